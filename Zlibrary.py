@@ -7,9 +7,12 @@ For more information, see:
 https://github.com/bipinkrish/Zlibrary-API/
 """
 import os
+import time
 
 import requests
 
+BASE_URL = "https://z-library.sk"  # https://z-library.sk https://1lib.sk
+
 
 class Zlibrary:
     def __init__(
@@ -18,14 +21,18 @@ class Zlibrary:
         password: str = None,
         remix_userid: [int, str] = None,
         remix_userkey: str = None,
+        router=None,
     ):
+        # router picks the proxy per request (choose(url) -> proxy or None,
+        # record(url, proxy, seconds or None)); without one the https_proxy
+        # environment variable is used for every request
+        self.__router = router
         self.__timeout = (5, 30)
         self.__email: str
         self.__name: str
         self.__kindle_email: str
         self.__remix_userid: [int, str]
         self.__remix_userkey: str
-        self.__domain = "z-library.sk" #z-library.sk 1lib.sk
 
         self.__loggedin = False
         self.__headers = {
@@ -37,13 +44,33 @@ class Zlibrary:
         self.__cookies = {
             "siteLanguageV2": "en",
         }
-        self.__proxies = {"http": proxy, "https": proxy} if (proxy := os.environ.get("https_proxy")) else None
+        self.__session = requests.Session()
 
         if email is not None and password is not None:
             self.login(email, password)
         elif remix_userid is not None and remix_userkey is not None:
             self.loginWithToken(remix_userid, remix_userkey)
 
+    def __proxy(self, url: str) -> [str, None]:
+        if self.__router is None:
+            return os.environ.get("https_proxy")
+        return self.__router.choose(url)
+
+    def __send(self, method: str, url: str, **payload) -> requests.Response:
+        proxy = self.__proxy(url)
+        # an explicit None keeps requests from falling back to the environment
+        payload["proxies"] = {"http": proxy, "https": proxy}
+        start = time.monotonic()
+        try:
+            response = self.__session.request(method, url, **payload)
+        except requests.RequestException:
+            if self.__router is not None:
+                self.__router.record(url, proxy, None)
+            raise
+        if self.__router is not None:
+            self.__router.record(url, proxy, time.monotonic() - start)
+        return response
+
     def __setValues(self, response) -> dict[str, str]:
         if not response["success"]:
             return response
@@ -102,13 +129,8 @@ class Zlibrary:
             "headers": self.__headers,
             "timeout": self.__timeout,
         }
-        if self.__proxies:
-            payload["proxies"] = self.__proxies
 
-        return requests.post(
-            "https://" + self.__domain + url,
-            **payload
-        ).json()
+        return self.__send("POST", BASE_URL + url, **payload).json()
 
     def __makeGetRequest(
         self, url: str, params: dict = {}, cookies=None
@@ -123,13 +145,8 @@ class Zlibrary:
             "headers": self.__headers,
             "timeout": self.__timeout,
         }
-        if self.__proxies:
-            payload["proxies"] = self.__proxies
 
-        return requests.get(
-            "https://" + self.__domain + url,
-            **payload
-        ).json()
+        return self.__send("GET", BASE_URL + url, **payload).json()
 
     def getProfile(self) -> dict[str, str]:
         return self.__makeGetRequest("/eapi/user/profile")
@@ -304,7 +321,7 @@ class Zlibrary:
         )
 
     def __getImageData(self, url: str) -> requests.Response.content:
-        res = requests.get(url, headers=self.__headers, timeout=self.__timeout)
+        res = self.__send("GET", url, headers=self.__headers, timeout=self.__timeout)
         if res.status_code == 200:
             return res.content
 
@@ -326,7 +343,7 @@ class Zlibrary:
         headers = self.__headers.copy()
         headers["authority"] = ddl.split("/")[2]
 
-        res = requests.get(ddl, headers=headers, timeout=300)
+        res = self.__send("GET", ddl, headers=headers, timeout=300)
         if res.status_code == 200:
             return filename, res.content
 
@@ -1,3 +1,5 @@
+from .extractors import mirrors
 from .extractors.download import get_information
 from .extractors.recent import get_recent_downloads
-from .extractors.search import search
+from .extractors.search import PARSER_ENGINES, parse_results, search, set_parser_engine
+from .utils import HTTPFailed, MirrorsUnavailable
@@ -1 +1,9 @@
-BASE_URL = "https://annas-archive.org"
+from ..utils import MirrorPool
+
+MIRRORS = [
+    "https://annas-archive.org",
+    "https://annas-archive.li",
+    "https://annas-archive.se",
+]
+
+mirrors = MirrorPool(MIRRORS)
@@ -5,7 +5,7 @@ from bs4 import NavigableString
 
 from ..models.data import URL, Download
 from ..utils import html_parser
-from . import BASE_URL
+from . import mirrors
 from .generic import extract_file_info, extract_publish_info
 
 
@@ -14,7 +14,7 @@ def remove_search_icon(s: str) -> str:
 
 
 def get_information(id: str) -> Download:
-    soup = html_parser(urljoin(BASE_URL, f"md5/{id}"))
+    soup, base_url = html_parser(mirrors, f"md5/{id}")
 
     def get_text(tag: str, cls: str):
         return soup.find(tag, class_=cls).text
@@ -30,7 +30,7 @@ def get_information(id: str) -> Download:
 
     # 提取下载链接并去重
     raw_links = [
-        parse_link(container)
+        parse_link(container, base_url)
         for container in soup.find_all("a", class_="js-download-link")
     ]
     download_links = list({(link.title, link.url): link for link in raw_links if link}.values())
@@ -48,10 +48,10 @@ def get_information(id: str) -> Download:
     )
 
 
-def parse_link(link: NavigableString) -> URL | None:
+def parse_link(link: NavigableString, base_url: str) -> URL | None:
     url = link.get("href")
     if url == "/datasets":
         return None
     elif url[0] == "/":
-        url = urljoin(BASE_URL, url[1:])
+        url = urljoin(base_url + "/", url[1:])
     return URL(html_unescape(link.text), url)
@@ -1,16 +1,11 @@
 from html import unescape as html_unescape
-from urllib.parse import urljoin
-
-from requests import get
 
 from ..models.data import RecentDownload
-from . import BASE_URL
-
-REQUEST_TIMEOUT = (5, 30)
+from . import mirrors
 
 
 def get_recent_downloads() -> list[RecentDownload]:
-    response = get(urljoin(BASE_URL, "dyn/recent_downloads"), timeout=REQUEST_TIMEOUT)
+    response, _ = mirrors.get("dyn/recent_downloads")
     data = response.json()
     return [
         RecentDownload(
@@ -1,30 +1,59 @@
 from html import unescape as html_unescape
-from urllib.parse import urljoin
 
-from bs4 import NavigableString
+from bs4 import BeautifulSoup, NavigableString
 
 from ..models.args import FileType, Language, OrderBy
 from ..models.data import SearchResult
-from ..utils import html_parser
-from . import BASE_URL
+from ..utils import fetch_html
+from . import mirrors, search_lxml
 from .generic import extract_file_info, extract_publish_info
 
+PARSER_ENGINES = ("bs4", "lxml")
+_parser_engine = "bs4"
+
+
+def set_parser_engine(engine: str):
+    global _parser_engine
+    if engine not in PARSER_ENGINES:
+        raise ValueError(f"unknown parser engine {engine!r}, expected one of {PARSER_ENGINES}")
+    _parser_engine = engine
+
+
+def get_parser_engine() -> str:
+    return _parser_engine
+
 
 def search(
     query: str,
     language: Language = Language.ANY,
     file_type: FileType = FileType.ANY,
     order_by: OrderBy = OrderBy.MOST_RELEVANT,
+    engine: str | None = None,
+    page: int = 1,
 ) -> list[SearchResult]:
     if not query.strip():
         raise ValueError("query can not be empty")
+    if page < 1:
+        raise ValueError("page must be a positive integer")
     params = {
         "q": query,
         "lang": language.value,
         "ext": file_type.value,
         "sort": order_by.value,
+        # the first page is requested without the parameter, like the website does
+        "page": page if page > 1 else None,
     }
-    soup = html_parser(urljoin(BASE_URL, "search"), params)
+    html, _ = fetch_html(mirrors, "search", params)
+    return parse_results(html, engine)
+
+
+def parse_results(html: str, engine: str | None = None) -> list[SearchResult]:
+    engine = engine or _parser_engine
+    if engine == "lxml":
+        return search_lxml.parse_results(html)
+    if engine != "bs4":
+        raise ValueError(f"unknown parser engine {engine!r}, expected one of {PARSER_ENGINES}")
+    soup = BeautifulSoup(html, "lxml")
     raw_results = soup.find_all("a", class_="js-vim-focus")
     return list(filter(lambda i: i is not None, map(parse_result, raw_results)))
 
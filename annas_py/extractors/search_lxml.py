@@ -0,0 +1,53 @@
+from html import unescape as html_unescape
+
+from lxml import etree, html as lxml_html
+
+from ..models.data import SearchResult
+from .generic import extract_file_info, extract_publish_info
+
+# XPath equivalents of the CSS selectors used by search.parse_result.
+# `div:nth-child(2) > div:nth-child(n)` counts every preceding sibling,
+# not only divs, so position is expressed with preceding-sibling::*.
+_RESULTS = etree.XPath("//a[contains(concat(' ', normalize-space(@class), ' '), ' js-vim-focus ')]")
+_TITLE = etree.XPath("(.//h3)[1]")
+_FILE_INFO = etree.XPath(".//div[count(preceding-sibling::*)=1]/div[count(preceding-sibling::*)=0]")
+_PUBLISH_INFO = etree.XPath(".//div[count(preceding-sibling::*)=1]/div[count(preceding-sibling::*)=2]")
+_AUTHORS = etree.XPath(".//div[count(preceding-sibling::*)=1]/div[count(preceding-sibling::*)=3]")
+_THUMBNAIL = etree.XPath("(.//img)[1]/@src")
+
+
+def _first_text(query: etree.XPath, element) -> str | None:
+    matches = query(element)
+    if not matches:
+        return None
+    return "".join(matches[0].itertext())
+
+
+def parse_results(html: str) -> list[SearchResult]:
+    root = lxml_html.document_fromstring(html)
+    return [result for result in map(parse_result, _RESULTS(root)) if result is not None]
+
+
+def parse_result(element) -> SearchResult | None:
+    title = _first_text(_TITLE, element)
+    if title is None:
+        return None
+    authors = _first_text(_AUTHORS, element)
+    publish_info = _first_text(_PUBLISH_INFO, element)
+    file_info = _first_text(_FILE_INFO, element)
+    if authors is None or publish_info is None or file_info is None:
+        raise AttributeError("search result is missing expected fields")
+    publisher, publish_date = extract_publish_info(publish_info)
+
+    thumbnail = _THUMBNAIL(element)
+    id = element.get("href").split("md5/")[-1]
+
+    return SearchResult(
+        id=id,
+        title=html_unescape(title.strip()),
+        authors=html_unescape(authors),
+        file_info=extract_file_info(file_info),
+        thumbnail=thumbnail[0] if thumbnail else None,
+        publisher=html_unescape(publisher) if publisher else None,
+        publish_date=publish_date,
+    )
@@ -1,19 +1,135 @@
+import threading
+import time
+
 from bs4 import BeautifulSoup, NavigableString
-from requests import get
+from requests import RequestException, Response, Session
 
 
 class HTTPFailed(Exception):
     pass
 
+
+class MirrorsUnavailable(HTTPFailed):
+    pass
+
 REQUEST_TIMEOUT = (5, 30)
+# one session for every mirror request, so connections are reused between searches
+SESSION = Session()
 
 
-def html_parser(url: str, params: dict = {}) -> NavigableString:
-    params = dict(filter(lambda i: i[1], params.items()))
-    response = get(url, params=params, timeout=REQUEST_TIMEOUT)
-    if response.status_code >= 400:
-        raise HTTPFailed(f"server returned http status {response.status_code}")
+class MirrorPool:
+    # Keeps every mirror's rolling latency and error rate and hands out
+    # the mirrors best-first; requests fail over to the next mirror on
+    # connection errors and server-side (5xx/429) statuses.
+    def __init__(self, mirrors: list[str], alpha: float = 0.3, error_penalty: float = 10.0):
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self._lock = threading.Lock()
+        self._latency: dict[str, float] = {}
+        self._error_rate: dict[str, float] = {}
+        self.router = None
+        self.set_mirrors(mirrors)
+
+    def set_mirrors(self, mirrors: list[str]):
+        mirrors = [m.strip().rstrip("/") for m in mirrors if m and m.strip()]
+        if not mirrors:
+            raise ValueError("at least one mirror is required")
+        with self._lock:
+            self.mirrors = mirrors
+
+    def set_router(self, router):
+        # router picks the proxy per request (choose(url) -> proxy or None,
+        # record(url, proxy, seconds or None)); without one requests
+        # follows the proxy environment variables
+        self.router = router
+
+    def _send(self, method: str, url: str, **kwargs) -> Response:
+        router = self.router
+        if router is None:
+            return SESSION.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+        proxy = router.choose(url)
+        start = time.monotonic()
+        try:
+            response = SESSION.request(
+                method, url, timeout=REQUEST_TIMEOUT, proxies={"http": proxy, "https": proxy}, **kwargs
+            )
+        except RequestException:
+            router.record(url, proxy, None)
+            raise
+        router.record(url, proxy, time.monotonic() - start)
+        return response
+
+    def score(self, mirror: str) -> float:
+        # unmeasured mirrors share one default score so configuration order
+        # decides among them
+        latency = self._latency.get(mirror, 2.0)
+        return latency + self._error_rate.get(mirror, 0.0) * self.error_penalty
+
+    def ranked(self) -> list[str]:
+        with self._lock:
+            return sorted(self.mirrors, key=self.score)
+
+    def record(self, mirror: str, latency: float | None, ok: bool):
+        with self._lock:
+            if latency is not None:
+                previous = self._latency.get(mirror)
+                self._latency[mirror] = (
+                    latency if previous is None else self.alpha * latency + (1 - self.alpha) * previous
+                )
+            previous_rate = self._error_rate.get(mirror, 0.0)
+            self._error_rate[mirror] = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * previous_rate
+
+    def get(self, path: str, params: dict | None = None) -> tuple[Response, str]:
+        errors = []
+        for mirror in self.ranked():
+            url = f"{mirror}/{path.lstrip('/')}"
+            start = time.monotonic()
+            try:
+                response = self._send("GET", url, params=params)
+            except RequestException as e:
+                self.record(mirror, None, ok=False)
+                errors.append(f"{mirror}: {e}")
+                continue
+            elapsed = time.monotonic() - start
+            if response.status_code >= 500 or response.status_code == 429:
+                self.record(mirror, elapsed, ok=False)
+                errors.append(f"{mirror}: http status {response.status_code}")
+                continue
+            self.record(mirror, elapsed, ok=True)
+            if response.status_code >= 400:
+                raise HTTPFailed(f"server returned http status {response.status_code}")
+            return response, mirror
+        raise MirrorsUnavailable("all mirrors failed: " + "; ".join(errors))
+
+    def warm(self) -> bool:
+        # open a connection to every mirror; only failures are recorded, a
+        # HEAD on the front page says little about search latency
+        reachable = False
+        for mirror in self.ranked():
+            try:
+                response = self._send("HEAD", mirror)
+            except RequestException:
+                self.record(mirror, None, ok=False)
+                continue
+            if response.status_code >= 500:
+                self.record(mirror, None, ok=False)
+            else:
+                reachable = True
+        return reachable
+
+
+def uncomment_html(html: str) -> str:
     # Uncomment code that would be dynamically rendered by JavaScript
-    html = response.text.replace("<!--", "").replace("-->", "")
+    return html.replace("<!--", "").replace("-->", "")
+
+
+def fetch_html(pool: MirrorPool, path: str, params: dict = {}) -> tuple[str, str]:
+    params = dict(filter(lambda i: i[1], params.items()))
+    response, mirror = pool.get(path, params)
+    return uncomment_html(response.text), mirror
+
+
+def html_parser(pool: MirrorPool, path: str, params: dict = {}) -> tuple[NavigableString, str]:
+    html, mirror = fetch_html(pool, path, params)
     soup = BeautifulSoup(html, "lxml")
-    return soup
+    return soup, mirror
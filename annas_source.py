@@ -1,77 +1,223 @@
 import asyncio
+import math
 
-from astrbot.api.all import Plain, Image, Node, logger
+from astrbot.api.all import Plain, Node, logger
 
+from data.plugins.astrbot_plugin_ebooks.annas_py import MirrorsUnavailable
 from data.plugins.astrbot_plugin_ebooks.annas_py import get_information as get_annas_information
+from data.plugins.astrbot_plugin_ebooks.annas_py import mirrors as annas_mirrors
 from data.plugins.astrbot_plugin_ebooks.annas_py import search as annas_search
-from data.plugins.astrbot_plugin_ebooks.annas_py.models.args import Language
-from data.plugins.astrbot_plugin_ebooks.utils import (
-    download_and_convert_to_base64,
-    is_base64_image,
-    is_url_accessible,
-    is_valid_annas_book_id,
-)
+from data.plugins.astrbot_plugin_ebooks.annas_py import set_parser_engine as set_annas_parser_engine
+from data.plugins.astrbot_plugin_ebooks.annas_py.models.args import FileType, Language, OrderBy
+from data.plugins.astrbot_plugin_ebooks.http_client import proxies
+from data.plugins.astrbot_plugin_ebooks.metrics import metrics
+from data.plugins.astrbot_plugin_ebooks.records import BookRecord, RecordPage
+from data.plugins.astrbot_plugin_ebooks.tracing import trace_tag, tracer
+from data.plugins.astrbot_plugin_ebooks.utils import TTLCache, is_valid_annas_book_id
+
+MAX_ANNAS_SEARCH_PAGES = 5
+
+
+def parse_annas_filters(options: list[str]):
+    """Classify free-form command options into Anna's Archive search filters.
+
+    Language codes, file extensions and sort orders never overlap, so the
+    options may be given in any order, e.g. ``epub en newest``.
+    Returns ``(language, file_type, order_by, unknown_options)``.
+    """
+    language, file_type, order_by = Language.ZH, FileType.ANY, OrderBy.MOST_RELEVANT
+    unknown = []
+    for option in options:
+        value = (option or "").strip().lower()
+        if not value:
+            continue
+        if value in ("any", "all"):
+            language = Language.ANY
+        elif value in {lang.value for lang in Language if lang.value}:
+            language = Language(value)
+        elif "." + value.lstrip(".") in {ext.value for ext in FileType if ext.value}:
+            file_type = FileType("." + value.lstrip("."))
+        elif value in {order.value for order in OrderBy if order.value}:
+            order_by = OrderBy(value)
+        else:
+            unknown.append(option)
+    return language, file_type, order_by, unknown
 
 
 class AnnasSource:
-    def __init__(self, config, proxy: str, max_results: int):
+    paginated = True
+
+    def __init__(self, config, max_results: int):
         self.config = config
-        self.proxy = proxy
         self.max_results = max_results
+        configured_mirrors = [
+            mirror for mirror in (self.config.get("annas_mirrors") or []) if isinstance(mirror, str) and mirror.strip()
+        ]
+        if configured_mirrors:
+            annas_mirrors.set_mirrors(configured_mirrors)
+        annas_mirrors.set_router(proxies)
+        try:
+            set_annas_parser_engine(self.config.get("annas_parser_engine", "lxml"))
+        except ValueError as e:
+            logger.warning(f"[Anna's Archive] {e}，使用默认解析引擎。")
+
+        self._details = TTLCache(maxsize=256, ttl=int(self.config.get("annas_detail_cache_ttl", 1800) or 0))
+        self._detail_tasks: dict[str, asyncio.Task] = {}
+
+    def _detail_task(self, book_id: str) -> asyncio.Task:
+        task = self._detail_tasks.get(book_id)
+        if task is None:
+            task = asyncio.create_task(self._fetch_information(book_id))
+            self._detail_tasks[book_id] = task
+            task.add_done_callback(lambda t: self._on_detail_fetched(book_id, t))
+        return task
+
+    async def _fetch_information(self, book_id: str):
+        with metrics.timer("Anna's Archive", "detail"):
+            return await asyncio.to_thread(get_annas_information, book_id)
+
+    def _on_detail_fetched(self, book_id: str, task: asyncio.Task):
+        self._detail_tasks.pop(book_id, None)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.debug(f"[Anna's Archive] 获取详情失败 {book_id}: {task.exception()}")
+        elif self._details.ttl > 0:
+            self._details.set(book_id, task.result())
+
+    async def _get_information(self, book_id: str):
+        """Return the parsed md5 detail page, served from cache or a shared in-flight fetch."""
+        cached = self._details.get(book_id)
+        if cached is not None:
+            metrics.cache_hit("Anna's Archive", "detail")
+            return cached
+        metrics.cache_miss("Anna's Archive", "detail")
+        return await asyncio.shield(self._detail_task(book_id))
+
+    def _prefetch_details(self, book_ids: list[str]):
+        """Speculatively warm the detail cache for the top search hits."""
+        for book_id in book_ids:
+            if book_id not in self._details:
+                self._detail_task(book_id)
+
+    async def _search_books(
+        self,
+        query: str,
+        limit: int,
+        language: Language,
+        file_type: FileType,
+        order_by: OrderBy,
+    ) -> tuple[list, int]:
+        """Fetch as many result pages as needed to fill ``limit``, concurrently after the first.
 
-    async def search_nodes(self, event, query: str, limit: int = 0):
+        Returns every parsed result of the fetched pages, which may be more
+        than ``limit``, and how many pages from the first were read without
+        a failure; a search continues after those.
+        """
+        with tracer.span("Anna's Archive/page 1"):
+            first_page = await asyncio.to_thread(
+                annas_search, query, language, file_type, order_by, page=1
+            )
+        books = list(first_page)
+        page_size = len(first_page)
+        if not page_size or len(books) >= limit:
+            return books, 1
+
+        extra_pages = min(math.ceil((limit - len(books)) / page_size), MAX_ANNAS_SEARCH_PAGES - 1)
+        with tracer.span(f"Anna's Archive/page 2-{1 + extra_pages}"):
+            pages = await asyncio.gather(
+                *[
+                    asyncio.to_thread(annas_search, query, language, file_type, order_by, page=page)
+                    for page in range(2, 2 + extra_pages)
+                ],
+                return_exceptions=True,
+            )
+
+        seen = {book.id for book in books}
+        pages_read, failed = 1, False
+        for page_number, page in enumerate(pages, 2):
+            if isinstance(page, Exception):
+                logger.warning(f"[Anna's Archive] 获取第 {page_number} 页结果失败: {page}")
+                failed = True
+                continue
+            if not failed:
+                pages_read = page_number
+            for book in page:
+                if book.id not in seen:
+                    seen.add(book.id)
+                    books.append(book)
+            if len(page) < page_size:
+                break
+        return books, pages_read
+
+    async def search_records(
+        self,
+        query: str,
+        limit: int = 0,
+        language: Language = Language.ZH,
+        file_type: FileType = FileType.ANY,
+        order_by: OrderBy = OrderBy.MOST_RELEVANT,
+        page: int = 1,
+    ):
+        """Return the books on a result page as records, or an error message string.
+
+        The first page is filled up to ``limit`` from following pages and
+        reports how many it read in ``RecordPage.pages``, so the next call
+        starts after them; later pages are a single upstream page. Every
+        parsed result is kept.
+        """
         if not self.config.get("enable_annas", False):
             return "[Anna's Archive] 功能未启用。"
 
-        if not await is_url_accessible("https://annas-archive.org", proxy=self.proxy):
-            return "[Anna's Archive] 无法连接到 Anna's Archive。"
-
         if not query:
             return "[Anna's Archive] 请提供电子书关键词以进行搜索。"
 
         if limit < 1:
             return "[Anna's Archive] 请确认搜索返回结果数量在 1-60 之间。"
 
-        try:
-            logger.info(f"[Anna's Archive] Received books search query: {query}, limit: {limit}")
-            results = annas_search(query, Language.ZH)
-            if not results or len(results) == 0:
-                return "[Anna's Archive] 未找到匹配的电子书。"
-
-            books = results[:limit]
-
-            async def construct_node(book):
-                chain = [Plain(f"{book.title}\n")]
-
-                if book.thumbnail:
-                    base64_image = await download_and_convert_to_base64(book.thumbnail, proxy=self.proxy)
-                    if base64_image and is_base64_image(base64_image):
-                        chain.append(Image.fromBase64(base64_image))
-                    else:
-                        chain.append(Plain("\n"))
-                else:
-                    chain.append(Plain("\n"))
-
-                chain.append(Plain(f"作者: {book.authors or '未知'}\n"))
-                chain.append(Plain(f"出版社: {book.publisher or '未知'}\n"))
-                chain.append(Plain(f"年份: {book.publish_date or '未知'}\n"))
-                language = book.file_info.language if book.file_info else "未知"
-                chain.append(Plain(f"语言: {language}\n"))
-                extension = book.file_info.extension if book.file_info else "未知"
-                chain.append(Plain(f"格式: {extension}\n"))
-                chain.append(Plain(f"ID: A{book.id}"))
-
-                return Node(
-                    uin=event.get_self_id(),
-                    name="Anna's Archive",
-                    content=chain,
+        with metrics.timer("Anna's Archive", "search") as timer:
+            try:
+                logger.info(
+                    f"[Anna's Archive] Received books search query: {query}, limit: {limit}, "
+                    f"language: {language.value or 'any'}, type: {file_type.value or 'any'}, "
+                    f"order: {order_by.value or 'relevant'}, page: {page}{trace_tag()}"
                 )
+                if page == 1:
+                    books, pages = await self._search_books(query, limit, language, file_type, order_by)
+                else:
+                    books = await asyncio.to_thread(annas_search, query, language, file_type, order_by, page=page)
+                    pages = 1
+                if not books:
+                    return "[Anna's Archive] 未找到匹配的电子书。"
 
-            tasks = [construct_node(book) for book in books]
-            return await asyncio.gather(*tasks)
-        except Exception as e:
-            logger.error(f"[Anna's Archive] Error during book search: {e}")
-            return "[Anna's Archive] 搜索电子书时发生错误，请稍后再试。"
+                prefetch_top_k = int(self.config.get("annas_prefetch_top_k", 0) or 0)
+                if prefetch_top_k > 0:
+                    self._prefetch_details([book.id for book in books[:prefetch_top_k]])
+
+                records = [
+                    BookRecord(
+                        "annas",
+                        (f"A{book.id}",),
+                        title=book.title,
+                        authors=book.authors,
+                        year=book.publish_date,
+                        publisher=book.publisher,
+                        language=book.file_info.language if book.file_info else "",
+                        extension=book.file_info.extension if book.file_info else "",
+                        filesize=book.file_info.size if book.file_info else "",
+                        cover=book.thumbnail,
+                    )
+                    for book in books
+                ]
+                return RecordPage(records, pages=pages)
+            except MirrorsUnavailable as e:
+                timer.fail()
+                logger.error(f"[Anna's Archive] 所有镜像均不可用: {e}")
+                return "[Anna's Archive] 无法连接到 Anna's Archive。"
+            except Exception as e:
+                timer.fail()
+                logger.error(f"[Anna's Archive] Error during book search: {e}{trace_tag()}")
+                return "[Anna's Archive] 搜索电子书时发生错误，请稍后再试。"
 
     async def download(self, event, book_id: str = None):
         if not self.config.get("enable_annas", False):
@@ -82,13 +228,13 @@ class AnnasSource:
 
         try:
             book_id = book_id.lstrip("A")
-            book_info = get_annas_information(book_id)
+            book_info = await self._get_information(book_id)
             urls = book_info.urls
 
             if not urls:
                 return [event.plain_result("[Anna's Archive] 未找到任何下载链接！")]
 
-            chain = [Plain("Anna's Archive\n目前无法直接下载电子书，可以通过访问下列链接手动下载：")]
+            chain = [Plain("Anna's Archive\n未能直接下载电子书，可以通过访问下列链接手动下载：")]
 
             fast_links = [url for url in urls if "Fast Partner Server" in url.title]
             if fast_links:
@@ -112,6 +258,17 @@ class AnnasSource:
 
             node = Node(uin=event.get_self_id(), name="Anna's Archive", content=chain)
             return [event.chain_result([node])]
+        except MirrorsUnavailable as e:
+            logger.error(f"[Anna's Archive] 所有镜像均不可用: {e}")
+            return [event.plain_result("[Anna's Archive] 无法连接到 Anna's Archive。")]
         except Exception as e:
             logger.error(f"[Anna's Archive] 下载失败：{e}")
             return [event.plain_result(f"[Anna's Archive] 下载电子书时发生错误，请稍后再试：{e}")]
+
+    async def warm(self) -> bool:
+        return await asyncio.to_thread(annas_mirrors.warm)
+
+    async def close(self):
+        for task in self._detail_tasks.values():
+            task.cancel()
+        self._detail_tasks.clear()
@@ -0,0 +1,81 @@
+"""Compare Anna's Archive search result parsing engines on saved pages.
+
+Usage:
+    python benchmarks/bench_annas_parse.py [--repeat 20] [--json]
+
+Both engines must produce identical ``SearchResult`` lists for every
+fixture; the script aborts otherwise so timings are never reported for a
+parser that has drifted.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from annas_py import PARSER_ENGINES, parse_results  # noqa: E402
+from annas_py.utils import uncomment_html  # noqa: E402
+
+FIXTURES_DIR = os.path.join(ROOT, "benchmarks", "fixtures")
+
+
+def load_fixtures() -> dict[str, str]:
+    pages = {}
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        if name.startswith("annas_search") and name.endswith(".html"):
+            with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+                pages[name] = uncomment_html(f.read())
+    return pages
+
+
+def time_engine(html: str, engine: str, repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse_results(html, engine)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    report = []
+    for name, html in load_fixtures().items():
+        reference = parse_results(html, PARSER_ENGINES[0])
+        for engine in PARSER_ENGINES[1:]:
+            if parse_results(html, engine) != reference:
+                sys.exit(f"{name}: engine {engine!r} output differs from {PARSER_ENGINES[0]!r}")
+
+        for engine in PARSER_ENGINES:
+            samples = sorted(time_engine(html, engine, args.repeat))
+            report.append(
+                {
+                    "fixture": name,
+                    "engine": engine,
+                    "results": len(reference),
+                    "min_ms": samples[0] * 1000,
+                    "median_ms": samples[len(samples) // 2] * 1000,
+                }
+            )
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{'fixture':<28} {'engine':<6} {'results':>7} {'min ms':>9} {'median ms':>10}")
+    for row in report:
+        print(
+            f"{row['fixture']:<28} {row['engine']:<6} {row['results']:>7} "
+            f"{row['min_ms']:>9.2f} {row['median_ms']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""Benchmark each source's search and /ebooks search against local stand-in upstreams.
+
+Usage (from the AstrBot root):
+    python data/plugins/astrbot_plugin_ebooks/benchmarks/bench_search.py \\
+        [--targets calibre,liber3,archive,zlib,annas,ebooks] [--concurrency 1,8,32] \\
+        [--requests 64] [--latency 50] [--jitter 20] [--error-rate 0.02] [--seed 0] \\
+        [--slow-rate 0.05 --slow-latency 3000] [--set enable_request_hedging=true] \\
+        [--json report.json] [--compare baseline.json]
+
+Every target is warmed up with one request, then ``--requests`` searches
+are issued by ``concurrency`` workers. The stand-ins run on their own loop
+in a background thread of the same process. The report lists throughput,
+latency percentiles, failures and the peak memory traced while the scenario
+ran, stand-ins included; ``--json`` also records the commit and arguments
+so reports from two commits can be put side by side with ``--compare``.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from importlib import import_module
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import (  # noqa: E402
+    ASTRBOT_ROOT,
+    PACKAGE,
+    QUERIES,
+    SOURCES,
+    BenchContext,
+    BenchEvent,
+    bench_config,
+    compare_rows,
+    percentile,
+    point_upstreams_at,
+    quiet_logs,
+    run_metadata,
+)
+from standins import StandInServer  # noqa: E402
+
+TARGETS = (*SOURCES, "ebooks")
+SOURCE_CLASSES = {
+    "calibre": "CalibreSource",
+    "liber3": "Liber3Source",
+    "archive": "ArchiveSource",
+    "zlib": "ZlibSource",
+    "annas": "AnnasSource",
+}
+
+
+def build_target(name: str, config, limit: int):
+    """Return an async ``search(index, query) -> bool`` for a source or the whole plugin."""
+    if name == "ebooks":
+        plugin = import_module(f"{PACKAGE}.main").ebooks(BenchContext(), config)
+
+        async def search_all(index: int, query: str) -> bool:
+            event = BenchEvent(f"bench:search:{index}")
+            responses = [response async for response in plugin.search_all_platforms(event, query, str(limit))]
+            return any(kind == "chain" for kind, _ in responses)
+
+        return search_all, plugin.terminate
+
+    downloads = None
+    if name != "annas":
+        cache = import_module(f"{PACKAGE}.download_cache").DownloadCache(os.path.abspath("cache"), max_bytes=1 << 30)
+        downloads = import_module(f"{PACKAGE}.download_manager").DownloadManager(os.path.abspath("."), cache)
+    source_class = getattr(import_module(f"{PACKAGE}.{name}_source"), SOURCE_CLASSES[name])
+    source = source_class(config, limit) if name == "annas" else source_class(config, limit, downloads)
+
+    async def search_source(index: int, query: str) -> bool:
+        return not isinstance(await source.search_records(query, limit), str)
+
+    return search_source, source.close
+
+
+async def run_scenario(search, requests: int, concurrency: int) -> dict:
+    latencies, failures = [], 0
+    issued = 0
+
+    async def worker():
+        nonlocal issued, failures
+        while issued < requests:
+            index = issued
+            issued += 1
+            started = time.perf_counter()
+            try:
+                ok = await search(index, QUERIES[index % len(QUERIES)])
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            failures += not ok
+
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+
+    return {
+        "requests": requests,
+        "failures": failures,
+        "seconds": elapsed,
+        "throughput": requests / elapsed,
+        **{f"p{q}_ms": percentile(latencies, q) * 1000 for q in (50, 90, 99)},
+        "max_ms": max(latencies) * 1000,
+        "peak_mb": (peak - baseline) / 1048576,
+    }
+
+
+async def run(args) -> list[dict]:
+    server = StandInServer(
+        args.latency / 1000, args.jitter / 1000, args.error_rate, args.seed, args.slow_rate, args.slow_latency / 1000
+    )
+    url = server.start_in_thread()
+    point_upstreams_at(url)
+    config = bench_config(url, **args.set)
+    # the plugin configures the shared HTTP layer in its __init__, single sources don't
+    http_client = import_module(f"{PACKAGE}.http_client")
+    http_client.hedging.configure(config.get("enable_request_hedging", False), config.get("hedge_budget_percent", 10))
+    http_client.limiter.configure(http_client.parse_rate_rules(config.get("rate_limits", [])))
+    http_client.proxies.configure(
+        config.get("proxy_pool", []), http_client.parse_proxy_rules(config.get("proxy_rules", []))
+    )
+    rows = []
+    try:
+        for name in args.targets:
+            search, close = build_target(name, config, args.limit)
+            try:
+                await search(-1, QUERIES[0])
+                for concurrency in args.concurrency:
+                    row = {"target": name, "concurrency": concurrency}
+                    row.update(await run_scenario(search, args.requests, concurrency))
+                    rows.append(row)
+                    if not args.json:
+                        print_row(row)
+            finally:
+                await close()
+    finally:
+        await http_client.close_session()
+        server.stop_thread()
+    return rows
+
+
+def print_header():
+    print(
+        f"{'target':<8} {'conc':>4} {'req':>5} {'fail':>4} {'req/s':>8} "
+        f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'peak MB':>8}"
+    )
+
+
+def print_row(row: dict):
+    print(
+        f"{row['target']:<8} {row['concurrency']:>4} {row['requests']:>5} {row['failures']:>4} "
+        f"{row['throughput']:>8.1f} {row['p50_ms']:>8.1f} {row['p90_ms']:>8.1f} {row['p99_ms']:>8.1f} "
+        f"{row['max_ms']:>8.1f} {row['peak_mb']:>8.2f}",
+        flush=True,
+    )
+
+
+def comma_list(kind):
+    return lambda value: [kind(item) for item in value.split(",") if item]
+
+
+def config_override(value: str) -> tuple:
+    key, _, raw = value.partition("=")
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        return key, raw
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--targets", type=comma_list(str), default=list(TARGETS))
+    parser.add_argument("--concurrency", type=comma_list(int), default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=64, help="searches per target and concurrency level")
+    parser.add_argument("--limit", type=int, default=20, help="results requested per search")
+    parser.add_argument("--latency", type=float, default=50, help="milliseconds added to every upstream response")
+    parser.add_argument("--jitter", type=float, default=20, help="up to this many extra milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream responses that are 503s")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of upstream responses delayed further")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="milliseconds added to the slow responses")
+    parser.add_argument(
+        "--set",
+        type=config_override,
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="override a plugin config value (JSON value), e.g. enable_request_hedging=true",
+    )
+    parser.add_argument("--verbose", action="store_true", help="keep the plugin's log output")
+    parser.add_argument("--json", metavar="PATH", help="write a machine-readable report")
+    parser.add_argument("--compare", metavar="PATH", help="compare against an earlier --json report")
+    args = parser.parse_args()
+    args.set = dict(args.set)
+    unknown = set(args.targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(sorted(unknown))}; choose from {', '.join(TARGETS)}")
+
+    args.json = args.json and os.path.abspath(args.json)
+    args.compare = args.compare and os.path.abspath(args.compare)
+    quiet_logs(args.verbose)
+    tracemalloc.start()
+    if not args.json:
+        print_header()
+    with tempfile.TemporaryDirectory() as workdir:
+        # the plugin keeps its temp files and download cache under the working directory
+        os.chdir(workdir)
+        try:
+            rows = asyncio.run(run(args))
+        finally:
+            os.chdir(ASTRBOT_ROOT)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"meta": run_metadata(args), "results": rows}, f, ensure_ascii=False, indent=2)
+        print_header()
+        for row in rows:
+            print_row(row)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nchange against {baseline['meta']['commit']}:")
+        for line in compare_rows(
+            rows, baseline["results"], ("target", "concurrency"), ("throughput", "p50_ms", "p99_ms", "peak_mb")
+        ):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
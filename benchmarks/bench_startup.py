@@ -0,0 +1,149 @@
+"""Benchmark how long the plugin takes to import and start, and what it imports.
+
+Usage (from the AstrBot root):
+    python data/plugins/astrbot_plugin_ebooks/benchmarks/bench_startup.py \\
+        [--runs 10] [--platforms calibre,liber3,archive,zlib,annas] \\
+        [--max-ms 50] [--json report.json] [--compare baseline.json]
+
+Each run is a fresh interpreter, so module caches don't carry over. AstrBot
+and aiohttp are imported first and not counted, since AstrBot has them
+loaded before any plugin. A run times importing ``main``, building the
+``ebooks`` Star with ``--platforms`` enabled, and then the first use of each
+enabled platform's source, which is when its module and dependencies are
+imported. No request is sent; the upstream URLs point at a closed port.
+
+The report gives the median and slowest run of each step and the heavy
+dependencies already imported once the Star is built. ``--max-ms`` exits
+non-zero when the median import plus start-up exceeds it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import (  # noqa: E402
+    ASTRBOT_ROOT,
+    PACKAGE,
+    SOURCES,
+    BenchContext,
+    bench_config,
+    compare_rows,
+    quiet_logs,
+    run_metadata,
+)
+
+HEAVY_MODULES = ("PIL", "bs4", "lxml", "requests", "aiofiles", f"{PACKAGE}.annas_py")
+UNREACHABLE_URL = "http://127.0.0.1:9"
+
+
+def loaded_heavy_modules() -> list[str]:
+    return [name.rsplit(".", 1)[-1] for name in HEAVY_MODULES if name in sys.modules]
+
+
+async def measure(platforms: list[str]) -> dict:
+    """Run in the child interpreter; returns the timings of one start-up in milliseconds."""
+    from importlib import import_module
+
+    import aiohttp  # noqa: F401
+    import astrbot.api.all  # noqa: F401
+
+    quiet_logs()
+    started = time.perf_counter()
+    main = import_module(f"{PACKAGE}.main")
+    imported = time.perf_counter()
+    overrides = {f"enable_{source}": source in platforms for source in SOURCES}
+    plugin = main.ebooks(BenchContext(), bench_config(UNREACHABLE_URL, **overrides))
+    built = time.perf_counter()
+    result = {
+        "import_ms": (imported - started) * 1000,
+        "init_ms": (built - imported) * 1000,
+        "heavy_modules": loaded_heavy_modules(),
+    }
+    for platform in platforms:
+        started = time.perf_counter()
+        plugin._get_source(platform)
+        result[f"{platform}_ms"] = (time.perf_counter() - started) * 1000
+    await plugin.terminate()
+    return result
+
+
+def run_child(platforms: list[str]) -> dict:
+    with tempfile.TemporaryDirectory() as workdir:
+        # the plugin creates its temp and cache directories under the working directory
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", "--platforms", ",".join(platforms)],
+            cwd=workdir,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def summarize(runs: list[dict], platforms: list[str]) -> list[dict]:
+    rows = []
+    for step in ("import", "init", *platforms):
+        values = [run[f"{step}_ms"] for run in runs]
+        rows.append({"step": step, "median_ms": statistics.median(values), "max_ms": max(values)})
+    totals = [run["import_ms"] + run["init_ms"] for run in runs]
+    rows.append({"step": "startup", "median_ms": statistics.median(totals), "max_ms": max(totals)})
+    return rows
+
+
+def comma_list(value: str) -> list[str]:
+    return [item for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--platforms", type=comma_list, default=list(SOURCES), help="platforms enabled in the config")
+    parser.add_argument("--max-ms", type=float, help="fail when the median import plus start-up takes longer")
+    parser.add_argument("--json", metavar="PATH", help="write a machine-readable report")
+    parser.add_argument("--compare", metavar="PATH", help="compare against an earlier --json report")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    unknown = set(args.platforms) - set(SOURCES)
+    if unknown:
+        parser.error(f"unknown platforms: {', '.join(sorted(unknown))}; choose from {', '.join(SOURCES)}")
+
+    if args.child:
+        print(json.dumps(asyncio.run(measure(args.platforms))))
+        return
+
+    args.json = args.json and os.path.abspath(args.json)
+    args.compare = args.compare and os.path.abspath(args.compare)
+    os.chdir(ASTRBOT_ROOT)
+    runs = [run_child(args.platforms) for _ in range(args.runs)]
+    rows = summarize(runs, args.platforms)
+    print(f"{'step':<10} {'median ms':>10} {'max ms':>10}")
+    for row in rows:
+        print(f"{row['step']:<10} {row['median_ms']:>10.1f} {row['max_ms']:>10.1f}")
+    heavy = sorted({name for run in runs for name in run["heavy_modules"]})
+    print(f"\nimported by start-up: {', '.join(heavy) or 'none'}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            report = {"meta": run_metadata(args), "results": rows, "heavy_modules": heavy}
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nchange against {baseline['meta']['commit']}:")
+        for line in compare_rows(rows, baseline["results"], ("step",), ("median_ms", "max_ms")):
+            print(line)
+
+    startup = rows[-1]["median_ms"]
+    if args.max_ms is not None and startup > args.max_ms:
+        sys.exit(f"start-up took {startup:.1f} ms, over the {args.max_ms:.0f} ms budget")
+
+
+if __name__ == "__main__":
+    main()
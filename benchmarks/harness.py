@@ -0,0 +1,157 @@
+"""Shared setup for the benchmarks that drive the plugin's own code.
+
+These benchmarks run inside an AstrBot checkout, because the plugin imports
+``astrbot.api`` and addresses its own modules as
+``data.plugins.astrbot_plugin_ebooks``; ``ASTRBOT_ROOT`` and this directory
+are put on ``sys.path`` on import.
+"""
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+from typing import Optional
+
+PLUGIN_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASTRBOT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(PLUGIN_ROOT)))
+PACKAGE = "data.plugins." + os.path.basename(PLUGIN_ROOT)
+for path in (ASTRBOT_ROOT, os.path.dirname(os.path.abspath(__file__))):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# the stand-ins are local; an inherited proxy would route around them
+for name in ("http_proxy", "https_proxy", "all_proxy", "HTTP_PROXY", "HTTPS_PROXY", "ALL_PROXY"):
+    os.environ.pop(name, None)
+
+SOURCES = ("calibre", "liber3", "archive", "zlib", "annas")
+QUERIES = ("python", "python crash course", "fluent python", "数据分析", "machine learning")
+
+
+class BenchConfig(dict):
+    """Stands in for AstrBotConfig, which is a dict that can save itself."""
+
+    def save_config(self):
+        pass
+
+
+class BenchContext:
+    """The plugin only hands its context to the download job queue, which sends messages through it."""
+
+    async def send_message(self, session, chain):
+        return True
+
+
+class BenchEvent:
+    """Just enough of AstrMessageEvent for the plugin's handlers.
+
+    Results are kept as ``(kind, payload)`` tuples; ``kind`` is ``"plain"`` or
+    ``"chain"``.
+    """
+
+    def __init__(self, session: str, message: str = "", admin: bool = False):
+        self.unified_msg_origin = session
+        self.message_str = message
+        self.admin = admin
+
+    def get_self_id(self) -> str:
+        return "bench"
+
+    def get_sender_id(self) -> str:
+        return self.unified_msg_origin
+
+    def is_admin(self) -> bool:
+        return self.admin
+
+    def plain_result(self, text: str):
+        return ("plain", text)
+
+    def chain_result(self, chain: list):
+        return ("chain", chain)
+
+
+def point_upstreams_at(url: str):
+    """Send every platform's requests to the stand-in server at ``url``."""
+    from importlib import import_module
+
+    import_module(f"{PACKAGE}.archive_source").ARCHIVE_URL = url
+    import_module(f"{PACKAGE}.liber3_source").LIBER3_API_URL = f"{url}/v1"
+    import_module(f"{PACKAGE}.zlib_source").ZLIB_URL = url
+    import_module(f"{PACKAGE}.Zlibrary").BASE_URL = url
+    import_module(f"{PACKAGE}.annas_py").mirrors.set_mirrors([url])
+
+
+def bench_config(url: str, **overrides) -> BenchConfig:
+    config = BenchConfig(
+        enable_calibre=True,
+        calibre_web_url=url,
+        enable_liber3=True,
+        enable_archive=True,
+        enable_zlib=True,
+        zlib_email="bench@example.com",
+        zlib_password="bench",
+        enable_annas=True,
+        annas_mirrors=[url],
+        annas_prefetch_top_k=0,
+        max_results=20,
+        enable_search_merge=True,
+        enable_merge_forward=False,
+        enable_download_jobs=False,
+        enable_tracing=False,
+    )
+    config.update(overrides)
+    return config
+
+
+def quiet_logs(verbose: bool = False):
+    """Silence the plugin's logs, which injected errors would otherwise flood, unless ``verbose``."""
+    from astrbot.api.all import logger
+
+    logger.setLevel(logging.DEBUG if verbose else logging.CRITICAL)
+    logging.getLogger("urllib3").setLevel(logging.DEBUG if verbose else logging.WARNING)
+
+
+def percentile(samples: list[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile, matching ``metrics.StageMetrics.percentile``."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def run_metadata(args) -> dict:
+    """Describe the run so reports from different commits can be lined up."""
+
+    def git(*command) -> str:
+        try:
+            return subprocess.run(
+                ["git", "-C", PLUGIN_ROOT, *command], capture_output=True, text=True, timeout=10
+            ).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+
+    return {
+        "commit": git("rev-parse", "--short", "HEAD") or "unknown",
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+    }
+
+
+def compare_rows(rows: list[dict], baseline: list[dict], key: tuple, fields: tuple) -> list[str]:
+    """Render the relative change of ``fields`` for rows present in both reports."""
+    previous = {tuple(row[k] for k in key): row for row in baseline}
+    lines = []
+    for row in rows:
+        old = previous.get(tuple(row[k] for k in key))
+        if old is None:
+            continue
+        changes = []
+        for field in fields:
+            if row.get(field) is None or not old.get(field):
+                continue
+            changes.append(f"{field} {(row[field] - old[field]) / old[field]:+.1%}")
+        lines.append(f"{' '.join(str(row[k]) for k in key)}: {', '.join(changes)}")
+    return lines
@@ -0,0 +1,315 @@
+"""Load-test the plugin's command handlers with many simulated chats.
+
+Usage (from the AstrBot root):
+    python data/plugins/astrbot_plugin_ebooks/benchmarks/load_test.py \\
+        [--stages 1,10,25,50] [--stage-seconds 20] [--think-time 1] \\
+        [--latency 150] [--jitter 100] [--error-rate 0.02] [--seed 0] \\
+        [--json report.json] [--compare baseline.json]
+
+The ``ebooks`` Star is built as AstrBot would build it and its handlers are
+called with fake events against the local stand-in upstreams. Each stage
+raises the number of chats; every chat sends a command, waits for all of
+its replies, thinks for a while and sends the next one. Commands are drawn
+from ``WORKLOAD``, and a chat only pages after it has searched.
+
+Every ``--sample-interval`` seconds the timeline records the active chats,
+event-loop lag, connections open to the stand-ins, open file descriptors
+and RSS. The JSON report carries the per-stage latency percentiles, the
+timeline and the call sites that blocked the loop, and ``--compare`` shows
+the per-stage change against an earlier report.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import (  # noqa: E402
+    ASTRBOT_ROOT,
+    PACKAGE,
+    QUERIES,
+    BenchContext,
+    BenchEvent,
+    bench_config,
+    compare_rows,
+    percentile,
+    point_upstreams_at,
+    quiet_logs,
+    run_metadata,
+)
+from standins import StandInServer  # noqa: E402
+
+# (weight, command); "next" falls back to a search for a chat that hasn't searched yet
+WORKLOAD = (
+    (60, "ebooks search"),
+    (25, "ebooks next"),
+    (3, "liber3 search"),
+    (3, "archive search"),
+    (3, "zlib search"),
+    (3, "annas search"),
+    (3, "calibre search"),
+)
+
+
+def process_stats(port: int) -> dict:
+    """Open connections to the stand-ins, open file descriptors and RSS of this process.
+
+    Uses psutil when it is installed and falls back to /proc, so on other
+    systems without psutil the values are ``None``.
+    """
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+
+    if psutil is not None:
+        process = psutil.Process()
+        # net_connections() replaced connections() in psutil 6
+        list_connections = getattr(process, "net_connections", None) or process.connections
+        connections = [
+            c for c in list_connections(kind="tcp")
+            if c.raddr and c.raddr.port == port and c.status == psutil.CONN_ESTABLISHED
+        ]
+        return {
+            "connections": len(connections),
+            "fds": process.num_fds() if hasattr(process, "num_fds") else None,
+            "rss_mb": process.memory_info().rss / 1048576,
+        }
+
+    stats = {"connections": None, "fds": None, "rss_mb": None}
+    try:
+        stats["fds"] = len(os.listdir("/proc/self/fd"))
+        with open("/proc/self/statm") as f:
+            stats["rss_mb"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576
+        # the stand-ins live in this process, so every established socket to their port is ours
+        connections = 0
+        for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+            if os.path.exists(table):
+                with open(table) as f:
+                    for line in f.readlines()[1:]:
+                        fields = line.split()
+                        if int(fields[2].rsplit(":", 1)[1], 16) == port and fields[3] == "01":
+                            connections += 1
+        stats["connections"] = connections
+    except (OSError, ValueError, IndexError):
+        pass
+    return stats
+
+
+class LoadTest:
+    def __init__(self, plugin, args, port: int, watchdog):
+        self.plugin = plugin
+        self.args = args
+        self.port = port
+        self.watchdog = watchdog
+        self.random = random.Random(args.seed)
+        self.stage = 0
+        self.latencies: list[dict[str, list[float]]] = [{} for _ in args.stages]
+        self.failures = [0] * len(args.stages)
+        self.timeline: list[dict] = []
+        self.searched: set[str] = set()
+        self.stopping = False
+
+    def pick_command(self, chat: str) -> str:
+        weights, commands = zip(*WORKLOAD)
+        command = self.random.choices(commands, weights)[0]
+        if command == "ebooks next" and chat not in self.searched:
+            command = "ebooks search"
+        return command
+
+    async def send(self, chat: str, command: str) -> bool:
+        event = BenchEvent(chat, message=command)
+        query = self.random.choice(QUERIES)
+        limit = str(self.args.limit)
+        handlers = {
+            "ebooks search": lambda: self.plugin.search_all_platforms(event, query, limit),
+            "ebooks next": lambda: self.plugin.next_result_page(event),
+            "liber3 search": lambda: self.plugin.search_liber3(event, query, limit),
+            "archive search": lambda: self.plugin.search_archive(event, query, limit),
+            "zlib search": lambda: self.plugin.search_zlib(event, query, limit),
+            "annas search": lambda: self.plugin.search_annas(event, query, limit),
+            "calibre search": lambda: self.plugin.search_calibre(event, query, limit),
+        }
+        responses = [response async for response in handlers[command]()]
+        if command == "ebooks search":
+            self.searched.add(chat)
+        return any(kind == "chain" for kind, _ in responses)
+
+    async def chat(self, chat: str):
+        # stagger the first command so a stage doesn't start with a thundering herd
+        await asyncio.sleep(self.random.random() * self.args.think_time)
+        while not self.stopping:
+            stage = self.stage
+            command = self.pick_command(chat)
+            started = time.perf_counter()
+            try:
+                ok = await self.send(chat, command)
+            except Exception:
+                ok = False
+            self.latencies[stage].setdefault(command, []).append(time.perf_counter() - started)
+            self.failures[stage] += not ok
+            await asyncio.sleep(self.args.think_time * (0.5 + self.random.random()))
+
+    async def sample(self, started: float, chats: list):
+        beats = self.watchdog.beats
+        while not self.stopping:
+            await asyncio.sleep(self.args.sample_interval)
+            new_beats, beats = self.watchdog.beats - beats, self.watchdog.beats
+            lags = list(self.watchdog.lags)[-new_beats:] if new_beats else []
+            self.timeline.append(
+                {
+                    "t": round(time.perf_counter() - started, 2),
+                    "stage": self.stage,
+                    "chats": len(chats),
+                    "lag_p50_ms": (percentile(lags, 50) or 0) * 1000,
+                    "lag_max_ms": max(lags, default=0) * 1000,
+                    **process_stats(self.port),
+                }
+            )
+
+    async def run(self):
+        chats: list[asyncio.Task] = []
+        started = time.perf_counter()
+        sampler = asyncio.create_task(self.sample(started, chats))
+        for stage, concurrency in enumerate(self.args.stages):
+            self.stage = stage
+            while len(chats) < concurrency:
+                chats.append(asyncio.create_task(self.chat(f"bench:chat:{len(chats)}")))
+            print(f"stage {stage + 1}/{len(self.args.stages)}: {concurrency} chats", flush=True)
+            await asyncio.sleep(self.args.stage_seconds)
+        self.stopping = True
+        await asyncio.gather(*chats, return_exceptions=True)
+        await sampler
+
+    def stage_rows(self) -> list[dict]:
+        rows = []
+        for stage, concurrency in enumerate(self.args.stages):
+            latencies = self.latencies[stage]
+            everything = [value for values in latencies.values() for value in values]
+            row = {
+                "concurrency": concurrency,
+                "commands": len(everything),
+                "failures": self.failures[stage],
+                "throughput": len(everything) / self.args.stage_seconds,
+            }
+            for q in (50, 90, 99):
+                value = percentile(everything, q)
+                row[f"p{q}_ms"] = value * 1000 if value is not None else None
+            row["by_command"] = {
+                command: {
+                    "count": len(values),
+                    "p50_ms": percentile(values, 50) * 1000,
+                    "p99_ms": percentile(values, 99) * 1000,
+                }
+                for command, values in sorted(latencies.items())
+            }
+            samples = [point for point in self.timeline if point["stage"] == stage]
+            row["lag_max_ms"] = max((point["lag_max_ms"] for point in samples), default=None)
+            for field in ("connections", "fds", "rss_mb"):
+                values = [point[field] for point in samples if point[field] is not None]
+                row[f"{field}_max"] = max(values, default=None)
+            rows.append(row)
+        return rows
+
+
+def _fmt(value: Optional[float], spec: str = ".0f") -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def print_report(rows: list[dict], watchdog):
+    print(
+        f"\n{'chats':>5} {'cmds':>6} {'fail':>5} {'cmd/s':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+        f"{'lag ms':>7} {'conns':>6} {'fds':>5} {'rss MB':>7}"
+    )
+    for row in rows:
+        print(
+            f"{row['concurrency']:>5} {row['commands']:>6} {row['failures']:>5} {row['throughput']:>7.1f} "
+            f"{_fmt(row['p50_ms']):>8} {_fmt(row['p90_ms']):>8} {_fmt(row['p99_ms']):>8} "
+            f"{_fmt(row['lag_max_ms']):>7} {_fmt(row['connections_max']):>6} {_fmt(row['fds_max']):>5} "
+            f"{_fmt(row['rss_mb_max'], '.1f'):>7}"
+        )
+    blocking = watchdog.summary_lines()
+    if blocking:
+        print("\n" + "\n".join(blocking))
+
+
+async def main_async(args) -> tuple[list[dict], list[dict], list[str]]:
+    from importlib import import_module
+
+    server = StandInServer(args.latency / 1000, args.jitter / 1000, args.error_rate, args.seed)
+    url = server.start_in_thread()
+    port = int(url.rsplit(":", 1)[1])
+    point_upstreams_at(url)
+    watchdog = import_module(f"{PACKAGE}.loop_watchdog").LoopWatchdog(threshold=args.block_threshold / 1000)
+    watchdog.start()
+    plugin = import_module(f"{PACKAGE}.main").ebooks(BenchContext(), bench_config(url, max_results=args.limit))
+    try:
+        load_test = LoadTest(plugin, args, port, watchdog)
+        await load_test.run()
+        rows = load_test.stage_rows()
+        print_report(rows, watchdog)
+        return rows, load_test.timeline, watchdog.summary_lines()
+    finally:
+        await plugin.terminate()
+        await watchdog.stop()
+        server.stop_thread()
+
+
+def comma_list(kind):
+    return lambda value: [kind(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stages", type=comma_list(int), default=[1, 10, 25, 50], help="chats in each stage")
+    parser.add_argument("--stage-seconds", type=float, default=20)
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean seconds a chat waits between commands")
+    parser.add_argument("--limit", type=int, default=10, help="results per search and page")
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--block-threshold", type=float, default=100, help="milliseconds of loop lag counted as blocking")
+    parser.add_argument("--latency", type=float, default=150, help="milliseconds added to every upstream response")
+    parser.add_argument("--jitter", type=float, default=100, help="up to this many extra milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream responses that are 503s")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="keep the plugin's log output")
+    parser.add_argument("--json", metavar="PATH", help="write a machine-readable report")
+    parser.add_argument("--compare", metavar="PATH", help="compare against an earlier --json report")
+    args = parser.parse_args()
+    args.json = args.json and os.path.abspath(args.json)
+    args.compare = args.compare and os.path.abspath(args.compare)
+
+    quiet_logs(args.verbose)
+    with tempfile.TemporaryDirectory() as workdir:
+        # the plugin keeps its temp files and download cache under the working directory
+        os.chdir(workdir)
+        try:
+            rows, timeline, blocking = asyncio.run(main_async(args))
+        finally:
+            os.chdir(ASTRBOT_ROOT)
+
+    if args.json:
+        report = {"meta": run_metadata(args), "stages": rows, "timeline": timeline, "blocking": blocking}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"report written to {args.json}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nchange against {baseline['meta']['commit']}:")
+        for line in compare_rows(
+            rows,
+            baseline["stages"],
+            ("concurrency",),
+            ("throughput", "p50_ms", "p99_ms", "lag_max_ms", "connections_max", "fds_max", "rss_mb_max"),
+        ):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""A local aiohttp server standing in for every upstream the plugin talks to.
+
+One server answers for all platforms, since their paths don't collide:
+
+    Calibre-Web   GET  /opds/search/{query}, /opds/cover/{id}
+    archive.org   GET  /advancedsearch.php, /metadata/{identifier}, /services/img/{identifier}
+    Liber3        POST /v1/searchV2, /v1/book
+    Z-Library     POST /eapi/user/login, /eapi/book/search; GET /eapi/user/profile
+    Anna's        GET  /search, /md5/{id}
+    covers        GET  /covers/{name}
+
+Responses come from the recorded fixtures in ``benchmarks/fixtures``. Every
+request waits ``latency`` seconds (plus up to ``jitter``), with probability
+``slow_rate`` another ``slow_latency`` to give a long tail, and fails with a
+503 with probability ``error_rate``; all are drawn from a seeded generator
+so a run can be repeated exactly.
+"""
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import threading
+from typing import Optional
+
+from aiohttp import web
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+UPSTREAMS = ("calibre", "archive", "liber3", "zlib", "annas", "covers")
+
+_UPSTREAM_PREFIXES = (
+    ("/opds/", "calibre"),
+    ("/advancedsearch.php", "archive"),
+    ("/metadata/", "archive"),
+    ("/services/", "archive"),
+    ("/v1/", "liber3"),
+    ("/eapi/", "zlib"),
+    ("/search", "annas"),
+    ("/md5/", "annas"),
+    ("/covers/", "covers"),
+)
+_ANNAS_THUMBNAIL = re.compile(r'src="https?://[^"]+/([^"/]+)"')
+
+
+def load_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def make_cover(width: int = 120, height: int = 180) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (96, 120, 160)).save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+def upstream_of(path: str) -> Optional[str]:
+    for prefix, upstream in _UPSTREAM_PREFIXES:
+        if path.startswith(prefix):
+            return upstream
+    return None
+
+
+class StandInServer:
+    """Serve the fixtures on ``127.0.0.1`` with injected latency and errors.
+
+    ``latency``, ``jitter``, ``slow_rate``, ``slow_latency`` and ``error_rate``
+    apply to every upstream unless ``overrides`` maps an upstream name to its
+    own ``{"latency": ..., ...}``.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        slow_rate: float = 0.0,
+        slow_latency: float = 0.0,
+        overrides: Optional[dict[str, dict]] = None,
+        annas_fixture: str = "annas_search_large.html",
+        port: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.overrides = overrides or {}
+        self.random = random.Random(seed)
+        self.annas_fixture = annas_fixture
+        self.port = port
+        self.requests: dict[str, int] = {upstream: 0 for upstream in UPSTREAMS}
+        self.errors: dict[str, int] = {upstream: 0 for upstream in UPSTREAMS}
+        self.url = ""
+        self._runner: Optional[web.AppRunner] = None
+
+    def _setting(self, upstream: str, name: str) -> float:
+        return self.overrides.get(upstream, {}).get(name, getattr(self, name))
+
+    @web.middleware
+    async def _inject(self, request: web.Request, handler):
+        upstream = upstream_of(request.path)
+        if upstream is None:
+            return await handler(request)
+        self.requests[upstream] += 1
+        delay = self._setting(upstream, "latency") + self.random.random() * self._setting(upstream, "jitter")
+        if self.random.random() < self._setting(upstream, "slow_rate"):
+            delay += self._setting(upstream, "slow_latency")
+        failed = self.random.random() < self._setting(upstream, "error_rate")
+        await asyncio.sleep(delay)
+        if failed:
+            self.errors[upstream] += 1
+            return web.Response(status=503, text="injected error")
+        try:
+            return await handler(request)
+        except ConnectionResetError:
+            # the client cancelled the request (e.g. a hedged duplicate lost) before its body arrived
+            return web.Response(status=499)
+
+    def _load(self):
+        base = self.url
+        self.cover = make_cover()
+        self.calibre_feed = load_fixture("calibre_opds.xml")
+        self.archive_search = json.loads(load_fixture("archive_search.json"))
+        self.archive_metadata = json.loads(load_fixture("archive_metadata.json"))
+        self.liber3_search = load_fixture("liber3_search.json")
+        self.liber3_books = json.loads(load_fixture("liber3_book.json"))["data"]["book"]
+        self.zlib_search = load_fixture("zlib_search.json").replace("{base_url}", base)
+        self.annas_search = _ANNAS_THUMBNAIL.sub(
+            lambda m: f'src="{base}/covers/{m.group(1)}"', load_fixture(self.annas_fixture)
+        )
+
+    async def start(self) -> str:
+        app = web.Application(middlewares=[self._inject])
+        app.router.add_get("/", self.root)
+        app.router.add_get("/opds/search/{query:.*}", self.calibre_search)
+        app.router.add_get("/opds/cover/{id}", self.image)
+        app.router.add_get("/advancedsearch.php", self.archive_advancedsearch)
+        app.router.add_get("/metadata/{identifier}", self.archive_item)
+        app.router.add_get("/services/img/{identifier}", self.image)
+        app.router.add_post("/v1/searchV2", self.liber3_search_books)
+        app.router.add_post("/v1/book", self.liber3_details)
+        app.router.add_post("/eapi/user/login", self.zlib_login)
+        app.router.add_get("/eapi/user/profile", self.zlib_login)
+        app.router.add_post("/eapi/book/search", self.zlib_search_books)
+        app.router.add_get("/search", self.annas_search_page)
+        app.router.add_get("/md5/{id}", self.not_found)
+        app.router.add_get("/covers/{name}", self.image)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        self._load()
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def start_in_thread(self) -> str:
+        """Serve from a background thread with its own event loop.
+
+        Z-Library's client makes blocking ``requests`` calls on the caller's
+        loop, which would deadlock against a server sharing that loop.
+        """
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+        self._thread = threading.Thread(target=serve, name="ebooks-standins", daemon=True)
+        self._loop = loop
+        self._thread.start()
+        started.wait()
+        return self.url
+
+    def stop_thread(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def root(self, request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def not_found(self, request: web.Request) -> web.Response:
+        return web.Response(status=404)
+
+    async def image(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.cover, content_type="image/jpeg")
+
+    async def calibre_search(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.calibre_feed, content_type="application/atom+xml")
+
+    async def archive_advancedsearch(self, request: web.Request) -> web.Response:
+        rows = int(request.query.get("rows", 50))
+        page = int(request.query.get("page", 1))
+        docs = self.archive_search["response"]["docs"]
+        start = (page - 1) * rows
+        payload = dict(self.archive_search)
+        payload["response"] = {"numFound": len(docs), "start": start, "docs": docs[start : start + rows]}
+        return web.json_response(payload)
+
+    async def archive_item(self, request: web.Request) -> web.Response:
+        return web.json_response(self.archive_metadata.get(request.match_info["identifier"], {}))
+
+    async def liber3_search_books(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.liber3_search, content_type="application/json")
+
+    async def liber3_details(self, request: web.Request) -> web.Response:
+        book_ids = (await request.json()).get("book_ids", [])
+        books = {book_id: self.liber3_books[book_id] for book_id in book_ids if book_id in self.liber3_books}
+        return web.json_response({"data": {"book": books}})
+
+    async def zlib_login(self, request: web.Request) -> web.Response:
+        user = {"id": 1, "email": "bench@example.com", "name": "bench", "kindle_email": "", "remix_userkey": "key"}
+        return web.json_response({"success": 1, "user": user})
+
+    async def zlib_search_books(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.zlib_search, content_type="application/json")
+
+    async def annas_search_page(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.annas_search, content_type="text/html")
+
+
+async def _serve(args):
+    server = StandInServer(args.latency / 1000, args.jitter / 1000, args.error_rate, args.seed, port=args.port)
+    print(f"serving stand-ins on {await server.start()}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the upstream stand-ins on their own, e.g. in another process.")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=50, help="milliseconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0, help="up to this many extra milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
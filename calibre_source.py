@@ -1,42 +1,44 @@
-import asyncio
 import random
 import re
 import xml.etree.ElementTree as ET
 from datetime import datetime
-from urllib.parse import quote_plus, urljoin, unquote
+from urllib.parse import quote_plus, urljoin
 
-from astrbot.api.all import Plain, Image, Node, Nodes, File, logger
-from data.plugins.astrbot_plugin_ebooks.utils import (
-    SharedSession,
-    download_and_convert_to_base64,
-    is_base64_image,
-    is_valid_calibre_book_url,
-)
+from astrbot.api.all import Plain, Node, Nodes, File, logger
+from data.plugins.astrbot_plugin_ebooks.download_manager import DownloadError, DownloadManager, url_host
+from data.plugins.astrbot_plugin_ebooks.http_client import preconnect, proxies
+from data.plugins.astrbot_plugin_ebooks.metrics import metrics
+from data.plugins.astrbot_plugin_ebooks.records import BookRecord, render_nodes
+from data.plugins.astrbot_plugin_ebooks.tracing import trace_tag, tracer
+from data.plugins.astrbot_plugin_ebooks.utils import SharedSession, is_valid_calibre_book_url
 
 
 class CalibreSource(SharedSession):
-    def __init__(self, config, proxy: str, max_results: int):
-        super().__init__(proxy)
+    paginated = False
+
+    def __init__(self, config, max_results: int, downloads: DownloadManager):
         self.config = config
         self.max_results = max_results
+        self.downloads = downloads
 
     async def _search_calibre_web(self, query: str, limit: int = None):
         calibre_web_url = self.config.get("calibre_web_url", "http://127.0.0.1:8083")
         search_url = f"{calibre_web_url}/opds/search/{query}"
 
         session = await self.get_session()
-        async with session.get(search_url, proxy=self.proxy) as response:
-            if response.status == 200:
-                content_type = response.headers.get("Content-Type", "")
-                if "application/atom+xml" in content_type:
-                    data = await response.text()
-                    return self._parse_opds_response(data, limit)
-                logger.error(f"[Calibre-Web] Unexpected content type: {content_type}")
-            else:
-                logger.error(
-                    f"[Calibre-Web] Error during search: Calibre-Web returned status code {response.status}"
-                )
-            return None
+        with tracer.span("Calibre-Web/opds"):
+            async with session.get(search_url, proxy=proxies.choose(search_url)) as response:
+                if response.status == 200:
+                    content_type = response.headers.get("Content-Type", "")
+                    if "application/atom+xml" in content_type:
+                        data = await response.text()
+                        return self._parse_opds_response(data, limit)
+                    logger.error(f"[Calibre-Web] Unexpected content type: {content_type}")
+                else:
+                    logger.error(
+                        f"[Calibre-Web] Error during search: Calibre-Web returned status code {response.status}"
+                    )
+                return None
 
     def _parse_opds_response(self, xml_data: str, limit: int = None):
         calibre_web_url = self.config.get("calibre_web_url", "http://127.0.0.1:8083")
@@ -129,43 +131,24 @@ class CalibreSource(SharedSession):
             logger.error(f"[Calibre-Web] Error parsing OPDS response: {e}")
             return None
 
-    async def _build_book_chain(self, item: dict) -> list:
-        chain = [Plain(f"{item['title']}")]
-        if item.get("cover_link"):
-            base64_image = await download_and_convert_to_base64(item["cover_link"], proxy=self.proxy)
-            if is_base64_image(base64_image):
-                chain.append(Image.fromBase64(base64_image))
-        else:
-            chain.append(Plain("\n"))
-        chain.append(Plain(f"作者: {item.get('authors', '未知')}\n"))
-        chain.append(Plain(f"年份: {item.get('year', '未知')}\n"))
-        chain.append(Plain(f"出版社: {item.get('publisher', '未知')}\n"))
-        description = item.get("summary", "")
-        if isinstance(description, str) and description != "":
-            description = description.strip()
-            description = description[:150] + "..." if len(description) > 150 else description
-        else:
-            description = "无简介"
-        chain.append(Plain(f"简介: {description}\n"))
-        chain.append(Plain(f"链接(用于下载): {item.get('download_link', '未知')}"))
-        return chain
-
-    async def _convert_calibre_results_to_nodes(self, event, results: list):
-        if not results:
-            return "[Calibre-Web] 未找到匹配的电子书。"
-
-        async def construct_node(book):
-            chain = await self._build_book_chain(book)
-            return Node(
-                uin=event.get_self_id(),
-                name="Calibre-Web",
-                content=chain,
-            )
-
-        tasks = [construct_node(book) for book in results]
-        return await asyncio.gather(*tasks)
-
-    async def search_nodes(self, event, query: str, limit: str|int = ""):
+    def _to_record(self, item: dict) -> BookRecord:
+        format_match = re.search(r"/opds/download/\d+/(\w+)/$", item.get("download_link", ""))
+        return BookRecord(
+            "calibre",
+            (item.get("download_link", ""),),
+            title=item.get("title"),
+            authors=item.get("authors"),
+            year=item.get("year"),
+            publisher=item.get("publisher"),
+            language=item.get("language"),
+            extension=format_match.group(1) if format_match else "",
+            filesize=item.get("file_size"),
+            description=item.get("summary"),
+            cover=item.get("cover_link"),
+        )
+
+    async def search_records(self, query: str, limit: str|int = ""):
+        """Return the matching books as records, or an error message string."""
         if not self.config.get("enable_calibre", False):
             return "[Calibre-Web] 功能未启用。"
 
@@ -176,17 +159,19 @@ class CalibreSource(SharedSession):
         if not (1 <= limit <= 100):
             return "[Calibre-Web] 请确认搜索返回结果数量在 1-100 之间。"
 
-        try:
-            logger.info(f"[Calibre-Web] Received books search query: {query}, limit: {limit}")
-            results = await self._search_calibre_web(quote_plus(query), limit)
-            if not results or len(results) == 0:
-                return "[Calibre-Web] 未找到匹配的电子书。"
-            return await self._convert_calibre_results_to_nodes(event, results)
-        except Exception as e:
-            logger.error(f"[Calibre-Web] 搜索失败: {e}")
-            return "[Calibre-Web] 搜索电子书时发生错误，请稍后再试。"
-
-    async def download(self, event, book_url: str = None):
+        with metrics.timer("Calibre-Web", "search") as timer:
+            try:
+                logger.info(f"[Calibre-Web] Received books search query: {query}, limit: {limit}{trace_tag()}")
+                results = await self._search_calibre_web(quote_plus(query), limit)
+                if not results or len(results) == 0:
+                    return "[Calibre-Web] 未找到匹配的电子书。"
+                return [self._to_record(item) for item in results]
+            except Exception as e:
+                timer.fail()
+                logger.error(f"[Calibre-Web] 搜索失败: {e}{trace_tag()}")
+                return "[Calibre-Web] 搜索电子书时发生错误，请稍后再试。"
+
+    async def download(self, event, book_url: str = None, progress=None):
         if not self.config.get("enable_calibre", False):
             return [event.plain_result("[Calibre-Web] 功能未启用。")]
 
@@ -195,27 +180,17 @@ class CalibreSource(SharedSession):
 
         try:
             session = await self.get_session()
-            async with session.get(book_url, proxy=self.proxy) as response:
-                if response.status == 200:
-                    content_disposition = response.headers.get("Content-Disposition")
-                    book_name = None
-
-                    if content_disposition:
-                        book_name_match = re.search(r'filename\*=(?:UTF-8\'\')?([^;]+)', content_disposition)
-                        if book_name_match:
-                            book_name = unquote(book_name_match.group(1))
-                        else:
-                            book_name_match = re.search(r'filename=["\']?([^;\']+)["\']?', content_disposition)
-                            if book_name_match:
-                                book_name = book_name_match.group(1)
-
-                    if not book_name or book_name.strip() == "":
-                        logger.error(f"[Calibre-Web] 无法提取书名，电子书地址: {book_url}")
-                        return [event.plain_result("[Calibre-Web] 无法提取书名，取消发送电子书。")]
-
-                    file = File(name=book_name, url=book_url)
-                    return [event.chain_result([file])]
-                return [event.plain_result(f"[Calibre-Web] 无法下载电子书，状态码: {response.status}")]
+            temp_file_path, book_name = await self.downloads.submit(
+                f"calibre:{book_url}",
+                url_host(book_url),
+                lambda transfer: self.downloads.fetch_to_file(transfer, session, book_url, proxy=proxies.choose(book_url)),
+                progress=progress,
+            )
+            file = File(name=book_name, file=temp_file_path)
+            return [event.chain_result([file])]
+        except DownloadError as e:
+            logger.error(f"[Calibre-Web] 下载失败: {e}，电子书地址: {book_url}")
+            return [event.plain_result(f"[Calibre-Web] 无法下载电子书，{e}")]
         except Exception as e:
             logger.error(f"[Calibre-Web] 下载失败: {e}")
             return [event.plain_result("[Calibre-Web] 下载电子书时发生错误，请稍后再试。")]
@@ -234,21 +209,20 @@ class CalibreSource(SharedSession):
                 n = len(results)
 
             recommended_books = random.sample(results, n)
-            result = await self._convert_calibre_results_to_nodes(event, recommended_books)
-
-            if isinstance(result, str):
-                return [event.plain_result(result)]
-            if isinstance(result, list):
-                guidance = f"[Calibre-Web] 如下是随机推荐的 {n} 本电子书。"
-                nodes = [Node(uin=event.get_self_id(), name="Calibre-Web", content=[Plain(guidance)])]
-                nodes.extend(result)
-                ns = Nodes([])
-                ns.nodes = nodes
-                return [event.chain_result([ns])]
-            return [event.plain_result("[Calibre-Web] 生成结果失败。")]
+            result = await render_nodes(event, [[self._to_record(book)] for book in recommended_books])
+
+            guidance = f"[Calibre-Web] 如下是随机推荐的 {n} 本电子书。"
+            nodes = [Node(uin=event.get_self_id(), name="Calibre-Web", content=[Plain(guidance)])]
+            nodes.extend(result)
+            ns = Nodes([])
+            ns.nodes = nodes
+            return [event.chain_result([ns])]
         except Exception as e:
             logger.error(f"[Calibre-Web] 推荐电子书时发生错误: {e}")
             return [event.plain_result("[Calibre-Web] 推荐电子书时发生错误，请稍后再试。")]
 
+    async def warm(self) -> bool:
+        return await preconnect(self.config.get("calibre_web_url", "http://127.0.0.1:8083"))
+
     async def close(self):
         await self.close_session()
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Optional
+
+from astrbot.api.all import logger
+
+INDEX_FILE = "index.json"
+
+
+class DownloadCache:
+    """Size-bounded on-disk cache of downloaded books.
+
+    Entries are keyed by the canonical source ID (``archive:<url>``,
+    ``zlib:<id>``, ...) and stored under a directory named after the key's
+    digest, keeping the original file name for sending. When the total size
+    exceeds ``max_bytes`` the least recently used unpinned entries are
+    evicted; an entry is pinned while a send of it may still be in progress.
+
+    Recency is tracked in memory; the index is written on ``put``, on
+    eviction and on ``close``, never on a cache hit.
+    """
+
+    def __init__(self, root: str, max_bytes: int, pin_seconds: float = 600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.pin_seconds = pin_seconds
+        self._entries: dict[str, dict] = {}
+        self._pins: dict[str, float] = {}
+        os.makedirs(self.root, exist_ok=True)
+        self._load_index()
+
+    def _index_path(self) -> str:
+        return os.path.join(self.root, INDEX_FILE)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"[ebooks] 下载缓存索引损坏，已重建: {e}")
+            return
+        self._entries = {key: entry for key, entry in entries.items() if os.path.isfile(self._path(entry))}
+
+    def _save_index(self):
+        temp_path = self._index_path() + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, ensure_ascii=False)
+        os.replace(temp_path, self._index_path())
+
+    def _path(self, entry: dict) -> str:
+        return os.path.join(self.root, entry["dir"], entry["name"])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry["size"] for entry in self._entries.values())
+
+    def get(self, key: str) -> Optional[tuple[str, str]]:
+        """Return ``(path, name)`` for a cached key and mark it recently used."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        path = self._path(entry)
+        if not os.path.isfile(path):
+            del self._entries[key]
+            return None
+        entry["last_used"] = time.time()
+        return path, entry["name"]
+
+    def put(self, key: str, source_path: str, name: str) -> tuple[str, str]:
+        """Move a finished download into the cache and return its cached ``(path, name)``.
+
+        The new entry is pinned before older ones are evicted, so making room
+        never deletes the file about to be sent.
+        """
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        entry_dir = os.path.join(self.root, digest)
+        if key in self._entries:
+            self._remove(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        path = os.path.join(entry_dir, name)
+        shutil.move(source_path, path)
+        self._entries[key] = {
+            "dir": digest,
+            "name": name,
+            "size": os.path.getsize(path),
+            "last_used": time.time(),
+        }
+        self.pin(key)
+        self.evict()
+        self._save_index()
+        return path, name
+
+    def pin(self, key: str):
+        """Protect an entry from eviction for ``pin_seconds`` while it is being sent.
+
+        The file is handed to the adapter as event results, so the plugin never
+        learns when the send finishes; the pin is a time limit that has to
+        outlast the slowest upload.
+        """
+        self._pins[key] = max(self._pins.get(key, 0), time.monotonic() + self.pin_seconds)
+
+    def is_pinned(self, key: str) -> bool:
+        expires_at = self._pins.get(key)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del self._pins[key]
+            return False
+        return True
+
+    def evict(self):
+        total = self.total_bytes
+        if total <= self.max_bytes:
+            return
+        evicted = False
+        for key in sorted(self._entries, key=lambda k: self._entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if self.is_pinned(key):
+                continue
+            total -= self._entries[key]["size"]
+            logger.debug(f"[ebooks] 下载缓存超出配额，移除：{key}")
+            self._remove(key)
+            evicted = True
+        if evicted:
+            self._save_index()
+
+    def close(self):
+        """Persist the in-memory recency so LRU order survives a restart."""
+        self._save_index()
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        shutil.rmtree(os.path.join(self.root, entry["dir"]), ignore_errors=True)
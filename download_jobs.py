@@ -0,0 +1,176 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Optional
+
+from astrbot.api.all import Plain, logger
+from astrbot.api.event import MessageChain
+
+from data.plugins.astrbot_plugin_ebooks.download_manager import Transfer
+
+MAX_FINISHED_JOBS = 50
+
+
+class DownloadJob:
+    def __init__(self, owner: str, origin: str, description: str, runner: Callable[..., Awaitable[list]]):
+        self.id = uuid.uuid4().hex[:6]
+        self.owner = owner
+        self.origin = origin
+        self.description = description
+        self.runner = runner
+        self.state = "queued"
+        self.created_at = time.time()
+        self.bytes_done = 0
+        self.bytes_total: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self._last_report = 0.0
+        self._last_percent = -1
+
+    def summary(self) -> str:
+        states = {"queued": "排队中", "running": "下载中", "done": "已完成", "failed": "失败", "cancelled": "已取消"}
+        text = f"{self.id} [{states.get(self.state, self.state)}] {self.description}"
+        if self.state == "running" and self.bytes_total:
+            text += f" {self.bytes_done * 100 // self.bytes_total}%"
+        return text
+
+
+class DownloadJobQueue:
+    """Run download jobs in the background with round-robin fairness across owners.
+
+    Each owner (user) has its own FIFO; workers always take the next job from
+    the owner after the one served last, so a user queueing many large books
+    can't starve everybody else. Progress and the final result are posted to
+    the job's conversation through ``context.send_message``.
+    """
+
+    def __init__(self, context, workers: int = 2, progress_interval: float = 15):
+        self.context = context
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self._queues: OrderedDict[str, deque[DownloadJob]] = OrderedDict()
+        self._jobs: OrderedDict[str, DownloadJob] = OrderedDict()
+        self._available: Optional[asyncio.Semaphore] = None
+        self._worker_tasks: list[asyncio.Task] = []
+        self._notify_tasks: set[asyncio.Task] = set()
+
+    def _ensure_workers(self):
+        if self._worker_tasks:
+            return
+        self._available = asyncio.Semaphore(0)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, owner: str, origin: str, description: str, runner: Callable[..., Awaitable[list]]) -> DownloadJob:
+        """Queue ``runner(progress)``; it must return the event results to post when done."""
+        self._ensure_workers()
+        job = DownloadJob(owner, origin, description, runner)
+        self._jobs[job.id] = job
+        self._queues.setdefault(owner, deque()).append(job)
+        self._available.release()
+        self._trim_finished()
+        return job
+
+    def jobs(self, origin: str = None) -> list[DownloadJob]:
+        return [job for job in self._jobs.values() if origin is None or job.origin == origin]
+
+    def get(self, job_id: str) -> Optional[DownloadJob]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job.state not in ("queued", "running"):
+            return False
+        if job.state == "queued":
+            queue = self._queues.get(job.owner)
+            if queue and job in queue:
+                queue.remove(job)
+                if not queue:
+                    del self._queues[job.owner]
+            job.state = "cancelled"
+            return True
+        job.task.cancel()
+        return True
+
+    def _next_job(self) -> Optional[DownloadJob]:
+        for owner in list(self._queues):
+            queue = self._queues[owner]
+            job = queue.popleft()
+            if queue:
+                self._queues.move_to_end(owner)
+            else:
+                del self._queues[owner]
+            return job
+        return None
+
+    async def _worker(self):
+        while True:
+            await self._available.acquire()
+            job = self._next_job()
+            if job is None:
+                # the job was cancelled while it was still queued
+                continue
+            job.state = "running"
+            job.task = asyncio.create_task(self._run(job))
+            try:
+                await asyncio.shield(job.task)
+            except asyncio.CancelledError:
+                if not job.task.cancelled():
+                    job.task.cancel()
+                    raise
+            except Exception:
+                pass
+
+    async def _run(self, job: DownloadJob):
+        try:
+            results = await job.runner(lambda transfer: self._on_progress(job, transfer))
+            job.state = "done"
+            for result in results:
+                await self.context.send_message(job.origin, result)
+        except asyncio.CancelledError:
+            job.state = "cancelled"
+            await self._notify(job, f"[ebooks] 任务 {job.id} 已取消。")
+            raise
+        except Exception as e:
+            job.state = "failed"
+            logger.error(f"[ebooks] 下载任务 {job.id} 失败: {e}")
+            await self._notify(job, f"[ebooks] 任务 {job.id} 下载失败，请稍后再试。")
+
+    def _on_progress(self, job: DownloadJob, transfer: Transfer):
+        job.bytes_done = transfer.bytes_done
+        job.bytes_total = transfer.bytes_total
+        if not job.bytes_total:
+            return
+        percent = job.bytes_done * 100 // job.bytes_total
+        now = time.monotonic()
+        if percent >= 100 or now - job._last_report < self.progress_interval or percent == job._last_percent:
+            return
+        job._last_report, job._last_percent = now, percent
+        text = (
+            f"[ebooks] 任务 {job.id} 下载中：{percent}% "
+            f"({job.bytes_done / 1048576:.1f}/{job.bytes_total / 1048576:.1f} MB)"
+        )
+        task = asyncio.create_task(self._notify(job, text))
+        self._notify_tasks.add(task)
+        task.add_done_callback(self._notify_tasks.discard)
+
+    async def _notify(self, job: DownloadJob, text: str):
+        try:
+            await self.context.send_message(job.origin, MessageChain([Plain(text)]))
+        except Exception as e:
+            logger.warning(f"[ebooks] 发送任务 {job.id} 消息失败: {e}")
+
+    def _trim_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in ("done", "failed", "cancelled")]
+        for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    async def stop(self):
+        for job in self._jobs.values():
+            if job.task and not job.task.done():
+                job.task.cancel()
+        for task in self._worker_tasks:
+            task.cancel()
+        for task in self._notify_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, *self._notify_tasks, return_exceptions=True)
+        self._worker_tasks = []
@@ -0,0 +1,413 @@
+import asyncio
+import os
+import shutil
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+from urllib.parse import urlparse
+
+import aiofiles
+import aiohttp
+from astrbot.api.all import logger
+
+from data.plugins.astrbot_plugin_ebooks.download_cache import DownloadCache
+from data.plugins.astrbot_plugin_ebooks.metrics import metrics
+from data.plugins.astrbot_plugin_ebooks.utils import extract_filename, truncate_filename
+
+T = TypeVar("T")
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_SEGMENT_RETRIES = 3
+KEY_SOURCES = {"archive": "archive.org", "calibre": "Calibre-Web", "ipfs": "IPFS", "zlib": "Z-Library"}
+
+
+class DownloadError(Exception):
+    """A transfer failed in a way that should be reported to the user."""
+
+
+class DownloadCancelled(DownloadError):
+    """The transfer was cancelled while a requester was waiting on it."""
+
+
+class RangeNotSupported(Exception):
+    """The server refused a byte-range request; fall back to a single stream."""
+
+
+def parse_segment_rules(rules) -> dict[str, int]:
+    """Parse ``host=N`` entries (``*=N`` for the default) into a mapping."""
+    parsed = {}
+    for rule in rules or []:
+        host, _, count = str(rule).partition("=")
+        if host.strip() and count.strip().isdigit():
+            parsed[host.strip().lower()] = int(count)
+    return parsed
+
+
+class Transfer:
+    """State of one in-flight download shared by every requester of the same key."""
+
+    def __init__(self, key: str, host: Optional[str]):
+        self.key = key
+        self.host = host
+        self.state = "queued"
+        self.created_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.bytes_done = 0
+        self.bytes_total: Optional[int] = None
+        self.waiters = 0
+        self.task: Optional[asyncio.Task] = None
+        self._listeners: list[Callable[["Transfer"], None]] = []
+
+    def add_listener(self, listener: Callable[["Transfer"], None]):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[["Transfer"], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def update(self, bytes_done: int, bytes_total: Optional[int] = None):
+        self.bytes_done = bytes_done
+        if bytes_total is not None:
+            self.bytes_total = bytes_total
+        for listener in list(self._listeners):
+            try:
+                listener(self)
+            except Exception as e:
+                logger.debug(f"[ebooks] 下载进度回调出错: {e}")
+
+
+class DownloadManager:
+    """Coordinate every source's transfers.
+
+    Downloads are keyed by a canonical source ID or URL; a key already in the
+    download cache is served from disk, and a request for a key that is
+    already queued or running attaches to that transfer instead of starting
+    another one. Running transfers are capped per host and globally, later
+    ones wait in FIFO order on the semaphores, the host's first. Factories return
+    ``(path, name)`` for a file written to ``staging_path()``, or None.
+    """
+
+    def __init__(
+        self,
+        temp_path: str,
+        cache: DownloadCache,
+        max_concurrent: int = 3,
+        max_per_host: int = 2,
+        segment_rules: dict[str, int] = None,
+        segment_min_bytes: int = 8 * 1024 * 1024,
+    ):
+        self.temp_path = temp_path
+        self.staging_dir = os.path.join(temp_path, "staging")
+        # anything left here was interrupted by a restart and can't be resumed
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self.cache = cache
+        self.max_per_host = max_per_host
+        self.segment_rules = segment_rules or {}
+        self.segment_min_bytes = segment_min_bytes
+        self._global_slots = asyncio.Semaphore(max_concurrent)
+        self._host_slots: dict[str, asyncio.Semaphore] = {}
+        self._transfers: dict[str, Transfer] = {}
+
+    def _host_semaphore(self, host: str) -> asyncio.Semaphore:
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.max_per_host)
+        return self._host_slots[host]
+
+    async def submit(
+        self,
+        key: str,
+        host: Optional[str],
+        factory: Callable[[Transfer], Awaitable[T]],
+        progress: Callable[[Transfer], None] = None,
+    ) -> T:
+        """Run ``factory`` for ``key`` once, letting concurrent requesters share the result.
+
+        A factory that only learns its host once it runs (e.g. the IPFS gateway
+        picked at that moment) is submitted with ``host=None`` and takes the
+        slots itself through ``hold_slots``.
+
+        The returned file is pinned in the cache so it survives until it has been sent.
+        """
+        self.cache.evict()
+        cached = self.cache.get(key)
+        if cached:
+            logger.info(f"[ebooks] 从下载缓存发送：{key}")
+            metrics.cache_hit(key_source(key), "download")
+            self.cache.pin(key)
+            return cached
+
+        transfer = self._transfers.get(key)
+        if transfer is None:
+            metrics.cache_miss(key_source(key), "download")
+            transfer = Transfer(key, host)
+            transfer.task = asyncio.create_task(self._run(transfer, factory))
+            transfer.task.add_done_callback(lambda _: self._forget(transfer))
+            self._transfers[key] = transfer
+        else:
+            logger.info(f"[ebooks] 复用正在进行的下载：{key}")
+            metrics.cache_hit(key_source(key), "download")
+
+        if progress:
+            transfer.add_listener(progress)
+        transfer.waiters += 1
+        try:
+            result = await asyncio.shield(transfer.task)
+            if result:
+                self.cache.pin(key)
+            return result
+        except asyncio.CancelledError:
+            if transfer.task.cancelled():
+                raise DownloadCancelled(f"下载已取消：{key}")
+            # the requester itself went away; stop the transfer if nobody else wants it
+            if transfer.waiters <= 1:
+                transfer.task.cancel()
+            raise
+        finally:
+            transfer.waiters -= 1
+            if progress:
+                transfer.remove_listener(progress)
+
+    @asynccontextmanager
+    async def hold_slots(self, transfer: Transfer, host: str) -> AsyncIterator:
+        """Run the body in one of ``host``'s download slots and a global one, timed as the transfer."""
+        transfer.host = host
+        # the host slot first: a transfer queued behind its own busy host must not hold a global slot
+        async with self._host_semaphore(host), self._global_slots:
+            transfer.state = "running"
+            transfer.started_at = time.monotonic()
+            logger.debug(f"[ebooks] 开始下载：{transfer.key}")
+            with metrics.timer(key_source(transfer.key), "download") as timer:
+                try:
+                    yield timer
+                finally:
+                    timer.bytes = transfer.bytes_done
+
+    async def _run(self, transfer: Transfer, factory: Callable[[Transfer], Awaitable[T]]) -> T:
+        if transfer.host is None:
+            result = await factory(transfer)
+        else:
+            async with self.hold_slots(transfer, transfer.host) as timer:
+                result = await factory(transfer)
+                if not result:
+                    timer.fail()
+        if not result:
+            return result
+        path, name = result
+        if os.path.getsize(path) > self.cache.max_bytes:
+            # caching it would evict everything else; send it from staging and drop it once sent
+            logger.info(f"[ebooks] 文件超出下载缓存容量，不缓存：{transfer.key}")
+            asyncio.get_running_loop().call_later(self.cache.pin_seconds, self._discard, path)
+            return path, name
+        return self.cache.put(transfer.key, path, name)
+
+    @staticmethod
+    def _discard(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _forget(self, transfer: Transfer):
+        transfer.state = "cancelled" if transfer.task.cancelled() else "done"
+        if self._transfers.get(transfer.key) is transfer:
+            del self._transfers[transfer.key]
+
+    def cancel(self, key: str) -> bool:
+        transfer = self._transfers.get(key)
+        if transfer is None or transfer.task.done():
+            return False
+        transfer.task.cancel()
+        return True
+
+    def transfers(self) -> list[Transfer]:
+        return list(self._transfers.values())
+
+    def staging_path(self) -> str:
+        return os.path.join(self.staging_dir, f"{uuid.uuid4().hex}.part")
+
+    def segments_for(self, host: str) -> int:
+        """Number of parallel range requests configured for ``host`` (suffix match, ``*`` as default)."""
+        best_match, segments = "", self.segment_rules.get("*", 1)
+        for pattern, count in self.segment_rules.items():
+            if pattern == "*":
+                continue
+            if (host == pattern or host.endswith("." + pattern)) and len(pattern) > len(best_match):
+                best_match, segments = pattern, count
+        return max(1, segments)
+
+    @staticmethod
+    def _resolve_filename(filename: str, content_disposition: str, fallback_filename: str) -> str:
+        book_name = filename or extract_filename(content_disposition or "")
+        if not book_name:
+            book_name = fallback_filename
+        if not book_name or not book_name.strip():
+            raise DownloadError("无法提取书名")
+        return truncate_filename(book_name)
+
+    async def fetch_to_file(
+        self,
+        transfer: Transfer,
+        session: aiohttp.ClientSession,
+        url: str,
+        proxy: str = None,
+        filename: str = None,
+        fallback_filename: str = None,
+        timeout: int = 300,
+    ) -> tuple[str, str]:
+        """Download ``url`` into a staging file and return ``(path, filename)``.
+
+        The name comes from ``filename``, then Content-Disposition, then
+        ``fallback_filename``; DownloadError is raised when none is usable.
+        Large files from hosts configured for segmented downloads are fetched
+        as parallel byte ranges when the server advertises ``Accept-Ranges``.
+        """
+        segments = self.segments_for(url_host(url))
+        if segments > 1:
+            probe = await self._probe_ranges(session, url, proxy)
+            if probe and probe[1] >= self.segment_min_bytes:
+                final_url, size, content_disposition = probe
+                book_name = self._resolve_filename(filename, content_disposition, fallback_filename)
+                path = self.staging_path()
+                try:
+                    await self._fetch_segments(transfer, session, final_url, path, size, segments, proxy, timeout)
+                    return path, book_name
+                except RangeNotSupported as e:
+                    logger.info(f"[ebooks] 分段下载不可用，改为单连接下载：{e}")
+                    os.remove(path)
+                except BaseException:
+                    if os.path.exists(path):
+                        os.remove(path)
+                    raise
+
+        async with session.get(
+            url,
+            proxy=proxy,
+            allow_redirects=True,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as response:
+            if response.status != 200:
+                raise DownloadError(f"状态码: {response.status}")
+
+            book_name = self._resolve_filename(
+                filename, response.headers.get("Content-Disposition", ""), fallback_filename
+            )
+            path = self.staging_path()
+            transfer.update(0, response.content_length)
+            try:
+                async with aiofiles.open(path, "wb") as temp_file:
+                    bytes_done = 0
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        await temp_file.write(chunk)
+                        bytes_done += len(chunk)
+                        transfer.update(bytes_done)
+            except BaseException:
+                if os.path.exists(path):
+                    os.remove(path)
+                raise
+        return path, book_name
+
+    async def _probe_ranges(
+        self, session: aiohttp.ClientSession, url: str, proxy: str
+    ) -> Optional[tuple[str, int, str]]:
+        """Return ``(final_url, size, content_disposition)`` when the server accepts byte ranges."""
+        try:
+            async with session.head(
+                url, proxy=proxy, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=15)
+            ) as response:
+                if response.status != 200 or response.headers.get("Accept-Ranges", "").lower() != "bytes":
+                    return None
+                if not response.content_length:
+                    return None
+                return str(response.url), response.content_length, response.headers.get("Content-Disposition", "")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug(f"[ebooks] 探测分段下载支持失败: {e}")
+            return None
+
+    async def _fetch_segments(
+        self,
+        transfer: Transfer,
+        session: aiohttp.ClientSession,
+        url: str,
+        path: str,
+        size: int,
+        segments: int,
+        proxy: str,
+        timeout: int,
+    ):
+        async with aiofiles.open(path, "wb") as temp_file:
+            await temp_file.truncate(size)
+
+        segment_size = -(-size // segments)
+        ranges = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+        progress = [0] * len(ranges)
+        transfer.update(0, size)
+
+        def report(index: int, done: int):
+            progress[index] = done
+            transfer.update(sum(progress))
+
+        tasks = [
+            asyncio.create_task(self._fetch_segment(session, url, path, start, end, index, report, proxy, timeout))
+            for index, (start, end) in enumerate(ranges)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # wait for the siblings to stop writing before the caller removes or reuses the file
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _fetch_segment(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        path: str,
+        start: int,
+        end: int,
+        index: int,
+        report: Callable[[int, int], None],
+        proxy: str,
+        timeout: int,
+    ):
+        offset = start
+        for attempt in range(MAX_SEGMENT_RETRIES + 1):
+            try:
+                async with session.get(
+                    url,
+                    headers={"Range": f"bytes={offset}-{end}"},
+                    proxy=proxy,
+                    timeout=aiohttp.ClientTimeout(total=timeout),
+                ) as response:
+                    if response.status != 206:
+                        raise RangeNotSupported(f"分段请求返回状态码 {response.status}")
+                    async with aiofiles.open(path, "r+b") as temp_file:
+                        await temp_file.seek(offset)
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            chunk = chunk[: end + 1 - offset]
+                            await temp_file.write(chunk)
+                            offset += len(chunk)
+                            report(index, offset - start)
+                            if offset > end:
+                                return
+                if offset > end:
+                    return
+                raise aiohttp.ClientPayloadError("segment ended early")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == MAX_SEGMENT_RETRIES:
+                    raise DownloadError(f"分段下载失败: {e}")
+                # resume this segment from the last byte written
+                logger.debug(f"[ebooks] 分段 {index} 在 {offset - start} 字节处中断，继续下载: {e}")
+                await asyncio.sleep(0.5 * (attempt + 1))
+
+
+def url_host(url: str) -> str:
+    return urlparse(url).hostname or url
+
+
+def key_source(key: str) -> str:
+    """Name the source of a download key such as ``zlib:<id>`` for metrics."""
+    prefix = key.split(":", 1)[0]
+    return KEY_SOURCES.get(prefix, prefix)
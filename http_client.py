@@ -0,0 +1,525 @@
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+from astrbot.api.all import logger
+
+# aiohttp forgets resolved addresses after 10s and idle connections after 15s by
+# default, too soon for a chat bot whose searches arrive minutes apart
+DNS_CACHE_TTL = 600
+KEEPALIVE_TIMEOUT = 60
+PRECONNECT_TIMEOUT = 10
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.05
+HEDGE_BURST = 5
+HEDGE_LATENCY_SAMPLES = 256
+RETRY_STATUSES = (429, 503)
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+MAX_BACKOFF = 30
+MIN_RATE_FACTOR = 0.125
+DIRECT = "direct"
+PROXY_EXPLORE_RATE = 0.05
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """Return the aiohttp session shared by every source, cover fetch and probe."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(ttl_dns_cache=DNS_CACHE_TTL, keepalive_timeout=KEEPALIVE_TIMEOUT)
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def preconnect(url: str) -> bool:
+    """Resolve the host of ``url`` and leave an open connection to it in the shared pool.
+
+    Every route the host may take is tried, which also keeps the proxy
+    rankings fresh. Any HTTP answer will do, a HEAD on an API root is often
+    a 404 or 405.
+    """
+    routes = proxies.routes(_host(url))
+    results = await asyncio.gather(*(_preconnect_via(url, route) for route in routes), return_exceptions=True)
+    return any(result is True for result in results)
+
+
+async def _preconnect_via(url: str, route: str) -> bool:
+    proxy = None if route == DIRECT else route
+    session = await get_session()
+    started = time.monotonic()
+    try:
+        async with session.head(
+            url,
+            proxy=proxy,
+            timeout=aiohttp.ClientTimeout(total=PRECONNECT_TIMEOUT),
+            allow_redirects=False,
+        ) as response:
+            ok = response.status < 500
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        proxies.record(url, proxy, None)
+        raise
+    proxies.record(url, proxy, time.monotonic() - started if ok else None)
+    return ok
+
+
+class Response:
+    """A response whose body has been read, so it outlives its connection."""
+
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status: int, headers: Mapping[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+    def text(self, encoding: str = "utf-8") -> str:
+        return self.body.decode(encoding, errors="replace")
+
+
+class HedgePolicy:
+    """Decide when a slow idempotent request gets a duplicate.
+
+    Latencies are kept per hedge key (e.g. ``"Liber3/book"``); a request is
+    hedged once it has run longer than the key's rolling p90. Every hedgeable
+    request earns ``budget`` of a hedge, up to ``HEDGE_BURST`` saved, and a
+    hedge spends one, so duplicates stay under ``budget`` of the traffic.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.budget = 0.1
+        self.tokens = float(HEDGE_BURST)
+        self.latencies: dict[str, deque[float]] = {}
+        self.requests = 0
+        self.hedged = 0
+        self.won = 0
+        self.over_budget = 0
+
+    def configure(self, enabled: bool, budget_percent: float = 10):
+        self.enabled = bool(enabled)
+        self.budget = max(0.0, min(float(budget_percent), 100.0)) / 100
+
+    def reset(self):
+        self.requests = self.hedged = self.won = self.over_budget = 0
+
+    def delay(self, key: str) -> Optional[float]:
+        """Seconds to wait before hedging, or None while the key has too few samples."""
+        samples = self.latencies.get(key)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return max(HEDGE_MIN_DELAY, ordered[math.ceil(0.9 * len(ordered)) - 1])
+
+    def observe(self, key: str, seconds: float):
+        samples = self.latencies.get(key)
+        if samples is None:
+            samples = self.latencies[key] = deque(maxlen=HEDGE_LATENCY_SAMPLES)
+        samples.append(seconds)
+
+    def earn(self):
+        self.requests += 1
+        self.tokens = min(float(HEDGE_BURST), self.tokens + self.budget)
+
+    def spend(self) -> bool:
+        if self.tokens < 1:
+            self.over_budget += 1
+            return False
+        self.tokens -= 1
+        self.hedged += 1
+        return True
+
+    def summary_lines(self) -> list[str]:
+        if not self.requests:
+            return []
+        return [
+            f"请求对冲: {self.requests} 次可对冲请求，发出对冲 {self.hedged} 次（{self.hedged / self.requests:.1%}），"
+            f"对冲先返回 {self.won} 次，超出预算未对冲 {self.over_budget} 次"
+        ]
+
+
+hedging = HedgePolicy()
+
+
+def parse_rate_rules(rules) -> dict[str, tuple[float, int]]:
+    """Parse ``host=rate`` or ``host=rate/burst`` entries, in requests per second, into a mapping."""
+    parsed = {}
+    for rule in rules or []:
+        host, _, limit = str(rule).partition("=")
+        rate, _, burst = limit.partition("/")
+        try:
+            rate, burst = float(rate), int(burst or 1)
+        except ValueError:
+            continue
+        if host.strip() and rate > 0 and burst > 0:
+            parsed[host.strip().lower()] = (rate, burst)
+    return parsed
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Read a ``Retry-After`` header, given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value.strip())
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostBucket:
+    """A token bucket for one host that queues requests instead of rejecting them.
+
+    ``reserve`` hands out start times spaced ``1 / rate`` apart once
+    ``burst`` requests are in flight, so callers simply sleep until their
+    turn and keep their order. A throttled host is paused for everyone.
+    """
+
+    __slots__ = ("limit", "rate", "burst", "tat", "paused_until", "failures", "queued", "waited", "throttles")
+
+    def __init__(self, rate: Optional[float], burst: int):
+        self.limit = rate
+        self.rate = rate
+        self.burst = burst
+        self.tat = 0.0
+        self.paused_until = 0.0
+        self.failures = 0
+        self.queued = 0
+        self.waited = 0.0
+        self.throttles = 0
+
+    def reserve(self, now: float) -> float:
+        """Claim the next start time; returns the seconds to wait for it."""
+        start = max(now, self.paused_until)
+        if self.rate is None:
+            return start - now
+        tat = max(self.tat, start)
+        self.tat = tat + 1 / self.rate
+        return max(start, tat - (self.burst - 1) / self.rate) - now
+
+    def throttled(self, retry_after: Optional[float], now: float) -> float:
+        """Pause the host after a 429 or 503 and slow it down; returns the pause."""
+        self.failures += 1
+        self.throttles += 1
+        if retry_after is None:
+            # exponential backoff with jitter, so queued requests don't return in lockstep
+            backoff = min(MAX_BACKOFF, BACKOFF_BASE * 2 ** (self.failures - 1))
+            retry_after = backoff / 2 + random.random() * backoff / 2
+        pause = min(MAX_BACKOFF, retry_after)
+        self.paused_until = max(self.paused_until, now + pause)
+        if self.limit is not None:
+            self.rate = max(self.limit * MIN_RATE_FACTOR, self.rate / 2)
+        return pause
+
+    def gave_up(self):
+        """Count a 429 or 503 that ends a request without pausing the host for other callers."""
+        self.throttles += 1
+
+    def succeeded(self):
+        self.failures = 0
+        if self.limit is not None and self.rate < self.limit:
+            self.rate = min(self.limit, self.rate + self.limit / 20)
+
+
+class RateLimiter:
+    """Per-host token buckets configured by ``host=rate[/burst]`` rules.
+
+    Rules match a host and its subdomains, ``*`` sets the default, and hosts
+    without a rule are not limited but still back off when throttled.
+    """
+
+    def __init__(self):
+        self.rules: dict[str, tuple[float, int]] = {}
+        self.buckets: dict[str, HostBucket] = {}
+
+    def configure(self, rules: dict[str, tuple[float, int]]):
+        self.rules = rules
+        self.buckets.clear()
+
+    def reset(self):
+        for bucket in self.buckets.values():
+            bucket.queued = bucket.throttles = 0
+            bucket.waited = 0.0
+
+    def bucket(self, host: str) -> HostBucket:
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            best_match, (rate, burst) = "", self.rules.get("*", (None, 1))
+            for pattern, limit in self.rules.items():
+                if pattern == "*":
+                    continue
+                if (host == pattern or host.endswith("." + pattern)) and len(pattern) > len(best_match):
+                    best_match, (rate, burst) = pattern, limit
+            bucket = self.buckets[host] = HostBucket(rate, burst)
+        return bucket
+
+    async def acquire(self, host: str):
+        bucket = self.bucket(host)
+        wait = bucket.reserve(time.monotonic())
+        if wait > 0:
+            bucket.queued += 1
+            bucket.waited += wait
+            await asyncio.sleep(wait)
+
+    def throttled(self, host: str, retry_after: Optional[str]) -> float:
+        return self.bucket(host).throttled(retry_after_seconds(retry_after), time.monotonic())
+
+    def gave_up(self, host: str):
+        self.bucket(host).gave_up()
+
+    def succeeded(self, host: str):
+        self.bucket(host).succeeded()
+
+    def summary_lines(self) -> list[str]:
+        return [
+            f"限速 {host}: 排队 {bucket.queued} 次，累计等待 {bucket.waited:.1f}s，被上游限流 {bucket.throttles} 次"
+            + (f"，当前 {bucket.rate:.1f}/{bucket.limit:.1f} 次/秒" if bucket.limit is not None else "")
+            for host, bucket in sorted(self.buckets.items())
+            if bucket.queued or bucket.throttles
+        ]
+
+
+limiter = RateLimiter()
+
+
+def parse_proxy_rules(rules) -> dict[str, list[str]]:
+    """Parse ``host=route`` entries, several routes separated by ``|``, into a mapping."""
+    parsed = {}
+    for rule in rules or []:
+        host, _, routes = str(rule).partition("=")
+        routes = [route.strip() for route in routes.split("|") if route.strip()]
+        if host.strip() and routes:
+            parsed[host.strip().lower()] = routes
+    return parsed
+
+
+def _route_label(route: str) -> str:
+    """A route for display, without the proxy's credentials."""
+    parsed = urlparse(route)
+    if not parsed.hostname:
+        return route
+    return f"{parsed.scheme}://{parsed.hostname}" + (f":{parsed.port}" if parsed.port else "")
+
+
+class ProxyRouter:
+    """Pick the proxy for each upstream host from its rolling latency.
+
+    Every host may use the ``pool`` of routes (proxy URLs, or ``direct``)
+    unless a ``host=route|route`` rule, matched like the rate limits, names
+    its own. Each host ranks its routes with a ``LatencyRanker`` fed by the
+    requests and warm-up probes sent through them; requests take the best
+    route, and ``PROXY_EXPLORE_RATE`` of them try another so a route that
+    recovered or got faster is noticed. Without a pool the ``https_proxy``
+    environment variable is the only route, as before.
+
+    The Z-Library and Anna's Archive clients choose and record from worker
+    threads, so the rankers and counts are only touched under a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.configure([], {})
+
+    def configure(self, pool: list[str], rules: dict[str, list[str]]):
+        pool = [str(route).strip() for route in pool or [] if str(route).strip()]
+        with self._lock:
+            self.pool = pool or [os.environ.get("https_proxy") or DIRECT]
+            self.rules = rules
+            self.rankers = {}
+            self.counts: dict[str, dict[str, int]] = {}
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+
+    def routes(self, host: str) -> list[str]:
+        best_match, routes = "", self.rules.get("*", self.pool)
+        for pattern, candidates in self.rules.items():
+            if pattern == "*":
+                continue
+            if (host == pattern or host.endswith("." + pattern)) and len(pattern) > len(best_match):
+                best_match, routes = pattern, candidates
+        return routes
+
+    def _ranker(self, host: str):
+        # callers hold _lock
+        ranker = self.rankers.get(host)
+        if ranker is None:
+            # utils imports this module for the shared session
+            from data.plugins.astrbot_plugin_ebooks.utils import LatencyRanker
+
+            ranker = self.rankers[host] = LatencyRanker(self.routes(host))
+        return ranker
+
+    def choose(self, url: str, avoid: Optional[str] = None) -> Optional[str]:
+        """Return the proxy for a request to ``url``, None to connect directly.
+
+        The ``avoid`` route is passed over when there is another, so a hedged
+        request leaves by a different one.
+        """
+        host = _host(url)
+        with self._lock:
+            ranked = self._ranker(host).ranked()
+            if len(ranked) > 1 and avoid in ranked:
+                ranked.remove(avoid)
+            route = ranked[0]
+            if len(ranked) > 1 and random.random() < PROXY_EXPLORE_RATE:
+                route = random.choice(ranked[1:])
+            counts = self.counts.setdefault(host, {})
+            counts[route] = counts.get(route, 0) + 1
+        return None if route == DIRECT else route
+
+    def record(self, url: str, proxy: Optional[str], seconds: Optional[float]):
+        """Record a request sent through ``proxy``; ``seconds`` is None when it failed."""
+        host = _host(url)
+        with self._lock:
+            ranker = self._ranker(host)
+            if seconds is None:
+                ranker.record_failure(proxy or DIRECT)
+            else:
+                ranker.record_success(proxy or DIRECT, seconds)
+
+    def summary_lines(self) -> list[str]:
+        with self._lock:
+            return self._summary_lines()
+
+    def _summary_lines(self) -> list[str]:
+        lines = []
+        for host, counts in sorted(self.counts.items()):
+            ranker = self.rankers.get(host)
+            if ranker is None or len(ranker.endpoints) < 2:
+                continue
+            routes = []
+            for route in ranker.ranked():
+                latency, failures = ranker.latency(route), ranker.failures(route)
+                state = f"{latency * 1000:.0f}ms" if latency is not None else "未测量"
+                if failures:
+                    state += f"，连续失败 {failures} 次"
+                routes.append(f"{_route_label(route)} {counts.get(route, 0)} 次（{state}）")
+            lines.append(f"代理 {host}: " + "；".join(routes))
+        return lines
+
+
+proxies = ProxyRouter()
+
+
+def _host(url: str) -> str:
+    return urlparse(url).hostname or url
+
+
+async def _attempt(
+    session: aiohttp.ClientSession, method: str, url: str, proxy: Optional[str], kwargs: dict
+) -> Response:
+    started = time.monotonic()
+    try:
+        async with session.request(method, url, proxy=proxy, **kwargs) as response:
+            result = Response(response.status, response.headers, await response.read())
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        proxies.record(url, proxy, None)
+        raise
+    proxies.record(url, proxy, time.monotonic() - started)
+    return result
+
+
+async def _limited_attempt(
+    session: aiohttp.ClientSession, method: str, url: str, proxy: Optional[str], kwargs: dict
+) -> Response:
+    await limiter.acquire(_host(url))
+    return await _attempt(session, method, url, proxy, kwargs)
+
+
+def _answered(task: asyncio.Task) -> bool:
+    return task.exception() is None and task.result().status < 500
+
+
+async def request(
+    method: str,
+    url: str,
+    hedge: Optional[str] = None,
+    hedge_url: Optional[str] = None,
+    max_retries: int = MAX_RETRIES,
+    **kwargs,
+) -> Response:
+    """Send a request on the shared session and read the whole body.
+
+    The proxy is chosen per attempt by ``proxies``, so callers don't pass
+    one. Requests wait for their host's rate limit. A 429 or 503 pauses the
+    host for its ``Retry-After`` (or a jittered backoff) and the request is
+    queued again, up to ``max_retries`` times; the last throttled answer is
+    returned as is, without pausing the host.
+
+    With a ``hedge`` key and hedging enabled, a request still unanswered
+    after the key's rolling p90 is sent again, to ``hedge_url`` if given
+    and through another route if there is one, and the first good answer
+    wins; the other request is cancelled. Only pass a key for idempotent
+    requests.
+    """
+    session = await get_session()
+    host = _host(url)
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(host)
+        if hedge is None or not hedging.enabled:
+            response = await _attempt(session, method, url, proxies.choose(url), kwargs)
+        else:
+            response = await _hedged(session, method, url, hedge, hedge_url, kwargs)
+        if response.status not in RETRY_STATUSES:
+            limiter.succeeded(host)
+            return response
+        if attempt == max_retries:
+            limiter.gave_up(host)
+            logger.debug(f"[ebooks] {host} 返回 {response.status}，已达重试上限")
+            return response
+        pause = limiter.throttled(host, response.headers.get("Retry-After"))
+        logger.debug(f"[ebooks] {host} 返回 {response.status}，{pause:.1f}s 后重试（第 {attempt + 1} 次）")
+
+
+async def _hedged(
+    session: aiohttp.ClientSession, method: str, url: str, hedge: str, hedge_url: Optional[str], kwargs: dict
+) -> Response:
+    hedging.earn()
+    delay = hedging.delay(hedge)
+    started = time.monotonic()
+    proxy = proxies.choose(url)
+    primary = asyncio.create_task(_attempt(session, method, url, proxy, kwargs))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and hedging.spend():
+            hedge_url = hedge_url or url
+            hedge_proxy = proxies.choose(hedge_url, avoid=proxy or DIRECT)
+            tasks.append(asyncio.create_task(_limited_attempt(session, method, hedge_url, hedge_proxy, kwargs)))
+        pending, failed = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if _answered(task):
+                    hedging.observe(hedge, time.monotonic() - started)
+                    hedging.won += task is not primary
+                    return task.result()
+                # an error or a 5xx only counts once the other request has failed too
+                failed = failed or task
+        return failed.result()
+    finally:
+        for task in tasks:
+            task.cancel()
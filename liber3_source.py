@@ -1,73 +1,151 @@
 import asyncio
+import time
 from typing import Optional
+from urllib.parse import quote
 
 import aiohttp
-from astrbot.api.all import Plain, Node, Nodes, File, logger
+from astrbot.api.all import File, logger
 
+from data.plugins.astrbot_plugin_ebooks.download_manager import DownloadError, DownloadManager, url_host
+from data.plugins.astrbot_plugin_ebooks.http_client import preconnect, proxies, request
+from data.plugins.astrbot_plugin_ebooks.metrics import metrics
+from data.plugins.astrbot_plugin_ebooks.records import BookRecord
+from data.plugins.astrbot_plugin_ebooks.tracing import trace_tag, tracer
 from data.plugins.astrbot_plugin_ebooks.utils import (
+    LatencyRanker,
     SharedSession,
     is_valid_liber3_book_id,
 )
 
+LIBER3_API_URL = "https://lgate.glitternode.ru/v1"
+DEFAULT_IPFS_GATEWAYS = [
+    "https://gateway-ipfs.st",
+    "https://ipfs.io",
+    "https://dweb.link",
+    "https://gateway.pinata.cloud",
+    "https://w3s.link",
+]
+IPFS_PROBE_TIMEOUT = 8
+
 
 class Liber3Source(SharedSession):
-    def __init__(self, config, proxy: str, max_results: int):
-        super().__init__(proxy)
+    paginated = False
+
+    def __init__(self, config, max_results: int, downloads: DownloadManager):
         self.config = config
         self.max_results = max_results
+        self.downloads = downloads
+        gateways = [
+            gateway.strip().rstrip("/")
+            for gateway in (self.config.get("liber3_ipfs_gateways") or [])
+            if isinstance(gateway, str) and gateway.strip()
+        ]
+        self.gateway_ranker = LatencyRanker(gateways or DEFAULT_IPFS_GATEWAYS)
 
     async def _get_liber3_book_details(self, book_ids: list) -> Optional[dict]:
-        detail_url = "https://lgate.glitternode.ru/v1/book"
+        detail_url = f"{LIBER3_API_URL}/book"
         headers = {"Content-Type": "application/json"}
         payload = {"book_ids": book_ids}
 
-        try:
-            session = await self.get_session()
-            async with session.post(detail_url, headers=headers, json=payload, proxy=self.proxy) as response:
+        with metrics.timer("Liber3", "detail") as timer:
+            try:
+                response = await request("POST", detail_url, headers=headers, json=payload, hedge="Liber3/book")
                 if response.status == 200:
-                    data = await response.json()
-                    return data.get("data", {}).get("book", {})
+                    return response.json().get("data", {}).get("book", {})
+                timer.fail()
                 logger.error(f"[Liber3] Error during detail request: Status code {response.status}")
-        except aiohttp.ClientError as e:
-            logger.error(f"[Liber3] HTTP client error: {e}")
-        except Exception as e:
-            logger.error(f"[Liber3] 发生意外错误: {e}")
-        return None
+            except aiohttp.ClientError as e:
+                timer.fail()
+                logger.error(f"[Liber3] HTTP client error: {e}")
+            except Exception as e:
+                timer.fail()
+                logger.error(f"[Liber3] 发生意外错误: {e}")
+            return None
 
     async def _search_liber3_books_with_details(self, word: str, limit: int = 50) -> Optional[dict]:
-        search_url = "https://lgate.glitternode.ru/v1/searchV2"
+        search_url = f"{LIBER3_API_URL}/searchV2"
         headers = {"Content-Type": "application/json"}
         payload = {"address": "", "word": word}
 
         try:
-            session = await self.get_session()
-            async with session.post(search_url, headers=headers, json=payload, proxy=self.proxy) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    book_data = data["data"].get("book", [])
-                    if not book_data:
-                        logger.info("[Liber3] 未找到匹配的电子书。")
-                        return None
-
-                    book_ids = [item.get("id") for item in book_data[:limit]]
-                    if not book_ids:
-                        logger.info("[Liber3] 未能提取电子书 ID。")
-                        return None
-
-                    detailed_books = await self._get_liber3_book_details(book_ids)
-                    if not detailed_books:
-                        logger.info("[Liber3] 未获取电子书详细信息。")
-                        return None
-
-                    return {"search_results": book_data[:limit], "detailed_books": detailed_books}
-                logger.error(f"[Liber3] 请求电子书搜索失败，状态码: {response.status}")
+            with tracer.span("Liber3/searchV2"):
+                response = await request("POST", search_url, headers=headers, json=payload, hedge="Liber3/searchV2")
+            if response.status != 200:
+                logger.error(f"[Liber3] 请求电子书搜索失败，状态码: {response.status}{trace_tag()}")
+                return None
+            data = response.json()
+
+            book_data = data["data"].get("book", [])
+            if not book_data:
+                logger.info("[Liber3] 未找到匹配的电子书。")
+                return None
+
+            book_ids = [item.get("id") for item in book_data[:limit]]
+            if not book_ids:
+                logger.info("[Liber3] 未能提取电子书 ID。")
+                return None
+
+            detailed_books = await self._get_liber3_book_details(book_ids)
+            if not detailed_books:
+                logger.info("[Liber3] 未获取电子书详细信息。")
+                return None
+
+            return {"search_results": book_data[:limit], "detailed_books": detailed_books}
         except aiohttp.ClientError as e:
             logger.error(f"[Liber3] HTTP 客户端错误: {e}")
         except Exception as e:
             logger.error(f"[Liber3] 发生意外错误: {e}")
         return None
 
-    async def search_nodes(self, event, query: str, limit: int):
+    async def _probe_gateway(self, gateway: str, ipfs_cid: str) -> Optional[str]:
+        """Fetch the first byte of the CID from a gateway and record its latency."""
+        url = f"{gateway}/ipfs/{ipfs_cid}"
+        start = time.monotonic()
+        try:
+            session = await self.get_session()
+            async with session.get(
+                url,
+                headers={"Range": "bytes=0-0"},
+                proxy=proxies.choose(url),
+                timeout=aiohttp.ClientTimeout(total=IPFS_PROBE_TIMEOUT),
+                allow_redirects=True,
+            ) as response:
+                if response.status in (200, 206):
+                    self.gateway_ranker.record_success(gateway, time.monotonic() - start)
+                    metrics.observe("IPFS", "probe", time.monotonic() - start)
+                    return gateway
+                logger.debug(f"[Liber3] IPFS 网关 {gateway} 返回状态码 {response.status}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"[Liber3] IPFS 网关 {gateway} 探测失败: {e}")
+        self.gateway_ranker.record_failure(gateway)
+        metrics.observe("IPFS", "probe", time.monotonic() - start, error=True)
+        return None
+
+    async def _select_gateway(self, ipfs_cid: str) -> Optional[str]:
+        """Pick the fastest healthy gateway, racing probes when rankings are stale."""
+        gateway = self.gateway_ranker.best()
+        if gateway:
+            return gateway
+
+        pending = {
+            asyncio.create_task(self._probe_gateway(gateway, ipfs_cid))
+            for gateway in self.gateway_ranker.ranked()
+        }
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result():
+                        return task.result()
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def search_records(self, query: str, limit: int):
+        """Return the matching books as records, or an error message string."""
         if not self.config.get("enable_liber3", False):
             return "[Liber3] 功能未启用。"
 
@@ -77,43 +155,39 @@ class Liber3Source(SharedSession):
         if not (1 <= limit <= 100):
             return "[Liber3] 请确认搜索返回结果数量在 1-100 之间。"
 
-        try:
-            logger.info(f"[Liber3] Received books search query: {query}, limit: {limit}")
-            results = await self._search_liber3_books_with_details(query, limit)
-            if not results:
-                return "[Liber3] 未找到匹配的电子书。"
-
-            search_results = results.get("search_results", [])
-            detailed_books = results.get("detailed_books", {})
-
-            async def construct_node(book):
-                book_id = book.get("id")
-                detail = detailed_books.get(book_id, {}).get("book", {})
-
-                chain = [
-                    Plain(f"书名: {book.get('title', '未知')}\n"),
-                    Plain(f"作者: {book.get('author', '未知')}\n"),
-                    Plain(f"年份: {detail.get('year', '未知')}\n"),
-                    Plain(f"出版社: {detail.get('publisher', '未知')}\n"),
-                    Plain(f"语言: {detail.get('language', '未知')}\n"),
-                    Plain(f"文件大小: {detail.get('filesize', '未知')}\n"),
-                    Plain(f"文件类型: {detail.get('extension', '未知')}\n"),
-                    Plain(f"ID(用于下载): L{book_id}"),
-                ]
-
-                return Node(
-                    uin=event.get_self_id(),
-                    name="Liber3",
-                    content=chain,
-                )
-
-            tasks = [construct_node(book) for book in search_results]
-            return await asyncio.gather(*tasks)
-        except Exception as e:
-            logger.error(f"[Liber3] 搜索失败: {e}")
-            return "[Liber3] 搜索电子书时发生错误，请稍后再试。"
-
-    async def download(self, event, book_id: str = None):
+        with metrics.timer("Liber3", "search") as timer:
+            try:
+                logger.info(f"[Liber3] Received books search query: {query}, limit: {limit}{trace_tag()}")
+                results = await self._search_liber3_books_with_details(query, limit)
+                if not results:
+                    return "[Liber3] 未找到匹配的电子书。"
+
+                detailed_books = results.get("detailed_books", {})
+                records = []
+                for book in results.get("search_results", []):
+                    book_id = book.get("id")
+                    detail = detailed_books.get(book_id, {}).get("book", {})
+                    records.append(
+                        BookRecord(
+                            "liber3",
+                            (f"L{book_id}",),
+                            title=book.get("title"),
+                            authors=book.get("author"),
+                            year=detail.get("year"),
+                            publisher=detail.get("publisher"),
+                            language=detail.get("language"),
+                            extension=detail.get("extension"),
+                            filesize=detail.get("filesize"),
+                            isbn=detail.get("isbn"),
+                        )
+                    )
+                return records
+            except Exception as e:
+                timer.fail()
+                logger.error(f"[Liber3] 搜索失败: {e}{trace_tag()}")
+                return "[Liber3] 搜索电子书时发生错误，请稍后再试。"
+
+    async def download(self, event, book_id: str = None, progress=None):
         if not self.config.get("enable_liber3", False):
             return [event.plain_result("[Liber3] 功能未启用。")]
 
@@ -134,9 +208,42 @@ class Liber3Source(SharedSession):
         if not ipfs_cid or not extension:
             return [event.plain_result("[Liber3] 电子书信息不足，无法完成下载。")]
 
-        ebook_url = f"https://gateway-ipfs.st/ipfs/{ipfs_cid}?filename={book_name}.{extension}"
-        file = File(name=f"{book_name}.{extension}", url=ebook_url)
+        return await self.download_cid(event, ipfs_cid, f"{book_name}.{extension}", progress=progress)
+
+    async def download_cid(self, event, ipfs_cid: str, file_name: str, progress=None):
+        """Download an IPFS CID through the fastest gateway and return the event results."""
+
+        async def fetch(transfer):
+            gateway = await self._select_gateway(ipfs_cid)
+            if not gateway:
+                raise DownloadError("所有 IPFS 网关均无法访问，请稍后再试。")
+            logger.info(f"[Liber3] 使用 IPFS 网关: {gateway}")
+            ebook_url = f"{gateway}/ipfs/{ipfs_cid}?filename={quote(file_name)}"
+            session = await self.get_session()
+            try:
+                # queue on the gateway actually picked, not on whichever ranked first when the download was submitted
+                async with self.downloads.hold_slots(transfer, url_host(gateway)):
+                    return await self.downloads.fetch_to_file(
+                        transfer, session, ebook_url, proxy=proxies.choose(ebook_url), filename=file_name
+                    )
+            except Exception:
+                self.gateway_ranker.record_failure(gateway)
+                raise
+
+        try:
+            temp_file_path, file_name = await self.downloads.submit(f"ipfs:{ipfs_cid}", None, fetch, progress=progress)
+        except DownloadError as e:
+            logger.error(f"[Liber3] 下载失败: {e}")
+            return [event.plain_result(f"[Liber3] 无法下载电子书，{e}")]
+        except Exception as e:
+            logger.error(f"[Liber3] 下载失败: {e}")
+            return [event.plain_result("[Liber3] 下载电子书时发生错误，请稍后再试。")]
+
+        file = File(name=file_name, file=temp_file_path)
         return [event.chain_result([file])]
 
+    async def warm(self) -> bool:
+        return await preconnect(LIBER3_API_URL)
+
     async def close(self):
         await self.close_session()
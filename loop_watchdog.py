@@ -0,0 +1,177 @@
+import asyncio
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+from astrbot.api.all import logger
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+LAG_SAMPLES = 1024
+MAX_BLOCKING_SITES = 50
+STACK_DEPTH = 12
+
+
+def _short_path(filename: str) -> str:
+    if filename.startswith(PLUGIN_DIR + os.sep):
+        return os.path.relpath(filename, PLUGIN_DIR)
+    return os.path.join(*filename.split(os.sep)[-2:])
+
+
+def _frame_label(frame: traceback.FrameSummary) -> str:
+    return f"{_short_path(frame.filename)}:{frame.lineno} {frame.name}"
+
+
+class BlockingSite:
+    """Stalls attributed to one line of plugin code."""
+
+    __slots__ = ("site", "blocked_in", "count", "total", "longest", "stack")
+
+    def __init__(self, site: str, blocked_in: str, stack: list[str]):
+        self.site = site
+        self.blocked_in = blocked_in
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+        self.stack = stack
+
+
+class LoopWatchdog:
+    """Measure event-loop lag and find out what blocks the loop.
+
+    A heartbeat task sleeps for ``interval`` and records how late it wakes.
+    A sampler thread watches the heartbeat; when the loop has not run it for
+    longer than ``threshold`` it captures the loop thread's stack. Each stall
+    is charged to the innermost plugin frame of that stack (the innermost
+    frame overall when the plugin isn't on it), so repeated offenders add up
+    under one call site.
+    """
+
+    def __init__(self, threshold: float = 0.2, interval: float = 0.05):
+        self.threshold = threshold
+        self.interval = interval
+        self.lags: deque[float] = deque(maxlen=LAG_SAMPLES)
+        self.beats = 0
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.sites: dict[str, BlockingSite] = {}
+        self.started_at = time.time()
+        self._beat = time.monotonic()
+        self._captured: tuple[float, Optional[list[traceback.FrameSummary]]] = (0.0, None)
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("[ebooks] 事件循环未运行，无法启动阻塞检测。")
+            return
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = loop.create_task(self._heartbeat())
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample, name="ebooks-loop-watchdog", daemon=True)
+        self._sampler.start()
+        logger.info(f"[ebooks] 已启动事件循环阻塞检测，阈值 {self.threshold * 1000:.0f}ms。")
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._sampler is not None:
+            await asyncio.to_thread(self._sampler.join)
+            self._sampler = None
+
+    def reset(self):
+        self.lags.clear()
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.sites.clear()
+        self.started_at = time.time()
+
+    async def _heartbeat(self):
+        while True:
+            beat = self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - beat - self.interval)
+            self.beats += 1
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self.stalls += 1
+                captured_beat, stack = self._captured
+                self._record_stall(lag, stack if captured_beat == beat else None)
+
+    def _sample(self):
+        """Runs in its own thread: capture the loop thread's stack once per stall."""
+        while not self._stop.wait(min(self.interval, self.threshold) / 2):
+            beat = self._beat
+            if self._captured[0] == beat or time.monotonic() - beat - self.interval < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                self._captured = (beat, traceback.extract_stack(frame))
+
+    def _record_stall(self, lag: float, stack: Optional[list[traceback.FrameSummary]]):
+        if not stack:
+            site_key, blocked_in, lines = "未知位置", "", []
+        else:
+            own = [
+                index for index, frame in enumerate(stack)
+                if frame.filename.startswith(PLUGIN_DIR + os.sep) and frame.filename != os.path.abspath(__file__)
+            ]
+            site_key = _frame_label(stack[own[-1]] if own else stack[-1])
+            blocked_in = _frame_label(stack[-1])
+            # from the outermost plugin frame down, eliding the middle of deep library calls
+            lines = [_frame_label(frame) for frame in stack[own[0] if own else 0 :]]
+            if len(lines) > STACK_DEPTH:
+                half = STACK_DEPTH // 2
+                lines = lines[:half] + ["..."] + lines[-half:]
+
+        site = self.sites.get(site_key)
+        if site is None:
+            if len(self.sites) >= MAX_BLOCKING_SITES:
+                del self.sites[min(self.sites.values(), key=lambda s: s.total).site]
+            site = self.sites[site_key] = BlockingSite(site_key, blocked_in, lines)
+        site.count += 1
+        site.total += lag
+        site.longest = max(site.longest, lag)
+        # the first stall at a site is logged with its stack, repeats only in the summary
+        if site.count == 1:
+            logger.warning(
+                f"[ebooks] 事件循环被阻塞 {lag * 1000:.0f}ms，位置: {site_key}"
+                + (f"，阻塞于 {blocked_in}" if blocked_in and blocked_in != site_key else "")
+                + ("\n  " + "\n  ".join(lines) if lines else "")
+            )
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.lags:
+            return None
+        ordered = sorted(self.lags)
+        return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+    def summary_lines(self, top: int = 10) -> list[str]:
+        if not self.lags:
+            return []
+        p50, p99 = self.percentile(50), self.percentile(99)
+        lines = [
+            f"事件循环延迟: p50/p99/max {p50 * 1000:.0f}/{p99 * 1000:.0f}/{self.max_lag * 1000:.0f} ms，"
+            f"超过 {self.threshold * 1000:.0f}ms 的阻塞 {self.stalls} 次"
+        ]
+        for site in sorted(self.sites.values(), key=lambda s: s.total, reverse=True)[:top]:
+            line = f"  {site.site}: {site.count} 次，累计 {site.total:.2f}s，最长 {site.longest * 1000:.0f}ms"
+            if site.blocked_in and site.blocked_in != site.site:
+                line += f"（阻塞于 {site.blocked_in}）"
+            lines.append(line)
+        return lines
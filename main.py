@@ -1,20 +1,48 @@
-from typing import Union
+import re
+import time
+from functools import partial
+from importlib import import_module
+from typing import Optional, Union
 
 from astrbot.api.all import *
 from astrbot.api.event.filter import *
-from data.plugins.astrbot_plugin_ebooks.annas_source import AnnasSource
-from data.plugins.astrbot_plugin_ebooks.archive_source import ArchiveSource
-from data.plugins.astrbot_plugin_ebooks.calibre_source import CalibreSource
-from data.plugins.astrbot_plugin_ebooks.liber3_source import Liber3Source
+from data.plugins.astrbot_plugin_ebooks.download_cache import DownloadCache
+from data.plugins.astrbot_plugin_ebooks.download_jobs import DownloadJobQueue
+from data.plugins.astrbot_plugin_ebooks.download_manager import DownloadManager, parse_segment_rules, url_host
+from data.plugins.astrbot_plugin_ebooks.http_client import (
+    close_session,
+    hedging,
+    limiter,
+    parse_proxy_rules,
+    parse_rate_rules,
+    preconnect,
+    proxies,
+)
+from data.plugins.astrbot_plugin_ebooks.loop_watchdog import LoopWatchdog
+from data.plugins.astrbot_plugin_ebooks.md5_resolver import Md5Resolver, contains_file
+from data.plugins.astrbot_plugin_ebooks.metrics import metrics
+from data.plugins.astrbot_plugin_ebooks.records import PLATFORM_NAMES, BookRecord, render_nodes
+from data.plugins.astrbot_plugin_ebooks.result_sets import MAX_RESULT_SETS, ResultSet, SourceCursor
+from data.plugins.astrbot_plugin_ebooks.tracing import trace_tag, tracer
 from data.plugins.astrbot_plugin_ebooks.utils import (
+    TTLCache,
+    classify_download_identifiers,
     is_valid_annas_book_id,
-    is_valid_archive_book_url,
-    is_valid_calibre_book_url,
-    is_valid_liber3_book_id,
     normalize_limit,
     to_event_results,
 )
-from data.plugins.astrbot_plugin_ebooks.zlib_source import ZlibSource
+from data.plugins.astrbot_plugin_ebooks.warmup import ConnectionWarmer
+
+MAX_BATCH_DOWNLOADS = 10
+# platform -> (module, class); a source module pulls in its HTTP and parsing
+# dependencies, so it is only imported when the platform is first used
+SOURCE_CLASSES = {
+    "calibre": ("calibre_source", "CalibreSource"),
+    "liber3": ("liber3_source", "Liber3Source"),
+    "archive": ("archive_source", "ArchiveSource"),
+    "zlib": ("zlib_source", "ZlibSource"),
+    "annas": ("annas_source", "AnnasSource"),
+}
 
 
 @register("ebooks", "buding", "一个功能强大的电子书搜索和下载插件", "2.0.0", "https://github.com/zouyonghe/astrbot_plugin_ebooks")
@@ -22,7 +50,6 @@ class ebooks(Star):
     def __init__(self, context: Context, config: AstrBotConfig):
         super().__init__(context)
         self.config = config
-        self.proxy = os.environ.get("https_proxy")
         self.TEMP_PATH = os.path.abspath("data/temp")
         os.makedirs(self.TEMP_PATH, exist_ok=True)
         self.max_results = self.config.get("max_results", 20)
@@ -35,24 +62,108 @@ class ebooks(Star):
             self.config.save_config()
             logger.info("[ebooks] 未设置 Calibre-Web URL，禁用该平台。")
 
-        self.calibre_source = CalibreSource(self.config, self.proxy, self.max_results)
-        self.liber3_source = Liber3Source(self.config, self.proxy, self.max_results)
-        self.archive_source = ArchiveSource(self.config, self.proxy, self.max_results, self.TEMP_PATH)
-        self.zlib_source = ZlibSource(self.config, self.proxy, self.max_results, self.TEMP_PATH)
-        self.annas_source = AnnasSource(self.config, self.proxy, self.max_results)
+        self.download_cache = DownloadCache(
+            os.path.join(self.TEMP_PATH, "cache"),
+            max_bytes=self.config.get("download_cache_max_mb", 1024) * 1024 * 1024,
+            pin_seconds=self.config.get("download_cache_pin_seconds", 600),
+        )
+        self.download_manager = DownloadManager(
+            self.TEMP_PATH,
+            self.download_cache,
+            max_concurrent=self.config.get("download_max_concurrency", 3),
+            max_per_host=self.config.get("download_max_per_host", 2),
+            segment_rules=parse_segment_rules(self.config.get("download_segments", [])),
+            segment_min_bytes=self.config.get("download_segment_min_mb", 8) * 1024 * 1024,
+        )
+        self.download_jobs = DownloadJobQueue(
+            self.context,
+            workers=self.config.get("download_job_workers", 2),
+            progress_interval=self.config.get("download_progress_interval", 15),
+        )
+
+        self.sources = {}
+        self.md5_resolver = Md5Resolver(self.config, self._get_source)
+        self.result_sets = TTLCache(maxsize=MAX_RESULT_SETS, ttl=self.config.get("search_result_ttl", 1800))
+        self.listed_results = TTLCache(maxsize=MAX_RESULT_SETS, ttl=self.config.get("search_result_ttl", 1800))
+        tracer.configure(self.config.get("enable_tracing", False), self.config.get("trace_slow_threshold_ms", 5000))
+        hedging.configure(self.config.get("enable_request_hedging", False), self.config.get("hedge_budget_percent", 10))
+        limiter.configure(parse_rate_rules(self.config.get("rate_limits", [])))
+        proxies.configure(self.config.get("proxy_pool", []), parse_proxy_rules(self.config.get("proxy_rules", [])))
+        self.watchdog = None
+        if self.config.get("enable_loop_watchdog", False):
+            self.watchdog = LoopWatchdog(threshold=max(10, self.config.get("loop_watchdog_threshold_ms", 200)) / 1000)
+            self.watchdog.start()
+        self.warmer = None
+        if self.config.get("enable_connection_warmup", False):
+            self.warmer = ConnectionWarmer(
+                self._warmup_targets,
+                interval=self.config.get("warmup_interval", 45),
+                idle_timeout=self.config.get("warmup_idle_minutes", 30) * 60,
+            )
+            self.warmer.start()
 
     async def terminate(self):
-        await asyncio.gather(
-            self.calibre_source.close(),
-            self.liber3_source.close(),
-            self.archive_source.close(),
-            self.zlib_source.terminate(),
-        )
+        await self.download_jobs.stop()
+        if self.watchdog:
+            await self.watchdog.stop()
+        if self.warmer:
+            await self.warmer.stop()
+        await asyncio.gather(*(source.close() for source in self.sources.values()))
+        await close_session()
+        self.download_cache.close()
+
+    def _warmup_targets(self) -> dict:
+        """Enabled platforms, plus the extra hosts such as cover CDNs from ``warmup_urls``."""
+        targets = {
+            PLATFORM_NAMES[platform]: self._build_source(platform).warm
+            for platform in SOURCE_CLASSES
+            if self.config.get(f"enable_{platform}", False)
+        }
+        for url in self.config.get("warmup_urls") or []:
+            if isinstance(url, str) and url.strip():
+                targets[url_host(url.strip())] = partial(preconnect, url.strip())
+        return targets
+
+    def _get_source(self, platform: str):
+        """Return the platform's source for a search or download, which also counts as activity for the warmer."""
+        if self.warmer:
+            self.warmer.touch()
+        return self._build_source(platform)
+
+    def _build_source(self, platform: str):
+        """Return the platform's source, importing and building it on first use."""
+        source = self.sources.get(platform)
+        if source is None:
+            module_name, class_name = SOURCE_CLASSES[platform]
+            source_class = getattr(import_module(f"data.plugins.astrbot_plugin_ebooks.{module_name}"), class_name)
+            if platform == "annas":
+                source = source_class(self.config, self.max_results)
+            else:
+                source = source_class(self.config, self.max_results, self.download_manager)
+            self.sources[platform] = source
+        return source
 
     async def _yield_download_results(self, results):
         for item in results:
             yield item
 
+    def _remember_listing(self, event: AstrMessageEvent, entries: list[list[BookRecord]], start: int):
+        """Remember the numbered books just rendered in this conversation for /ebooks get."""
+        listing = {start + offset: entry for offset, entry in enumerate(entries)}
+        self.listed_results.set(event.unified_msg_origin, listing)
+
+    async def _search_platform(self, event: AstrMessageEvent, platform_name: str, query: str, search, limit: int):
+        """Await one platform's ``search_records`` coroutine and render its results, as one trace."""
+        with tracer.trace(f"{platform_name} search “{query}”"):
+            records = await search
+            if isinstance(records, str):
+                return [event.plain_result(records)]
+            entries = [[record] for record in records[:limit]]
+            self._remember_listing(event, entries, start=1)
+            with metrics.timer(platform_name, "render"):
+                nodes = await render_nodes(event, entries, start=1)
+            return to_event_results(event, platform_name, nodes)
+
     @command_group("calibre")
     def calibre(self):
         pass
@@ -63,19 +174,19 @@ class ebooks(Star):
         if err:
             yield event.plain_result(f"[Calibre-Web] {err}")
             return
-        result = await self.calibre_source.search_nodes(event, query, limit_value)
-        for response in to_event_results(event, "Calibre-Web", result):
+        search = self._get_source("calibre").search_records(query, limit_value)
+        for response in await self._search_platform(event, "Calibre-Web", query, search, limit_value):
             yield response
 
     @calibre.command("download")
     async def download_calibre(self, event: AstrMessageEvent, book_url: str = None):
-        results = await self.calibre_source.download(event, book_url)
+        results = await self._get_source("calibre").download(event, book_url)
         async for response in self._yield_download_results(results):
             yield response
 
     @calibre.command("recommend")
     async def recommend_calibre(self, event: AstrMessageEvent, n: int):
-        results = await self.calibre_source.recommend(event, n)
+        results = await self._get_source("calibre").recommend(event, n)
         async for response in self._yield_download_results(results):
             yield response
 
@@ -97,13 +208,13 @@ class ebooks(Star):
         if err:
             yield event.plain_result(f"[Liber3] {err}")
             return
-        result = await self.liber3_source.search_nodes(event, query, limit_value)
-        for response in to_event_results(event, "Liber3", result):
+        search = self._get_source("liber3").search_records(query, limit_value)
+        for response in await self._search_platform(event, "Liber3", query, search, limit_value):
             yield response
 
     @liber3.command("download")
     async def download_liber3(self, event: AstrMessageEvent, book_id: str = None):
-        results = await self.liber3_source.download(event, book_id)
+        results = await self._get_source("liber3").download(event, book_id)
         async for response in self._yield_download_results(results):
             yield response
 
@@ -126,13 +237,13 @@ class ebooks(Star):
         if err:
             yield event.plain_result(f"[archive.org] {err}")
             return
-        result = await self.archive_source.search_nodes(event, query, limit_value)
-        for response in to_event_results(event, "archive.org", result):
+        search = self._get_source("archive").search_records(query, limit_value)
+        for response in await self._search_platform(event, "archive.org", query, search, limit_value):
             yield response
 
     @archive.command("download")
     async def download_archive(self, event: AstrMessageEvent, book_url: str = None):
-        results = await self.archive_source.download(event, book_url)
+        results = await self._get_source("archive").download(event, book_url)
         async for response in self._yield_download_results(results):
             yield response
 
@@ -157,13 +268,13 @@ class ebooks(Star):
         if err:
             yield event.plain_result(f"[Z-Library] {err}")
             return
-        result = await self.zlib_source.search_nodes(event, query, limit_value)
-        for response in to_event_results(event, "Z-Library", result):
+        search = self._get_source("zlib").search_records(query, limit_value)
+        for response in await self._search_platform(event, "Z-Library", query, search, limit_value):
             yield response
 
     @zlib.command("download")
     async def download_zlib(self, event: AstrMessageEvent, book_id: str = None, book_hash: Union[str, int] = None):
-        results = await self.zlib_source.download(event, book_id, book_hash)
+        results = await self._get_source("zlib").download(event, book_id, book_hash)
         async for response in self._yield_download_results(results):
             yield response
 
@@ -183,18 +294,37 @@ class ebooks(Star):
         pass
 
     @annas.command("search")
-    async def search_annas(self, event: AstrMessageEvent, query: str, limit: str = ""):
+    async def search_annas(
+        self,
+        event: AstrMessageEvent,
+        query: str,
+        limit: str = "",
+        option1: str = "",
+        option2: str = "",
+        option3: str = "",
+    ):
         limit_value, err = normalize_limit(limit, self.max_results, 1, 60, clamp_max=True)
         if err:
             yield event.plain_result(f"[Anna's Archive] {err}")
             return
-        result = await self.annas_source.search_nodes(event, query, limit_value)
-        for response in to_event_results(event, "anna's archive", result):
+        from data.plugins.astrbot_plugin_ebooks.annas_source import parse_annas_filters
+
+        language, file_type, order_by, unknown = parse_annas_filters([option1, option2, option3])
+        if unknown:
+            yield event.plain_result(
+                f"[Anna's Archive] 无法识别的筛选条件：{' '.join(unknown)}，"
+                "可用语言代码（如 zh、en、any）、文件格式（如 epub、pdf）或排序（newest、oldest、largest、smallest）。"
+            )
+            return
+        search = self._get_source("annas").search_records(
+            query, limit_value, language=language, file_type=file_type, order_by=order_by
+        )
+        for response in await self._search_platform(event, "Anna's Archive", query, search, limit_value):
             yield response
 
     @annas.command("download")
     async def download_annas(self, event: AstrMessageEvent, book_id: str = None):
-        results = await self.annas_source.download(event, book_id)
+        results = await self._download_item(event, "annas", (book_id,))
         async for response in self._yield_download_results(results):
             yield response
 
@@ -230,20 +360,25 @@ class ebooks(Star):
             "  - `/liber3 download <ID>`：通过 Liber3 平台下载电子书。",
             "",
             "- **Anna's Archive**:",
-            "  - `/annas search <关键词> [数量]`：搜索 Anna's Archive 平台上的电子书。例如：`/annas search Python 20`。",
-            "  - `/annas download <ID>`：获取 Anna's Archive 电子书下载链接。",
+            "  - `/annas search <关键词> [数量] [语言] [格式] [排序]`：搜索 Anna's Archive 平台上的电子书，筛选条件顺序任意。例如：`/annas search Python 20 en epub newest`。",
+            "  - `/annas download <ID>`：下载 Anna's Archive 电子书，同时向 Liber3、Anna's Archive IPFS 链接和 Z-Library 查询并从最先响应的来源下载，均不可用时返回下载链接。",
             "",
             "- **通用命令**:",
             "  - `/ebooks help`：显示当前插件的帮助信息。",
-            "  - `/ebooks search <关键词> [数量]`：在所有支持的平台中同时搜索电子书。例如：`/ebooks search Python 20`。",
-            "  - `/ebooks download <URL/ID> [Hash]`：通用的电子书下载方式。",
+            "  - `/ebooks search <关键词> [数量]`：在所有支持的平台中同时搜索电子书，合并各平台的重复结果并排序。例如：`/ebooks search Python 20`。",
+            "  - `/ebooks next`：查看上一次搜索的下一页结果。",
+            "  - `/ebooks page <页码>`：查看上一次搜索的指定页结果。",
+            "  - `/ebooks get <序号>`：下载上一次搜索结果中对应序号的电子书，无需复制 ID 或链接。",
+            "  - `/ebooks download <URL/ID> [Hash]`：通用的电子书下载方式，可一次提供多个链接或 ID（空格或逗号分隔）批量下载。",
+            "  - `/ebooks jobs [cancel <任务ID>]`：查看或取消后台下载任务（需启用后台下载）。",
+            "  - `/ebooks stats [reset|dump]`：查看各平台各阶段的请求量、失败数、延迟分位数和缓存命中率，启用阻塞检测时还会列出事件循环延迟和阻塞位置（仅管理员）。",
             "",
             "---",
             "📒 **注意事项**:",
-            "- `数量` 为可选参数，默认为20，用于限制搜索结果的返回数量，数量超过30会分多个转发发送。",
+            "- `数量` 为可选参数，默认为20，用于限制搜索结果的返回数量，数量超过30会分多个转发发送。`/ebooks search` 中为每页显示的数量，其余结果缓存在会话中供翻页。",
             "- 下载指令要根据搜索结果，提供有效的 URL、ID 和 Hash 值。",
             "- 推荐功能会从现有书目中随机选择书籍进行展示（目前仅支持Calibre-Web)。",
-            "- 目前无法直接从 Anna's Archive 下载电子书。",
+            "- Anna's Archive 电子书通过其他平台按 md5 解析下载，无法解析时只返回下载链接。",
             "",
             "---",
             "🌐 **支持平台**:",
@@ -256,57 +391,181 @@ class ebooks(Star):
 
     @ebooks.command("search")
     async def search_all_platforms(self, event: AstrMessageEvent, query: str = None, limit: str = ""):
-        limit, err = normalize_limit(limit, self.max_results, 1, 50)
+        with tracer.trace(f"ebooks search “{query}”"):
+            responses = await self._search_all_platforms(event, query, limit)
+        for response in responses:
+            yield response
+
+    async def _search_all_platforms(self, event: AstrMessageEvent, query: Optional[str], limit: str):
+        with tracer.span("ebooks/validate"):
+            limit, err = normalize_limit(limit, self.max_results, 1, 50)
         if not query:
-            yield event.plain_result("[ebooks] 请提供电子书关键词以进行搜索。")
-            return
+            return [event.plain_result("[ebooks] 请提供电子书关键词以进行搜索。")]
 
         if err:
-            yield event.plain_result(f"[ebooks] {err}")
-            return
-
-        tasks = []
-        if self.config.get("enable_calibre", False):
-            tasks.append(("Calibre-Web", self.calibre_source.search_nodes(event, query, limit)))
-        if self.config.get("enable_liber3", False):
-            tasks.append(("Liber3", self.liber3_source.search_nodes(event, query, limit)))
-        if self.config.get("enable_archive", False):
-            tasks.append(("archive.org", self.archive_source.search_nodes(event, query, limit)))
-        if self.config.get("enable_zlib", False):
-            tasks.append(("Z-Library", self.zlib_source.search_nodes(event, query, limit)))
-        if self.config.get("enable_annas", False):
-            tasks.append(("Anna's Archive", self.annas_source.search_nodes(event, query, limit)))
+            return [event.plain_result(f"[ebooks] {err}")]
 
+        result_set = ResultSet(
+            query,
+            page_size=limit,
+            cursors=self._search_cursors(query, limit),
+            merge=self.config.get("enable_search_merge", True),
+        )
         try:
-            search_results = await asyncio.gather(*[task for _, task in tasks])
-            named_results = list(zip([name for name, _ in tasks], search_results))
-            if self.config.get("enable_merge_forward", False):
-                ns = Nodes([])
-                for platform_name, platform_results in named_results:
-                    if isinstance(platform_results, str):
-                        node = Node(
-                            uin=event.get_self_id(),
-                            name="ebooks",
-                            content=[Plain(platform_results)],
-                        )
-                        ns.nodes.append(node)
-                        continue
-                    for i in range(0, len(platform_results), 30):
-                        chunk_results = platform_results[i:i + 30]
-                        node = Node(
-                            uin=event.get_self_id(),
-                            name="ebooks",
-                            content=chunk_results,
-                        )
-                        ns.nodes.append(node)
-                yield event.chain_result([ns])
-            else:
-                for platform_name, platform_results in named_results:
-                    for response in to_event_results(event, platform_name, platform_results):
-                        yield response
+            notes = await result_set.fetch_more()
+            if not result_set.entries:
+                return [event.plain_result("\n".join(notes) or "[ebooks] 未找到匹配的电子书。")]
+            self.result_sets.set(event.unified_msg_origin, result_set)
+            return await self._render_result_page(event, result_set, 1, notes)
         except Exception as e:
-            logger.error(f"[ebooks] Error during multi-platform search: {e}")
-            yield event.plain_result(f"[ebooks] 搜索电子书时发生错误，请稍后再试。")
+            logger.error(f"[ebooks] Error during multi-platform search: {e}{trace_tag()}")
+            return [event.plain_result(f"[ebooks] 搜索电子书时发生错误，请稍后再试。")]
+
+    def _search_cursors(self, query: str, limit: int) -> list[SourceCursor]:
+        def fetcher(source):
+            if source.paginated:
+                return lambda page: source.search_records(query, limit, page=page)
+            return lambda page: source.search_records(query, limit)
+
+        cursors = []
+        for platform in SOURCE_CLASSES:
+            if self.config.get(f"enable_{platform}", False):
+                source = self._get_source(platform)
+                cursors.append(SourceCursor(PLATFORM_NAMES[platform], fetcher(source), source.paginated))
+        return cursors
+
+    async def _render_result_page(self, event: AstrMessageEvent, result_set: ResultSet, page: int, notes=()):
+        entries = await result_set.get_page(page)
+        if entries is None:
+            return [event.plain_result(f"[ebooks] 没有第 {page} 页，当前共 {result_set.page_count} 页搜索结果。")]
+
+        start = (page - 1) * result_set.page_size + 1
+        self._remember_listing(event, entries, start)
+        with metrics.timer("ebooks", "render"):
+            nodes = await render_nodes(event, entries, start=start)
+        page_count = f"{result_set.page_count}{'+' if result_set.has_more_upstream else ''}"
+        header = f"[ebooks] “{result_set.query}” 的搜索结果，第 {page}/{page_count} 页，已获取 {len(result_set.entries)} 本电子书"
+        if page < result_set.page_count or result_set.has_more_upstream:
+            header += "，发送 /ebooks next 查看下一页"
+        header = "\n".join([header + "。", *notes])
+
+        if self.config.get("enable_merge_forward", False):
+            header_node = Node(uin=event.get_self_id(), name="ebooks", content=[Plain(header)])
+            return to_event_results(event, "ebooks", [header_node, *nodes])
+        return [event.plain_result(header), *to_event_results(event, "ebooks", nodes)]
+
+    @ebooks.command("next")
+    async def next_result_page(self, event: AstrMessageEvent):
+        async for response in self._show_result_page(event, None):
+            yield response
+
+    @ebooks.command("page")
+    async def goto_result_page(self, event: AstrMessageEvent, page: str = ""):
+        if not str(page).isdigit() or int(page) < 1:
+            yield event.plain_result("[ebooks] 请提供有效的页码，例如：/ebooks page 2")
+            return
+        async for response in self._show_result_page(event, int(page)):
+            yield response
+
+    async def _show_result_page(self, event: AstrMessageEvent, page: Optional[int]):
+        result_set = self.result_sets.get(event.unified_msg_origin)
+        if result_set is None:
+            yield event.plain_result("[ebooks] 没有可翻页的搜索结果，请先使用 /ebooks search 搜索。")
+            return
+        # paging keeps the result set alive for another TTL
+        self.result_sets.set(event.unified_msg_origin, result_set)
+        page = page or result_set.page + 1
+        with tracer.trace(f"ebooks page {page} “{result_set.query}”"):
+            try:
+                responses = await self._render_result_page(event, result_set, page)
+            except Exception as e:
+                logger.error(f"[ebooks] Error while paging search results: {e}{trace_tag()}")
+                responses = [event.plain_result("[ebooks] 获取搜索结果时发生错误，请稍后再试。")]
+        for response in responses:
+            yield response
+
+    async def _download_item(self, event: AstrMessageEvent, platform: str, args: tuple, progress=None):
+        if platform == "zlib":
+            return await self._get_source("zlib").download(event, *args, progress=progress)
+        if platform == "calibre":
+            return await self._get_source("calibre").download(event, *args, progress=progress)
+        if platform == "archive":
+            return await self._get_source("archive").download(event, *args, progress=progress)
+        if platform == "liber3":
+            return await self._get_source("liber3").download(event, *args, progress=progress)
+        if platform == "annas":
+            book_id = args[0]
+            if (
+                self.config.get("enable_annas", False)
+                and self.config.get("enable_md5_resolver", True)
+                and is_valid_annas_book_id(book_id)
+            ):
+                results = await self.md5_resolver.download(event, book_id[1:], progress=progress)
+                if results:
+                    return results
+            return await self._get_source("annas").download(event, book_id)
+        return [
+            event.plain_result(
+                "[ebooks] 未识别的输入格式，请提供以下格式之一：\n"
+                "- Calibre-Web 下载链接\n"
+                "- archive.org 下载链接\n"
+                "- Liber3/Annas Archive 32位 ID\n"
+                "- Z-Library 的 ID 和 Hash"
+            )
+        ]
+
+    async def _download_by_identifier(self, event: AstrMessageEvent, arg1: str, arg2: str = None, progress=None):
+        """Dispatch an identifier to its platform and return the platform's event results."""
+        if arg1 and arg2:
+            platform, args = "zlib", (arg1, arg2)
+        else:
+            platform, args = classify_download_identifiers([arg1])[0]
+        if platform in PLATFORM_NAMES:
+            logger.info(f"[ebooks] ⏳ 检测到 {PLATFORM_NAMES[platform]} 标识，开始下载...")
+        return await self._download_item(event, platform, args, progress=progress)
+
+    async def _download_batch(self, event: AstrMessageEvent, items: list[tuple[str, tuple]]):
+        """Download several items concurrently, bounded per platform, with one summary reply."""
+        per_platform = max(1, self.config.get("batch_download_per_platform", 2))
+        semaphores = {platform: asyncio.Semaphore(per_platform) for platform, _ in items}
+
+        async def run(platform: str, args: tuple):
+            if platform not in PLATFORM_NAMES:
+                return False, "未识别的格式", []
+            async with semaphores[platform]:
+                try:
+                    results = await self._download_item(event, platform, args)
+                except Exception as e:
+                    logger.error(f"[ebooks] 批量下载 {' '.join(args)} 失败: {e}")
+                    return False, "下载时发生错误", []
+            delivered = [
+                result for result in results if any(isinstance(c, (File, Node, Nodes)) for c in result.chain)
+            ]
+            if delivered:
+                return True, "", delivered
+            reason = "".join(c.text for result in results for c in result.chain if isinstance(c, Plain))
+            return False, reason or "下载失败", []
+
+        logger.info(f"[ebooks] 开始批量下载 {len(items)} 本电子书")
+        outcomes = await asyncio.gather(*[run(platform, args) for platform, args in items])
+
+        succeeded = sum(1 for ok, _, _ in outcomes if ok)
+        lines = [f"[ebooks] 批量下载完成：成功 {succeeded}/{len(items)}"]
+        for (platform, args), (ok, reason, _) in zip(items, outcomes):
+            label = f"{PLATFORM_NAMES.get(platform, '未知')} {' '.join(args)}"
+            lines.append(f"✅ {label}" if ok else f"❌ {label}：{reason}")
+        responses = [event.plain_result("\n".join(lines))]
+        for _, _, delivered in outcomes:
+            responses.extend(delivered)
+        return responses
+
+    @staticmethod
+    def _command_arguments(event: AstrMessageEvent, *command: str):
+        """Return every token after ``command`` in the raw message, or None for other messages."""
+        tokens = [token for token in re.split(r"[\s,，]+", event.message_str.strip().lstrip("/")) if token]
+        if tokens[: len(command)] != list(command):
+            return None
+        return tokens[len(command) :]
 
     @ebooks.command("download")
     async def download_all_platforms(self, event: AstrMessageEvent, arg1: str = None, arg2: str = None):
@@ -314,46 +573,138 @@ class ebooks(Star):
             yield event.plain_result("[ebooks] 请提供有效的下载链接、ID 或参数！")
             return
 
+        tokens = self._command_arguments(event, "ebooks", "download") or [arg for arg in (arg1, arg2) if arg]
+        items = classify_download_identifiers(tokens)
+        if len(items) > MAX_BATCH_DOWNLOADS:
+            yield event.plain_result(f"[ebooks] 一次最多批量下载 {MAX_BATCH_DOWNLOADS} 本电子书。")
+            return
+
+        if len(items) > 1:
+            runner = lambda progress: self._download_batch(event, items)
+            description = f"批量下载 {len(items)} 本电子书"
+        else:
+            runner = lambda progress: self._download_by_identifier(event, arg1, arg2, progress=progress)
+            description = " ".join(arg for arg in (arg1, arg2) if arg)
+
+        async for response in self._run_download(event, description, runner):
+            yield response
+
+    async def _run_download(self, event: AstrMessageEvent, description: str, runner):
+        """Run ``runner(progress)`` now, or as a background job when download jobs are enabled."""
+        if self.config.get("enable_download_jobs", False):
+            job = self.download_jobs.submit(
+                owner=event.get_sender_id(),
+                origin=event.unified_msg_origin,
+                description=description,
+                runner=runner,
+            )
+            yield event.plain_result(
+                f"[ebooks] 已创建下载任务 {job.id}，完成后会自动发送文件。使用 /ebooks jobs 查看任务进度。"
+            )
+            return
+
         try:
-            if arg1 and arg2:
-                logger.info("[ebooks] 检测到 Z-Library ID 和 Hash，开始下载...")
-                async for result in self.download_zlib(event, arg1, arg2):
-                    yield result
-                return
+            for result in await runner(None):
+                yield result
+        except Exception:
+            yield event.plain_result(f"[ebooks] 下载电子书时发生错误，请稍后再试。")
 
-            if is_valid_calibre_book_url(arg1):
-                logger.info("[ebooks] 检测到 Calibre-Web 链接，开始下载...")
-                async for result in self.download_calibre(event, arg1):
-                    yield result
-                return
+    @ebooks.command("get")
+    async def download_listed_book(self, event: AstrMessageEvent, index: str = ""):
+        listing = self.listed_results.get(event.unified_msg_origin)
+        if listing is None:
+            yield event.plain_result("[ebooks] 当前会话没有可用的搜索结果，请先搜索电子书。")
+            return
+        if not str(index).isdigit() or int(index) not in listing:
+            yield event.plain_result(
+                f"[ebooks] 请提供上一次搜索结果中的序号（{min(listing)}-{max(listing)}），例如：/ebooks get {min(listing)}"
+            )
+            return
 
-            if is_valid_archive_book_url(arg1):
-                logger.info("[ebooks] 检测到 archive.org 链接，开始下载...")
-                async for result in self.download_archive(event, arg1):
-                    yield result
-                return
+        entry = listing[int(index)]
+        description = f"{index}. {entry[0].title or ' '.join(entry[0].download)}"
+        async for response in self._run_download(
+            event, description, lambda progress: self._download_entry(event, entry, progress)
+        ):
+            yield response
 
-            if is_valid_liber3_book_id(arg1):
-                logger.info("[ebooks] ⏳ 检测到 Liber3 ID，开始下载...")
-                async for result in self.download_liber3(event, arg1):
-                    yield result
+    async def _download_entry(self, event: AstrMessageEvent, records: list[BookRecord], progress=None):
+        """Download a listed book from its platforms in rank order, stopping at the first file."""
+        results = []
+        for record in records:
+            logger.info(f"[ebooks] ⏳ 通过 {record.source} 下载：{' '.join(record.download)}")
+            results = await self._download_item(event, record.platform, record.download, progress=progress)
+            if contains_file(results):
+                return results
+        return results
+
+    @ebooks.command("jobs")
+    async def manage_download_jobs(self, event: AstrMessageEvent, action: str = "", job_id: str = ""):
+        if action == "cancel":
+            job = self.download_jobs.get(job_id)
+            if job is None or job.origin != event.unified_msg_origin:
+                yield event.plain_result(f"[ebooks] 未找到任务 {job_id}。")
+                return
+            if job.owner != event.get_sender_id() and not event.is_admin():
+                yield event.plain_result("[ebooks] 只能取消自己创建的任务。")
                 return
+            if self.download_jobs.cancel(job_id):
+                yield event.plain_result(f"[ebooks] 已取消任务 {job_id}。")
+            else:
+                yield event.plain_result(f"[ebooks] 任务 {job_id} 已结束，无法取消。")
+            return
+
+        if action:
+            yield event.plain_result("[ebooks] 用法：/ebooks jobs 或 /ebooks jobs cancel <任务ID>")
+            return
 
-            if is_valid_annas_book_id(arg1):
-                logger.info("[ebooks] ⏳ 检测到 Annas Archive ID，开始下载...")
-                async for result in self.download_annas(event, arg1):
-                    yield result
+        jobs = self.download_jobs.jobs(event.unified_msg_origin)
+        if not jobs:
+            yield event.plain_result("[ebooks] 当前会话没有下载任务。")
+            return
+        yield event.plain_result("[ebooks] 下载任务：\n" + "\n".join(job.summary() for job in jobs))
+
+    @permission_type(PermissionType.ADMIN)
+    @ebooks.command("stats")
+    async def show_stats(self, event: AstrMessageEvent, action: str = ""):
+        if action == "reset":
+            metrics.reset()
+            hedging.reset()
+            limiter.reset()
+            proxies.reset()
+            if self.watchdog:
+                self.watchdog.reset()
+            yield event.plain_result("[ebooks] 已重置统计数据。")
+            return
+
+        if action == "dump":
+            path = os.path.abspath(self.config.get("metrics_dump_path", "") or "data/ebooks_metrics.prom")
+            try:
+                temp_path = path + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    f.write(metrics.prometheus_text())
+                os.replace(temp_path, path)
+            except OSError as e:
+                logger.error(f"[ebooks] 写入统计数据失败: {e}")
+                yield event.plain_result(f"[ebooks] 写入统计数据失败：{e}")
                 return
+            yield event.plain_result(f"[ebooks] 已将 Prometheus 格式的统计数据写入 {path}")
+            return
 
-            yield event.plain_result(
-                "[ebooks] 未识别的输入格式，请提供以下格式之一：\n"
-                "- Calibre-Web 下载链接\n"
-                "- archive.org 下载链接\n"
-                "- Liber3/Annas Archive 32位 ID\n"
-                "- Z-Library 的 ID 和 Hash"
-            )
-        except Exception:
-            yield event.plain_result(f"[ebooks] 下载电子书时发生错误，请稍后再试。")
+        if action:
+            yield event.plain_result("[ebooks] 用法：/ebooks stats [reset|dump]")
+            return
+
+        lines = metrics.summary_lines() + hedging.summary_lines() + limiter.summary_lines() + proxies.summary_lines()
+        if self.watchdog:
+            lines += self.watchdog.summary_lines()
+        if not lines:
+            yield event.plain_result("[ebooks] 暂无统计数据。")
+            return
+        since = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(metrics.started_at))
+        cache = self.download_cache
+        lines.append(f"下载缓存: {len(cache)} 个文件，{cache.total_bytes / 1048576:.1f} MB")
+        yield event.plain_result(f"[ebooks] 自 {since} 起的统计：\n" + "\n".join(lines))
 
     @llm_tool("search_ebooks")
     async def search_ebooks(self, event: AstrMessageEvent, query: str):
@@ -386,3 +737,17 @@ class ebooks(Star):
         """
         async for result in self.download_all_platforms(event, arg1, arg2):
             yield result
+
+    @llm_tool("download_ebook_by_index")
+    async def download_ebook_by_index(self, event: AstrMessageEvent, index: int):
+        """Download an eBook from the most recent search results by its number.
+
+        When to use:
+            After a search, each listed book is numbered. Prefer this method over download_ebook when the user
+            refers to a book from the last search results, since it does not require copying IDs, hashes or URLs.
+
+        Args:
+            index (number): The number shown before the book title in the last search results.
+        """
+        async for result in self.download_listed_book(event, str(index)):
+            yield result
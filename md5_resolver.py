@@ -0,0 +1,91 @@
+import asyncio
+import re
+from typing import Any, Awaitable, Callable, Optional
+
+from astrbot.api.all import File, logger
+
+IPFS_CID_PATTERN = re.compile(r"/ipfs/([A-Za-z0-9]{46,})")
+
+DownloadPlan = tuple[str, Callable[..., Awaitable[list]]]
+
+
+def contains_file(results: list) -> bool:
+    return any(isinstance(component, File) for result in results for component in result.chain)
+
+
+class Md5Resolver:
+    """Deliver a book identified by its md5 from whichever platform answers first.
+
+    Liber3 IDs and Anna's Archive IDs are both md5 content hashes. Each
+    platform that can serve a hash directly is asked concurrently for a
+    download plan; plans are tried in the order they resolve, falling back
+    to the next one when a transfer fails.
+    """
+
+    def __init__(self, config, get_source: Callable[[str], Any]):
+        self.config = config
+        # sources are built on first use, and only for the platforms asked
+        self.get_source = get_source
+
+    @property
+    def liber3_source(self):
+        return self.get_source("liber3")
+
+    @property
+    def annas_source(self):
+        return self.get_source("annas")
+
+    async def _via_liber3(self, md5: str) -> Optional[DownloadPlan]:
+        if not self.config.get("enable_liber3", False):
+            return None
+        details = await self.liber3_source._get_liber3_book_details([md5])
+        book_info = (details or {}).get(md5, {}).get("book", {})
+        ipfs_cid = book_info.get("ipfs_cid")
+        extension = book_info.get("extension")
+        if not ipfs_cid or not extension:
+            return None
+        file_name = f"{book_info.get('title', 'unknown_book').replace(' ', '_')}.{extension}"
+        return "Liber3", lambda event, progress: self.liber3_source.download_cid(
+            event, ipfs_cid, file_name, progress=progress
+        )
+
+    async def _via_annas(self, md5: str) -> Optional[DownloadPlan]:
+        if not self.config.get("enable_annas", False):
+            return None
+        book_info = await self.annas_source._get_information(md5)
+        for url in book_info.urls:
+            match = IPFS_CID_PATTERN.search(url.url)
+            if match:
+                extension = book_info.file_info.extension if book_info.file_info else "pdf"
+                file_name = f"{book_info.title.replace(' ', '_')}.{extension}"
+                return "Anna's Archive (IPFS)", lambda event, progress: self.liber3_source.download_cid(
+                    event, match.group(1), file_name, progress=progress
+                )
+        return None
+
+    async def download(self, event, md5: str, progress=None) -> Optional[list]:
+        """Return event results carrying the file, or None when no platform could deliver it."""
+        md5 = md5.lower()
+        lookups = [
+            asyncio.create_task(lookup(md5))
+            for lookup in (self._via_liber3, self._via_annas)
+        ]
+        try:
+            for next_plan in asyncio.as_completed(lookups):
+                try:
+                    plan = await next_plan
+                except Exception as e:
+                    logger.debug(f"[ebooks] md5 {md5} 查询失败: {e}")
+                    continue
+                if not plan:
+                    continue
+                platform, fetch = plan
+                logger.info(f"[ebooks] md5 {md5} 由 {platform} 最先响应，开始下载")
+                results = await fetch(event, progress)
+                if contains_file(results):
+                    return results
+                logger.info(f"[ebooks] md5 {md5} 通过 {platform} 下载失败，尝试下一个来源")
+            return None
+        finally:
+            for lookup in lookups:
+                lookup.cancel()
@@ -0,0 +1,204 @@
+import asyncio
+import bisect
+import math
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from data.plugins.astrbot_plugin_ebooks.tracing import tracer
+
+STAGES = ("warmup", "probe", "login", "search", "detail", "cover", "render", "download")
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LATENCY_SAMPLES = 1024
+
+
+class StageMetrics:
+    """Counters for one (source, stage) pair."""
+
+    __slots__ = ("requests", "errors", "bytes", "cache_hits", "cache_misses", "buckets", "latency_sum", "samples")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.samples: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def observe(self, seconds: float, error: bool = False):
+        self.requests += 1
+        if error:
+            self.errors += 1
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.latency_sum += seconds
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Nearest-rank percentile over the most recent ``LATENCY_SAMPLES`` observations."""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+    @property
+    def hit_ratio(self) -> Optional[float]:
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else None
+
+
+class Timer:
+    """Time a block and record it on exit; exceptions and ``fail()`` count as errors.
+
+    Inside a trace the block is also recorded as a ``source/stage`` span.
+    """
+
+    __slots__ = ("registry", "source", "stage", "started", "error", "bytes", "span")
+
+    def __init__(self, registry: "MetricsRegistry", source: str, stage: str):
+        self.registry = registry
+        self.source = source
+        self.stage = stage
+        self.error = False
+        self.bytes = 0
+
+    def fail(self):
+        self.error = True
+
+    def __enter__(self) -> "Timer":
+        self.span = tracer.span(f"{self.source}/{self.stage}")
+        self.span.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        cancelled = exc_type is not None and issubclass(exc_type, asyncio.CancelledError)
+        self.registry.observe(
+            self.source,
+            self.stage,
+            time.perf_counter() - self.started,
+            error=self.error or (exc_type is not None and not cancelled),
+            nbytes=self.bytes,
+        )
+        if self.error:
+            self.span.fail()
+        self.span.__exit__(exc_type, exc, tb)
+        return False
+
+
+class MetricsRegistry:
+    """In-process metrics keyed by source (platform name or host) and stage.
+
+    Everything is plain counters, so recording costs a dict lookup and a
+    few additions. Some are recorded from worker threads (the Z-Library
+    login runs in ``asyncio.to_thread``), so updates and reads hold a lock;
+    uncontended, it adds well under a microsecond.
+    """
+
+    def __init__(self):
+        self._stages: dict[tuple[str, str], StageMetrics] = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def stage(self, source: str, stage: str) -> StageMetrics:
+        # callers hold _lock
+        key = (source, stage)
+        metrics = self._stages.get(key)
+        if metrics is None:
+            metrics = self._stages[key] = StageMetrics()
+        return metrics
+
+    def timer(self, source: str, stage: str) -> Timer:
+        return Timer(self, source, stage)
+
+    def observe(self, source: str, stage: str, seconds: float, error: bool = False, nbytes: int = 0):
+        with self._lock:
+            metrics = self.stage(source, stage)
+            metrics.observe(seconds, error)
+            metrics.bytes += nbytes
+
+    def cache_hit(self, source: str, stage: str):
+        with self._lock:
+            self.stage(source, stage).cache_hits += 1
+
+    def cache_miss(self, source: str, stage: str):
+        with self._lock:
+            self.stage(source, stage).cache_misses += 1
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self.started_at = time.time()
+
+    def items(self) -> list[tuple[tuple[str, str], StageMetrics]]:
+        # callers hold _lock
+        order = {stage: index for index, stage in enumerate(STAGES)}
+        return sorted(self._stages.items(), key=lambda item: (item[0][0], order.get(item[0][1], len(order))))
+
+    def summary_lines(self) -> list[str]:
+        with self._lock:
+            return self._summary_lines()
+
+    def _summary_lines(self) -> list[str]:
+        lines = []
+        for (source, stage), metrics in self.items():
+            parts = [f"{source}/{stage}: {metrics.requests} 次"]
+            if metrics.requests:
+                parts.append(f"失败 {metrics.errors}")
+                p50, p95, p99 = (metrics.percentile(q) for q in (50, 95, 99))
+                parts.append(f"p50/p95/p99 {p50 * 1000:.0f}/{p95 * 1000:.0f}/{p99 * 1000:.0f} ms")
+            if metrics.bytes:
+                parts.append(_format_bytes(metrics.bytes))
+            if metrics.hit_ratio is not None:
+                parts.append(f"缓存命中 {metrics.hit_ratio:.0%} ({metrics.cache_hits}/{metrics.cache_hits + metrics.cache_misses})")
+            lines.append("，".join(parts))
+        return lines
+
+    def prometheus_text(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        with self._lock:
+            return self._prometheus_text()
+
+    def _prometheus_text(self) -> str:
+        families = {
+            "ebooks_requests_total": ("counter", "Requests per source and stage.", lambda m: m.requests),
+            "ebooks_errors_total": ("counter", "Failed requests per source and stage.", lambda m: m.errors),
+            "ebooks_bytes_total": ("counter", "Bytes transferred per source and stage.", lambda m: m.bytes),
+            "ebooks_cache_hits_total": ("counter", "Cache hits per source and stage.", lambda m: m.cache_hits),
+            "ebooks_cache_misses_total": ("counter", "Cache misses per source and stage.", lambda m: m.cache_misses),
+        }
+        items = self.items()
+        lines = []
+        for name, (kind, help_text, value) in families.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{{{_labels(source, stage)}}} {value(m)}" for (source, stage), m in items]
+
+        lines += [
+            "# HELP ebooks_latency_seconds Request latency per source and stage.",
+            "# TYPE ebooks_latency_seconds histogram",
+        ]
+        for (source, stage), metrics in items:
+            labels = _labels(source, stage)
+            cumulative = 0
+            for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), metrics.buckets):
+                cumulative += count
+                lines.append(f'ebooks_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"ebooks_latency_seconds_sum{{{labels}}} {metrics.latency_sum}")
+            lines.append(f"ebooks_latency_seconds_count{{{labels}}} {metrics.requests}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_bytes(size: int) -> str:
+    if size < 1048576:
+        return f"{size / 1024:.1f} KB"
+    return f"{size / 1048576:.1f} MB"
+
+
+def _labels(source: str, stage: str) -> str:
+    source = source.replace("\\", "\\\\").replace('"', '\\"')
+    return f'source="{source}",stage="{stage}"'
+
+
+metrics = MetricsRegistry()
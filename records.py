@@ -0,0 +1,180 @@
+import asyncio
+from typing import Optional
+
+from astrbot.api.all import Plain, Image, Node
+
+from data.plugins.astrbot_plugin_ebooks.metrics import metrics
+from data.plugins.astrbot_plugin_ebooks.utils import download_and_convert_to_base64, is_base64_image
+
+PLATFORM_NAMES = {
+    "calibre": "Calibre-Web",
+    "archive": "archive.org",
+    "liber3": "Liber3",
+    "annas": "Anna's Archive",
+    "zlib": "Z-Library",
+}
+UNKNOWN_VALUES = {"", "未知", "unknown", "none", "null", "无简介", "无描述"}
+DESCRIPTION_LENGTH = 150
+
+
+def is_unknown(value) -> bool:
+    return value is None or str(value).strip().lower() in UNKNOWN_VALUES
+
+
+class BookRecord:
+    """One search result, in the same shape whichever platform produced it.
+
+    ``download`` holds the arguments ``/ebooks download`` takes for the book
+    on ``platform``, e.g. ``("L<md5>",)`` or ``("<id>", "<hash>")``.
+    Missing metadata is stored as an empty string.
+    """
+
+    __slots__ = (
+        "platform",
+        "download",
+        "title",
+        "authors",
+        "year",
+        "publisher",
+        "language",
+        "extension",
+        "filesize",
+        "description",
+        "cover",
+        "isbn",
+    )
+
+    def __init__(
+        self,
+        platform: str,
+        download: tuple,
+        title,
+        authors="",
+        year="",
+        publisher="",
+        language="",
+        extension="",
+        filesize="",
+        description="",
+        cover="",
+        isbn="",
+    ):
+        self.platform = platform
+        self.download = tuple(str(arg) for arg in download)
+        self.title = _clean(title)
+        self.authors = _clean(authors)
+        self.year = _clean(year)
+        self.publisher = _clean(publisher)
+        self.language = _clean(language)
+        self.extension = _clean(extension).lstrip(".").lower()
+        self.filesize = _clean(filesize)
+        self.description = _clean(description)
+        self.cover = _clean(cover)
+        self.isbn = _clean(isbn)
+
+    @property
+    def source(self) -> str:
+        return PLATFORM_NAMES.get(self.platform, self.platform)
+
+    def __repr__(self) -> str:
+        return f"BookRecord({self.platform}, {' '.join(self.download)}, {self.title!r})"
+
+
+class RecordPage(list):
+    """Records from one search call that read ``pages`` upstream pages, so a cursor can skip past all of them."""
+
+    def __init__(self, records=(), pages: int = 1):
+        super().__init__(records)
+        self.pages = pages
+
+
+def _clean(value) -> str:
+    if isinstance(value, (list, tuple)):
+        value = ", ".join(str(item) for item in value if not is_unknown(item))
+    return "" if is_unknown(value) else str(value).strip()
+
+
+def first_known(records: list[BookRecord], field: str, default: str = "未知") -> str:
+    for record in records:
+        value = getattr(record, field)
+        if value:
+            return value
+    return default
+
+
+def _download_lines(record: BookRecord) -> list[str]:
+    if record.platform == "zlib":
+        book_id, book_hash = record.download
+        return [f"ID(用于下载): {book_id}", f"Hash(用于下载): {book_hash}"]
+    if record.platform in ("calibre", "archive"):
+        return [f"链接(用于下载): {record.download[0]}"]
+    return [f"ID(用于下载): {record.download[0]}"]
+
+
+async def render_node(event, records: list[BookRecord], index: Optional[int] = None) -> Node:
+    """Render one book as a forward node.
+
+    ``records`` are copies of the same book from one or more platforms, best
+    first; metadata is taken from the first record that has it and every
+    platform's download handle is listed. A numbered book can be downloaded
+    with ``/ebooks get <index>``.
+    """
+    title = first_known(records, "title")
+    chain = [Plain(f"{index}. {title}" if index is not None else title)]
+
+    image = None
+    cover_record = next((record for record in records if record.cover), None)
+    if cover_record:
+        with metrics.timer(cover_record.source, "cover") as timer:
+            base64_image = await download_and_convert_to_base64(cover_record.cover)
+            if base64_image and is_base64_image(base64_image):
+                image = Image.fromBase64(base64_image)
+                timer.bytes = len(base64_image) * 3 // 4
+            else:
+                timer.fail()
+    chain.append(image or Plain("\n"))
+
+    lines = [
+        f"作者: {first_known(records, 'authors')}",
+        f"年份: {first_known(records, 'year')}",
+        f"出版社: {first_known(records, 'publisher')}",
+        f"语言: {first_known(records, 'language')}",
+    ]
+    extensions = list(dict.fromkeys(record.extension for record in records if record.extension))
+    if extensions:
+        lines.append(f"格式: {' / '.join(extensions)}")
+    if len(records) == 1 and records[0].filesize:
+        lines.append(f"文件大小: {records[0].filesize}")
+    description = first_known(records, "description", default="无简介")
+    if len(description) > DESCRIPTION_LENGTH:
+        description = description[:DESCRIPTION_LENGTH] + "..."
+    lines.append(f"简介: {description}")
+
+    if len(records) == 1:
+        lines.extend(_download_lines(records[0]))
+        name = records[0].source
+    else:
+        lines.append("下载(用于 /ebooks download):")
+        lines.extend(f"{record.source}: {' '.join(record.download)}" for record in records)
+        name = "ebooks"
+
+    if index is not None:
+        lines.append(f"快捷下载: /ebooks get {index}")
+
+    chain.append(Plain("\n".join(lines)))
+    return Node(uin=event.get_self_id(), name=name, content=chain)
+
+
+async def render_nodes(event, entries: list[list[BookRecord]], start: Optional[int] = None) -> list[Node]:
+    """Render each entry as its own node, fetching covers concurrently.
+
+    With ``start`` the nodes are numbered from it for ``/ebooks get``.
+    """
+    return list(
+        await asyncio.gather(
+            *[
+                render_node(event, entry, None if start is None else start + offset)
+                for offset, entry in enumerate(entries)
+            ]
+        )
+    )
@@ -0,0 +1,108 @@
+import asyncio
+import math
+from typing import Awaitable, Callable, Optional, Union
+
+from astrbot.api.all import logger
+
+from data.plugins.astrbot_plugin_ebooks.records import BookRecord, RecordPage
+from data.plugins.astrbot_plugin_ebooks.search_merge import merge_records
+from data.plugins.astrbot_plugin_ebooks.tracing import tracer
+
+MAX_RESULT_SETS = 256
+MAX_UPSTREAM_PAGES = 10
+MAX_FETCH_ROUNDS = 3
+
+SearchFetch = Callable[[int], Awaitable[Union[list[BookRecord], str]]]
+
+
+class SourceCursor:
+    """Where a search stands on one platform; ``fetch(page)`` returns records or an error message."""
+
+    __slots__ = ("platform", "fetch", "paginated", "next_page", "exhausted")
+
+    def __init__(self, platform: str, fetch: SearchFetch, paginated: bool):
+        self.platform = platform
+        self.fetch = fetch
+        self.paginated = paginated
+        self.next_page = 1
+        self.exhausted = False
+
+
+class ResultSet:
+    """The parsed results of one search, rendered a page at a time.
+
+    Entries are clusters of records for the same book (single records when
+    merging is off). Pages are served from memory; only when a requested page
+    lies past the buffered entries are the platforms that support upstream
+    paging asked for their next page, and new records that were already
+    listed are dropped.
+    """
+
+    def __init__(self, query: str, page_size: int, cursors: list[SourceCursor], merge: bool = True):
+        self.query = query
+        self.page_size = page_size
+        self.cursors = cursors
+        self.merge = merge
+        self.entries: list[list[BookRecord]] = []
+        self.page = 0
+        self._seen: set[tuple[str, tuple]] = set()
+        self._lock = asyncio.Lock()
+
+    @property
+    def page_count(self) -> int:
+        return math.ceil(len(self.entries) / self.page_size)
+
+    @property
+    def has_more_upstream(self) -> bool:
+        return any(not cursor.exhausted for cursor in self.cursors)
+
+    async def _add(self, platform_records: list[list[BookRecord]]):
+        fresh = []
+        for records in platform_records:
+            records = [record for record in records if (record.platform, record.download) not in self._seen]
+            self._seen.update((record.platform, record.download) for record in records)
+            fresh.append(records)
+        if self.merge:
+            # a few hundred similar titles take tens of milliseconds to cluster, keep that off the loop
+            entries = await asyncio.to_thread(merge_records, fresh)
+        else:
+            entries = [[record] for records in fresh for record in records]
+        self.entries.extend(entries)
+
+    async def fetch_more(self) -> list[str]:
+        """Fetch the next page from every platform that still has one; return their error messages."""
+        async with self._lock:
+            cursors = [cursor for cursor in self.cursors if not cursor.exhausted]
+            results = await asyncio.gather(
+                *[cursor.fetch(cursor.next_page) for cursor in cursors], return_exceptions=True
+            )
+            notes, platform_records = [], []
+            for cursor, result in zip(cursors, results):
+                if isinstance(result, Exception):
+                    logger.warning(f"[ebooks] 获取 {cursor.platform} 第 {cursor.next_page} 页结果失败: {result}")
+                    result = []
+                if isinstance(result, str):
+                    notes.append(result)
+                    result = []
+                # a source that filled its first page from several upstream pages reports how many it read
+                cursor.next_page += result.pages if isinstance(result, RecordPage) else 1
+                cursor.exhausted = (
+                    not result or not cursor.paginated or cursor.next_page > MAX_UPSTREAM_PAGES
+                )
+                platform_records.append(result)
+            with tracer.span("ebooks/merge"):
+                await self._add(platform_records)
+            return notes
+
+    async def get_page(self, page: int) -> Optional[list[list[BookRecord]]]:
+        """Return the entries of a 1-based page, fetching further upstream pages when needed."""
+        rounds = 0
+        while len(self.entries) < page * self.page_size and self.has_more_upstream and rounds < MAX_FETCH_ROUNDS:
+            logger.info(f"[ebooks] 缓存的搜索结果不足第 {page} 页，继续获取“{self.query}”的下一页结果")
+            await self.fetch_more()
+            rounds += 1
+        start = (page - 1) * self.page_size
+        if page < 1 or start >= len(self.entries):
+            return None
+        self.page = page
+        return self.entries[start : start + self.page_size]
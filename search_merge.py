@@ -0,0 +1,173 @@
+import re
+import unicodedata
+from collections import Counter
+from difflib import SequenceMatcher
+
+from data.plugins.astrbot_plugin_ebooks.records import BookRecord, is_unknown
+
+TITLE_SIMILARITY = 0.9
+BLOCK_KEY_LENGTH = 4
+RRF_K = 60
+
+_SEPARATORS = re.compile(r"[^\w]+|_")
+_SUBTITLE = re.compile(r"\s*[:：(（\[【—]|\s-\s")
+_DIGITS = re.compile(r"\d+")
+_AUTHOR_SPLIT = re.compile(r"[,，;；&/、]|\band\b|\s和\s")
+
+
+def normalize_text(text) -> str:
+    """Fold width, case and punctuation, returning words separated by single spaces."""
+    if is_unknown(text):
+        return ""
+    text = unicodedata.normalize("NFKC", str(text)).casefold()
+    return " ".join(_SEPARATORS.sub(" ", text).split())
+
+
+def normalize_title(title) -> str:
+    """Normalize a title without its subtitle, so ``Python Crash Course: A Hands-On...`` is ``Python Crash Course``."""
+    if is_unknown(title):
+        return ""
+    title = unicodedata.normalize("NFKC", str(title)).strip()
+    main_title = _SUBTITLE.split(title, maxsplit=1)[0]
+    return normalize_text(main_title or title).replace(" ", "")
+
+
+def normalize_authors(authors) -> set[str]:
+    if isinstance(authors, (list, tuple)):
+        authors = ",".join(str(author) for author in authors)
+    if is_unknown(authors):
+        return set()
+    authors = unicodedata.normalize("NFKC", str(authors)).casefold()
+    names = set()
+    for name in _AUTHOR_SPLIT.split(authors):
+        names.update(normalize_text(name).split())
+    return names
+
+
+def normalize_isbns(isbn) -> set[str]:
+    """Return the ISBN-13 form of every ISBN found in a string or list."""
+    if isinstance(isbn, (list, tuple)):
+        isbn = " ".join(str(value) for value in isbn)
+    if is_unknown(isbn):
+        return set()
+    isbns = set()
+    for candidate in re.findall(r"[0-9][0-9\-\s]{8,16}[0-9Xx]", str(isbn)):
+        digits = re.sub(r"[^0-9Xx]", "", candidate).upper()
+        if len(digits) == 10:
+            core = "978" + digits[:9]
+            check = (10 - sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(core)) % 10) % 10
+            isbns.add(core + str(check))
+        elif len(digits) == 13 and digits.isdigit():
+            isbns.add(digits)
+    return isbns
+
+
+class _Entry:
+    __slots__ = ("record", "rank", "title", "chars", "digits", "authors", "isbns")
+
+    def __init__(self, record: BookRecord, rank: int):
+        self.record = record
+        self.rank = rank
+        self.title = normalize_title(record.title)
+        self.chars = Counter(self.title)
+        self.digits = _DIGITS.findall(self.title)
+        self.authors = normalize_authors(record.authors)
+        self.isbns = normalize_isbns(record.isbn)
+
+
+def _similar_titles(a: _Entry, b: _Entry) -> bool:
+    """Whether two titles reach ``TITLE_SIMILARITY``, trying cheap upper bounds on the ratio first."""
+    if a.title == b.title:
+        return True
+    total = len(a.title) + len(b.title)
+    # SequenceMatcher.ratio() is at most 2 * shorter / total (real_quick_ratio) ...
+    if 2 * min(len(a.title), len(b.title)) < TITLE_SIMILARITY * total:
+        return False
+    # ... and at most 2 * shared characters / total (quick_ratio, from the precomputed counts)
+    shared = sum(min(count, b.chars[char]) for char, count in a.chars.items() if char in b.chars)
+    if 2 * shared < TITLE_SIMILARITY * total:
+        return False
+    return SequenceMatcher(None, a.title, b.title).ratio() >= TITLE_SIMILARITY
+
+
+def _same_book(a: _Entry, b: _Entry) -> bool:
+    if a.isbns and b.isbns:
+        return bool(a.isbns & b.isbns)
+    if a.record.platform == b.record.platform and a.record.download == b.record.download:
+        return True
+    if not a.title or not b.title:
+        return False
+    # volumes of a series differ only in their number, e.g. "三体1" and "三体2"
+    if a.digits != b.digits:
+        return False
+    if not _similar_titles(a, b):
+        return False
+    if not a.authors or not b.authors:
+        return True
+    if a.authors & b.authors:
+        return True
+    # CJK names are not space separated, e.g. "鲁迅" and "鲁迅著"
+    joined_a, joined_b = "".join(sorted(a.authors)), "".join(sorted(b.authors))
+    return joined_a in joined_b or joined_b in joined_a
+
+
+def merge_records(platform_records: list[list[BookRecord]], limit: int = 0) -> list[list[BookRecord]]:
+    """Cluster duplicate books across platforms and rank the clusters.
+
+    Records are compared only within a block sharing an ISBN or the first
+    characters of the normalized title. Results of one query usually share
+    those characters, so a block can hold most of them; within a block only
+    titles of similar length are paired, and those go through cheap upper
+    bounds before the full similarity ratio. Clusters are ranked by reciprocal rank fusion: a book found
+    near the top of several platforms beats one listed by a single platform.
+    Each cluster is returned as its records in rank order.
+    """
+    entries = [
+        _Entry(record, rank)
+        for records in platform_records
+        for rank, record in enumerate(records)
+    ]
+    parent = list(range(len(entries)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    blocks: dict[str, list[int]] = {}
+    for index, entry in enumerate(entries):
+        keys = {f"isbn:{isbn}" for isbn in entry.isbns}
+        if entry.title:
+            keys.add(f"title:{entry.title[:BLOCK_KEY_LENGTH]}")
+        for key in keys:
+            blocks.setdefault(key, []).append(index)
+
+    for key, members in blocks.items():
+        if key.startswith("isbn:"):
+            # sharing an ISBN settles it
+            for other in members[1:]:
+                parent[find(other)] = find(members[0])
+            continue
+        # titles more than (2 - TITLE_SIMILARITY) / TITLE_SIMILARITY times longer can't be similar enough
+        members.sort(key=lambda index: len(entries[index].title))
+        for i, left in enumerate(members):
+            longest = len(entries[left].title) * (2 - TITLE_SIMILARITY) / TITLE_SIMILARITY
+            for right in members[i + 1 :]:
+                if len(entries[right].title) > longest:
+                    break
+                root_left, root_right = find(left), find(right)
+                if root_left != root_right and _same_book(entries[left], entries[right]):
+                    parent[root_right] = root_left
+
+    clusters: dict[int, list[_Entry]] = {}
+    for index, entry in enumerate(entries):
+        clusters.setdefault(find(index), []).append(entry)
+
+    def score(cluster: list[_Entry]) -> float:
+        return sum(1 / (RRF_K + entry.rank) for entry in cluster)
+
+    ranked = sorted(clusters.values(), key=lambda cluster: (-score(cluster), min(e.rank for e in cluster)))
+    merged = [[entry.record for entry in sorted(cluster, key=lambda e: e.rank)] for cluster in ranked]
+    return merged[:limit] if limit else merged
+
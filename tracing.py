@@ -0,0 +1,143 @@
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+
+from astrbot.api.all import logger
+
+WATERFALL_WIDTH = 30
+MAX_WATERFALL_LINES = 40
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("ebooks_current_span", default=None)
+
+
+class _NoopSpan:
+    """Returned when tracing is off or no trace is active, so instrumented code pays almost nothing."""
+
+    __slots__ = ()
+
+    def fail(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("trace", "name", "children", "start", "end", "error", "_token")
+
+    def __init__(self, trace: Optional["Trace"], name: str):
+        self.trace = trace if trace is not None else self
+        self.name = name
+        self.children: list[Span] = []
+        self.start = self.end = 0.0
+        self.error = False
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def fail(self):
+        self.error = True
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.error = True
+        _current_span.reset(self._token)
+        return False
+
+
+class Trace(Span):
+    """The root span of one user request; logs a waterfall when it is slower than the threshold."""
+
+    __slots__ = ("id", "slow_threshold")
+
+    def __init__(self, name: str, slow_threshold: float):
+        super().__init__(None, name)
+        self.id = uuid.uuid4().hex[:8]
+        self.slow_threshold = slow_threshold
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        if self.duration >= self.slow_threshold:
+            logger.warning(f"[ebooks] trace {self.id} 慢请求 {self.duration:.1f}s：\n" + "\n".join(self.waterfall()))
+        else:
+            logger.debug(f"[ebooks] trace {self.id} {self.name} 用时 {self.duration * 1000:.0f}ms")
+        return False
+
+    def waterfall(self) -> list[str]:
+        """One line per span, with siblings of the same name folded into one line."""
+        total = max(self.duration, 1e-6)
+        lines = []
+
+        def bar(start: float, end: float) -> str:
+            offset = int((start - self.start) / total * WATERFALL_WIDTH)
+            width = max(1, int((end - start) / total * WATERFALL_WIDTH))
+            return (" " * offset + "█" * width).ljust(WATERFALL_WIDTH)
+
+        def walk(spans: list[Span], depth: int):
+            groups: dict[str, list[Span]] = {}
+            for span in spans:
+                groups.setdefault(span.name, []).append(span)
+            for name, group in sorted(groups.items(), key=lambda item: min(span.start for span in item[1])):
+                if len(lines) >= MAX_WATERFALL_LINES:
+                    return
+                start = min(span.start for span in group)
+                end = max(span.end or span.start for span in group)
+                errors = sum(1 for span in group if span.error)
+                label = name if len(group) == 1 else f"{name} ×{len(group)} (最长 {max(s.duration for s in group) * 1000:.0f}ms)"
+                if errors:
+                    label += f" 失败 {errors}"
+                lines.append(
+                    f"{(start - self.start) * 1000:7.0f}ms {(end - start) * 1000:7.0f}ms |{bar(start, end)}| "
+                    f"{'  ' * depth}{label}"
+                )
+                walk([child for span in group for child in span.children], depth + 1)
+
+        walk([self], 0)
+        return lines
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.slow_threshold = 5.0
+
+    def configure(self, enabled: bool, slow_threshold_ms: int):
+        self.enabled = enabled
+        self.slow_threshold = max(0, slow_threshold_ms) / 1000
+
+    def trace(self, name: str):
+        """Start a trace for one request; a no-op when tracing is disabled or a trace is already active."""
+        if not self.enabled or _current_span.get() is not None:
+            return NOOP_SPAN
+        return Trace(name, self.slow_threshold)
+
+    def span(self, name: str):
+        parent = _current_span.get()
+        if parent is None:
+            return NOOP_SPAN
+        span = Span(parent.trace, name)
+        parent.children.append(span)
+        return span
+
+
+def trace_tag() -> str:
+    """Return `` trace=<id>`` for log lines written inside a trace, otherwise an empty string."""
+    span = _current_span.get()
+    return f" trace={span.trace.id}" if span is not None else ""
+
+
+tracer = Tracer()
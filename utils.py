@@ -1,66 +1,93 @@
+import asyncio
 import base64
 import io
 import os
 import re
-from typing import Union
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Optional, Union
+from urllib.parse import unquote, urlparse
 
 import aiohttp
 from astrbot.api.all import Node, Nodes
-from PIL import Image as Img
-from aiohttp import ClientPayloadError
-from bs4 import BeautifulSoup
 
+from data.plugins.astrbot_plugin_ebooks.http_client import get_session, proxies, request
+from data.plugins.astrbot_plugin_ebooks.metrics import metrics
 
-async def is_url_accessible(url: str, proxy: str = None) -> bool:
-    """Check whether a URL is reachable with a short HEAD request."""
-    try:
-        async with aiohttp.ClientSession() as session:
+_reachable_urls: dict[str, float] = {}
+REACHABILITY_TTL = 30
+COVER_TIMEOUT = 8
+
+
+async def is_url_accessible(url: str) -> bool:
+    """Check whether a URL is reachable with a short HEAD request.
+
+    Successful probes are remembered for ``REACHABILITY_TTL`` seconds so
+    bursts of requests to the same platform don't each pay a round trip.
+    """
+    host = urlparse(url).netloc
+    if _reachable_urls.get(url, 0) > time.monotonic():
+        metrics.cache_hit(host, "probe")
+        return True
+    metrics.cache_miss(host, "probe")
+    proxy = proxies.choose(url)
+    started = time.monotonic()
+    with metrics.timer(host, "probe") as timer:
+        try:
+            session = await get_session()
             async with session.head(
                 url,
                 timeout=5,
                 proxy=proxy,
                 allow_redirects=True,
             ) as response:
-                return response.status == 200
+                proxies.record(url, proxy, time.monotonic() - started)
+                if response.status == 200:
+                    _reachable_urls[url] = time.monotonic() + REACHABILITY_TTL
+                    return True
+                timer.fail()
+                return False
+        except Exception:
+            proxies.record(url, proxy, None)
+            timer.fail()
+            return False
+
+
+async def download_and_convert_to_base64(cover_url: str):
+    """Fetch an image and convert it to base64 (handles HTML indirection).
+
+    A cover is not worth holding up the search reply: a throttled host is not
+    retried and the whole fetch gets ``COVER_TIMEOUT`` seconds, after which
+    the book is listed without one.
+    """
+    try:
+        return await asyncio.wait_for(_fetch_cover(cover_url), COVER_TIMEOUT)
     except Exception:
-        return False
+        return None
 
 
-async def download_and_convert_to_base64(cover_url: str, proxy: str = None):
-    """Fetch an image and convert it to base64 (handles HTML indirection)."""
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(cover_url, proxy=proxy) as response:
-                if response.status != 200:
-                    return None
-
-                content_type = response.headers.get("Content-Type", "").lower()
-                if "html" in content_type:
-                    html_content = await response.text()
-                    soup = BeautifulSoup(html_content, "html.parser")
-                    img_tag = soup.find("meta", attrs={"property": "og:image"})
-                    if img_tag:
-                        return await download_and_convert_to_base64(
-                            img_tag.get("content"),
-                            proxy=proxy,
-                        )
-                    return None
-
-                content = await response.read()
-                base64_data = base64.b64encode(content).decode("utf-8")
-                return base64_data
-    except ClientPayloadError:
-        if "content" in locals():
-            base64_data = base64.b64encode(content).decode("utf-8")
-            if is_base64_image(base64_data):
-                return base64_data
+async def _fetch_cover(cover_url: str) -> Optional[str]:
+    response = await request("GET", cover_url, max_retries=0)
+    if response.status != 200:
         return None
-    except Exception:
+
+    content_type = response.headers.get("Content-Type", "").lower()
+    if "html" in content_type:
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(response.text(), "html.parser")
+        img_tag = soup.find("meta", attrs={"property": "og:image"})
+        if img_tag:
+            return await _fetch_cover(img_tag.get("content"))
         return None
 
+    return base64.b64encode(response.body).decode("utf-8")
+
 
 def is_base64_image(base64_data: str) -> bool:
     """Validate that the base64 data represents an image."""
+    from PIL import Image as Img
+
     try:
         image_data = base64.b64decode(base64_data)
         image = Img.open(io.BytesIO(image_data))
@@ -79,6 +106,19 @@ def truncate_filename(filename: str, max_length: int = 100):
     return filename
 
 
+def extract_filename(content_disposition: str) -> Optional[str]:
+    """Extract the file name from a Content-Disposition header."""
+    if not content_disposition:
+        return None
+    book_name_match = re.search(r'filename\*=(?:UTF-8\'\')?([^;]+)', content_disposition)
+    if book_name_match:
+        return unquote(book_name_match.group(1))
+    book_name_match = re.search(r'filename=["\']?([^;\']+)["\']?', content_disposition)
+    if book_name_match:
+        return book_name_match.group(1)
+    return None
+
+
 def is_valid_calibre_book_url(book_url: str) -> bool:
     """检测电子书下载链接格式是否合法"""
     if not book_url:
@@ -100,6 +140,8 @@ def is_html(content):
 
 def parse_html_to_text(html_content: str):
     """Parse HTML content into plain text."""
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(html_content, "html.parser")
     return soup.get_text().strip()
 
@@ -141,25 +183,143 @@ def is_valid_archive_book_url(book_url: str) -> bool:
     """检测 archive.org 下载链接格式是否合法"""
     if not book_url:
         return False
-    pattern = re.compile(r"^https://archive\\.org/download/[^/]+/[^/]+$")
+    pattern = re.compile(r"^https://archive\.org/download/[^/]+/[^/]+$")
     return bool(pattern.match(book_url))
 
 
-class SharedSession:
-    """Provide a reusable aiohttp session per source."""
+_MISSING = object()
+
+
+class TTLCache:
+    """A bounded LRU mapping whose entries expire ``ttl`` seconds after insertion."""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 1800):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class LatencyRanker:
+    """Rank endpoints by rolling (EWMA) latency, penalising recent failures."""
+
+    def __init__(
+        self,
+        endpoints: Iterable[str],
+        alpha: float = 0.3,
+        max_age: float = 300,
+        failure_penalty: float = 30.0,
+    ):
+        self.endpoints = list(endpoints)
+        self.alpha = alpha
+        self.max_age = max_age
+        self.failure_penalty = failure_penalty
+        self._latency: dict[str, float] = {}
+        self._failures: dict[str, int] = {}
+        self._updated: dict[str, float] = {}
+
+    def record_success(self, endpoint: str, latency: float):
+        previous = self._latency.get(endpoint)
+        if previous is None:
+            self._latency[endpoint] = latency
+        else:
+            self._latency[endpoint] = self.alpha * latency + (1 - self.alpha) * previous
+        self._failures[endpoint] = 0
+        self._updated[endpoint] = time.monotonic()
+
+    def record_failure(self, endpoint: str):
+        self._failures[endpoint] = self._failures.get(endpoint, 0) + 1
+        self._updated[endpoint] = time.monotonic()
+
+    def latency(self, endpoint: str) -> Optional[float]:
+        return self._latency.get(endpoint)
+
+    def failures(self, endpoint: str) -> int:
+        return self._failures.get(endpoint, 0)
+
+    def score(self, endpoint: str) -> float:
+        latency = self._latency.get(endpoint, self.failure_penalty / 2)
+        return latency + self._failures.get(endpoint, 0) * self.failure_penalty
+
+    def ranked(self) -> list[str]:
+        return sorted(self.endpoints, key=self.score)
+
+    def best(self) -> Optional[str]:
+        """Return the top endpoint if it was measured healthy recently, else None."""
+        now = time.monotonic()
+        for endpoint in self.ranked():
+            updated = self._updated.get(endpoint)
+            if updated is None or now - updated > self.max_age:
+                continue
+            if self._failures.get(endpoint, 0) == 0 and endpoint in self._latency:
+                return endpoint
+            return None
+        return None
+
+
+def classify_download_identifiers(tokens: list[str]) -> list[tuple[str, tuple]]:
+    """Group raw identifiers into ``(platform, args)`` pairs using the validators above.
+
+    A Z-Library ID directly followed by its hash forms one item; anything
+    unrecognised is returned with the platform ``"unknown"``.
+    """
+    items = []
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        next_token = tokens[index + 1] if index + 1 < len(tokens) else None
+        if is_valid_zlib_book_id(token) and is_valid_zlib_book_hash(next_token):
+            items.append(("zlib", (token, next_token)))
+            index += 2
+            continue
+        if is_valid_calibre_book_url(token):
+            items.append(("calibre", (token,)))
+        elif is_valid_archive_book_url(token):
+            items.append(("archive", (token,)))
+        elif is_valid_liber3_book_id(token):
+            items.append(("liber3", (token,)))
+        elif is_valid_annas_book_id(token):
+            items.append(("annas", (token,)))
+        else:
+            items.append(("unknown", (token,)))
+        index += 1
+    return items
+
 
-    def __init__(self, proxy: str = None):
-        self.proxy = proxy
-        self._session: aiohttp.ClientSession = None
+class SharedSession:
+    """Give a source the plugin-wide aiohttp session, so all platforms share one connection pool."""
 
     async def get_session(self) -> aiohttp.ClientSession:
-        if self._session is None or self._session.closed:
-            self._session = aiohttp.ClientSession()
-        return self._session
+        return await get_session()
 
     async def close_session(self):
-        if self._session and not self._session.closed:
-            await self._session.close()
+        """The session outlives any one source; the plugin closes it with ``http_client.close_session``."""
 
 
 def to_event_results(event, platform_name: str, results, chunk_size: int = 30):
@@ -0,0 +1,94 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+from astrbot.api.all import logger
+
+from data.plugins.astrbot_plugin_ebooks.metrics import metrics
+
+WarmupTargets = Callable[[], dict[str, Callable[[], Awaitable[bool]]]]
+
+
+class ConnectionWarmer:
+    """Open connections to the upstreams in the background and keep them open.
+
+    ``targets`` returns a name (platform or host) for each upstream mapped to
+    a coroutine function making one cheap request over the connection pool
+    searches will use. It is called again every round, so platforms enabled
+    later are picked up. Rounds repeat every ``interval`` seconds; with an
+    interval of 0 the upstreams are only warmed once, after start-up.
+
+    Keepalive pauses once nobody has searched or downloaded for
+    ``idle_timeout`` seconds (0 keeps it going), and ``touch`` resumes it
+    with a fresh round on the next request.
+    """
+
+    def __init__(self, targets: WarmupTargets, interval: float = 45, idle_timeout: float = 1800):
+        self.targets = targets
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.last_active = time.monotonic()
+        self.rounds = 0
+        self._idle = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logger.warning("[ebooks] 事件循环未运行，无法启动连接预热。")
+            return
+        if self._task is None:
+            self._task = loop.create_task(self._run())
+
+    def touch(self):
+        """Note a search or download, resuming keepalive if it was paused for idleness."""
+        self.last_active = time.monotonic()
+        if self._idle:
+            self._idle = False
+            self._task = None
+            logger.debug("[ebooks] 收到新的请求，恢复连接保活。")
+            self.start()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def warm(self) -> dict[str, bool]:
+        """Run one round; returns whether each upstream answered."""
+        targets = self.targets()
+        self.rounds += 1
+        results = await asyncio.gather(*(self._warm_one(name, warm) for name, warm in targets.items()))
+        return dict(zip(targets, results))
+
+    async def _warm_one(self, name: str, warm: Callable[[], Awaitable[bool]]) -> bool:
+        started = time.monotonic()
+        try:
+            ok = bool(await warm())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"[ebooks] 预热 {name} 失败: {e}")
+            ok = False
+        metrics.observe(name, "warmup", time.monotonic() - started, error=not ok)
+        return ok
+
+    async def _run(self):
+        first = self.rounds == 0
+        results = await self.warm()
+        if first:
+            failed = [name for name, ok in results.items() if not ok]
+            logger.info(
+                f"[ebooks] 已预热 {len(results) - len(failed)}/{len(results)} 个上游连接"
+                + (f"，无法连接: {', '.join(failed)}" if failed else "")
+                + "。"
+            )
+        while self.interval > 0:
+            await asyncio.sleep(self.interval)
+            if self.idle_timeout > 0 and time.monotonic() - self.last_active > self.idle_timeout:
+                logger.info(f"[ebooks] {self.idle_timeout / 60:.0f} 分钟内没有搜索或下载，暂停连接保活。")
+                self._idle = True
+                return
+            await self.warm()